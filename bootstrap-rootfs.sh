@@ -69,8 +69,15 @@ archive_rootfs() {
 	local serviced_path="${SCRIPT_DIR}/serviced/serviced.py"
 	if [ -f "$serviced_path" ]; then
 		echo "[*] Injecting serviced.py..."
-		sudo mkdir -p "${2:?}/usr/bin"
-		sudo cp "$serviced_path" "${2}/usr/bin/serviced"
+		# The module lives under /usr/lib/serviced so its bytecode gets cached;
+		# /usr/bin/serviced is only a launcher (scripts are never cached).
+		sudo mkdir -p "${2:?}/usr/bin" "${2}/usr/lib/serviced"
+		sudo cp "$serviced_path" "${2}/usr/lib/serviced/serviced.py"
+		sudo chmod 644 "${2}/usr/lib/serviced/serviced.py"
+		printf '%s\n' '#!/usr/bin/env python3' 'import sys' \
+			'sys.path.insert(0, "/usr/lib/serviced")' \
+			'from serviced import main' 'main()' |
+			sudo tee "${2}/usr/bin/serviced" >/dev/null
 		sudo chmod 755 "${2}/usr/bin/serviced"
 	else
 		echo "[!] Warning: serviced.py not found at $serviced_path"
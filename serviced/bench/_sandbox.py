@@ -0,0 +1,334 @@
+"""
+_sandbox.py - Throw-away unit tree for exercising serviced without root
+
+Builds a self-contained directory with stub daemons for every supported
+Type=, a fake system bus (a Unix socket listener plus a dbus-send
+stand-in that answers NameHasOwner from a names directory) and private
+state/enabled directories.  serviced is loaded as a module and its path
+constants are pointed into the sandbox, so nothing outside it is touched.
+Heavy imports stay inside the functions that need them: the sandbox
+launcher imports this module on every CLI call and is itself measured.
+"""
+
+from __future__ import print_function
+
+import os
+import stat
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICED_DIR = os.path.dirname(HERE)
+
+BUS_NAME_FMT = "org.serviced.Bench%d"
+
+SIMPLE_STUB = """\
+#!/bin/sh
+trap ':' HUP
+trap 'exit 0' TERM INT
+while :; do sleep 1 & wait $!; done
+"""
+
+FORKING_STUB = """\
+#!/bin/sh
+(
+    trap ':' HUP
+    trap 'exit 0' TERM INT
+    while :; do sleep 1 & wait $!; done
+) >/dev/null 2>&1 </dev/null &
+echo $! > "$1"
+"""
+
+ONESHOT_STUB = """\
+#!/bin/sh
+exit 0
+"""
+
+DBUS_STUB = """\
+#!/bin/sh
+NAMEFILE="$SERVICED_BENCH_BUS_DIR/$1"
+trap 'rm -f "$NAMEFILE"; exit 0' TERM INT
+trap ':' HUP
+echo $$ > "$NAMEFILE"
+while :; do sleep 1 & wait $!; done
+"""
+
+FAKE_DBUS_SEND = """\
+#!/bin/sh
+# dbus-send stand-in: only NameHasOwner and ListNames are implemented.
+for arg in "$@"; do last="$arg"; done
+if [ "${last##*.}" = "ListNames" ]; then
+    echo "   array ["
+    for f in "$SERVICED_BENCH_BUS_DIR"/*; do
+        [ -f "$f" ] && kill -0 "$(cat "$f")" 2>/dev/null && echo "      string \\"${f##*/}\\""
+    done
+    echo "   ]"
+    exit 0
+fi
+name="${last#string:}"
+f="$SERVICED_BENCH_BUS_DIR/$name"
+if [ -f "$f" ] && kill -0 "$(cat "$f")" 2>/dev/null; then
+    echo "   boolean true"
+else
+    echo "   boolean false"
+fi
+"""
+
+BUS_STUB = """\
+#!%(python)s
+import os, signal, socket, sys
+path = sys.argv[1]
+try:
+    os.unlink(path)
+except OSError:
+    pass
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+s.bind(path)
+s.listen(64)
+signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+while True:
+    c, _ = s.accept()
+    c.close()
+"""
+
+LAUNCHER = """\
+#!%(python)s
+import sys
+sys.path.insert(0, %(bench_dir)r)
+import _sandbox
+_sandbox.load_serviced(%(root)r).main()
+"""
+
+
+class Sandbox:
+    """A unit tree of stub daemons rooted in a temporary directory.
+
+    `copies` replicates every stub type so start_all_enabled can be
+    measured over larger sets.
+    """
+
+    TYPES = ("simple", "forking", "oneshot", "dbus", "notify")
+
+    def __init__(self, copies=1, root=None):
+        import tempfile
+
+        self.copies = copies
+        self.root = root or tempfile.mkdtemp(prefix="serviced-bench-")
+        self.bin_dir = os.path.join(self.root, "bin")
+        self.unit_dir = os.path.join(self.root, "units")
+        self.state_dir = os.path.join(self.root, "state")
+        self.lib_dir = os.path.join(self.root, "lib")
+        self.run_dir = os.path.join(self.root, "run")
+        self.bus_dir = os.path.join(self.run_dir, "bus-names")
+        self.bus_socket = os.path.join(self.run_dir, "dbus", "system_bus_socket")
+        self.units = {}
+
+    # ---- Build ----
+
+    def build(self):
+        for d in (
+            self.bin_dir,
+            self.unit_dir,
+            self.state_dir,
+            self.lib_dir,
+            self.bus_dir,
+            os.path.dirname(self.bus_socket),
+        ):
+            os.makedirs(d, exist_ok=True)
+        py = {"python": sys.executable}
+        self._script("fake-dbus-send", FAKE_DBUS_SEND, link="dbus-send")
+        self._script("bbus", BUS_STUB % py)
+        self._script(
+            "serviced",
+            LAUNCHER % {"python": sys.executable, "bench_dir": HERE, "root": self.root},
+        )
+        self._unit(
+            "bench-bus.socket",
+            "[Unit]\nDescription=Bench fake system bus socket\n\n"
+            "[Socket]\nListenStream=%s\nService=bench-bus.service\n"
+            % self.bus_socket,
+        )
+        self._unit(
+            "bench-bus.service",
+            "[Unit]\nDescription=Bench fake system bus\n\n"
+            "[Service]\nType=simple\nExecStart=%s %s\n"
+            % (os.path.join(self.bin_dir, "bbus"), self.bus_socket),
+        )
+        for i in range(self.copies):
+            self._add_copy(i)
+        return self
+
+    def _script(self, fname, body, link=None):
+        path = os.path.join(self.bin_dir, fname)
+        with open(path, "w") as f:
+            f.write(body)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+        if link:
+            dst = os.path.join(self.bin_dir, link)
+            if not os.path.lexists(dst):
+                os.symlink(path, dst)
+        return path
+
+    def _unit(self, name, body, stype=None):
+        with open(os.path.join(self.unit_dir, name), "w") as f:
+            f.write(body)
+        if stype:
+            self.units[name] = stype
+
+    def _add_copy(self, i):
+        simple = self._script("bsimple%d" % i, SIMPLE_STUB)
+        self._unit(
+            "bench-simple-%d.service" % i,
+            "[Unit]\nDescription=Bench Type=simple stub\n\n"
+            "[Service]\nType=simple\nExecStartPre=/bin/true\n"
+            "ExecStart=%s\nExecReload=/bin/kill -HUP $MAINPID\n" % simple,
+            "simple",
+        )
+        fork = self._script("bfork%d" % i, FORKING_STUB)
+        pidfile = os.path.join(self.run_dir, "bfork%d.pid" % i)
+        self._unit(
+            "bench-forking-%d.service" % i,
+            "[Unit]\nDescription=Bench Type=forking stub\n\n"
+            "[Service]\nType=forking\nPIDFile=%s\nExecStart=%s %s\n"
+            "ExecReload=/bin/kill -HUP $MAINPID\n" % (pidfile, fork, pidfile),
+            "forking",
+        )
+        oneshot = self._script("boneshot%d" % i, ONESHOT_STUB)
+        self._unit(
+            "bench-oneshot-%d.service" % i,
+            "[Unit]\nDescription=Bench Type=oneshot stub\n\n"
+            "[Service]\nType=oneshot\nRemainAfterExit=yes\nExecStart=%s\n" % oneshot,
+            "oneshot",
+        )
+        dbus = self._script("bdbus%d" % i, DBUS_STUB)
+        self._unit(
+            "bench-dbus-%d.service" % i,
+            "[Unit]\nDescription=Bench Type=dbus stub\n"
+            "Requires=bench-bus.socket\nAfter=bench-bus.socket\n\n"
+            "[Service]\nType=dbus\nBusName=%s\nExecStart=%s %s\n"
+            "ExecReload=/bin/kill -HUP $MAINPID\n"
+            % (BUS_NAME_FMT % i, dbus, BUS_NAME_FMT % i),
+            "dbus",
+        )
+        notify = self._script("bnotify%d" % i, SIMPLE_STUB)
+        self._unit(
+            "bench-notify-%d.service" % i,
+            "[Unit]\nDescription=Bench Type=notify stub\n\n"
+            "[Service]\nType=notify\nExecStart=%s\n"
+            "ExecReload=/bin/kill -HUP $MAINPID\n" % notify,
+            "notify",
+        )
+
+    # ---- Environment ----
+
+    def env(self, base=None):
+        env = dict(os.environ if base is None else base)
+        env["PATH"] = self.bin_dir + os.pathsep + env.get("PATH", "")
+        env["SERVICED_BENCH_BUS_DIR"] = self.bus_dir
+        return env
+
+    def activate(self):
+        """Point this process' environment at the sandbox (fake dbus-send)."""
+        os.environ.update(self.env())
+
+    @property
+    def cli(self):
+        return os.path.join(self.bin_dir, "serviced")
+
+    def enable_all(self):
+        enabled = os.path.join(self.lib_dir, "enabled")
+        os.makedirs(enabled, exist_ok=True)
+        for name in self.units:
+            dst = os.path.join(enabled, name)
+            if not os.path.lexists(dst):
+                os.symlink(os.path.join(self.unit_dir, name), dst)
+
+    # ---- Teardown ----
+
+    def kill_all(self):
+        """SIGKILL every process that still has a pid file in the sandbox."""
+        import signal
+
+        pid_files = []
+        for d in (os.path.join(self.state_dir, "pids"), self.run_dir, self.bus_dir):
+            if os.path.isdir(d):
+                pid_files.extend(
+                    os.path.join(d, f)
+                    for f in os.listdir(d)
+                    if os.path.isfile(os.path.join(d, f))
+                )
+        for path in pid_files:
+            try:
+                with open(path) as f:
+                    pid = int(f.read().strip())
+            except (IOError, OSError, ValueError):
+                continue
+            if pid > 2:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except OSError:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+        time.sleep(0.1)
+
+    def cleanup(self):
+        import shutil
+
+        self.kill_all()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def load_serviced(root):
+    """Import serviced.py with every path constant redirected under `root`."""
+    if SERVICED_DIR not in sys.path:
+        sys.path.insert(0, SERVICED_DIR)
+    import serviced
+
+    state = os.path.join(root, "state")
+    lib = os.path.join(root, "lib")
+    serviced.SYSTEM_UNIT_PATHS = [os.path.join(root, "units")]
+    serviced.USER_UNIT_PATHS = []
+    serviced.STATE_DIR = state
+    serviced.PID_DIR = os.path.join(state, "pids")
+    serviced.LOG_DIR = os.path.join(state, "logs")
+    serviced.STATUS_DIR = os.path.join(state, "status")
+    serviced.BOOT_TIMINGS_FILE = os.path.join(state, "boot-timings.json")
+    serviced.BOOT_PROGRESS_FILE = os.path.join(state, "boot-progress.json")
+    serviced.BOOT_LOG_FILE = os.path.join(state, "boot.log")
+    serviced.CONTROL_SOCKET = os.path.join(state, "control.sock")
+    serviced.DBUS_INDEX_FILE = os.path.join(state, "dbus-activation.index")
+    serviced.METRICS_FILE = os.path.join(state, "metrics.dat")
+    serviced.LOCK_DIR = os.path.join(state, "locks")
+    serviced.FROZEN_DIR = os.path.join(state, "frozen")
+    serviced.SHED_FILE = os.path.join(state, "shed.dat")
+    serviced.DBUS_ACTIVATION_DIRS = [os.path.join(root, "dbus-1", "system-services")]
+    serviced.ENABLED_DIR = os.path.join(lib, "enabled")
+    serviced.ACTION_LOG_FILE = os.path.join(lib, "serviced.log")
+    serviced.SYSTEM_BUS_SOCKET = os.path.join(root, "run", "dbus", "system_bus_socket")
+    os.environ.setdefault("SERVICED_BENCH_BUS_DIR", os.path.join(root, "run", "bus-names"))
+    bin_dir = os.path.join(root, "bin")
+    if not os.environ.get("PATH", "").startswith(bin_dir):
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    return serviced
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples`; 0.0 when there are none."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = int(-(-pct * len(ordered) // 100)) - 1
+    return ordered[max(0, min(len(ordered) - 1, k))]
+
+
+def best_of(n, fn):
+    """Shortest of `n` timed calls of fn(), in seconds."""
+    best = None
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+api.py - In-process query throughput of serviced.Client
+
+Starts the sandbox units (see _sandbox.py) and measures how many status
+queries per second one long-lived Client answers: single-unit status(),
+a batched statuses() round sharing one ProcSnapshot (and optionally a
+D-Bus name set kept between rounds), and units().  Compare with the per-call CLI numbers from lifecycle.py.
+
+    python3 serviced/bench/api.py --copies 10 --seconds 2
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _sandbox  # noqa: E402
+
+
+def rate(fn, seconds):
+    """Calls per second of fn() over about `seconds`, and units answered."""
+    calls = answered = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while time.perf_counter() < deadline:
+        answered += fn()
+        calls += 1
+    elapsed = time.perf_counter() - t0
+    return calls / elapsed, answered / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--copies", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    sb = _sandbox.Sandbox(copies=max(1, args.copies)).build()
+    sb.activate()
+    sd = _sandbox.load_serviced(sb.root)
+    try:
+        client = sd.Client()
+        names = sorted(sb.units)
+        client.start(names, jobs=8)
+        one = "bench-simple-0.service"
+
+        def single():
+            client.status(one)
+            return 1
+
+        def batched():
+            return len(client.statuses(names, proc=client.snapshot()))
+
+        bus = client.bus_names()
+
+        def batched_bus():
+            proc = client.snapshot()
+            return len(client.statuses(names, proc=proc, bus_names=bus))
+
+        def listing():
+            return len(client.units())
+
+        rows = [
+            ("status(one)", rate(single, args.seconds)),
+            ("statuses(%d units)" % len(names), rate(batched, args.seconds)),
+            ("  + shared bus_names", rate(batched_bus, args.seconds)),
+            ("units()", rate(listing, args.seconds)),
+        ]
+        print("%-24s %12s %14s" % ("CALL", "calls/s", "unit states/s"))
+        print("-" * 52)
+        for label, (calls, answered) in rows:
+            print("%-24s %12.0f %14.0f" % (label, calls, answered))
+        client.shutdown(timeout=2.0)
+    finally:
+        sb.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+daemon.py - Query latency through 'serviced daemon' vs in-process
+
+Starts the sandbox units (see _sandbox.py) behind a detached serviced
+daemon and times status of one unit and of every unit three ways: a
+fresh Client per call (what a standalone CLI pays after startup), a
+RemoteClient round trip over the control socket (answered from the
+daemon's memory), and the whole CLI process with and without the daemon.
+
+    python3 serviced/bench/daemon.py -n 200 --copies 4
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _sandbox  # noqa: E402
+
+
+def time_calls(n, fn):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-n", "--iterations", type=int, default=100)
+    parser.add_argument("--copies", type=int, default=4)
+    parser.add_argument("--cli", type=int, default=20, help="CLI runs per mode")
+    args = parser.parse_args()
+
+    sb = _sandbox.Sandbox(copies=max(1, args.copies)).build()
+    sb.activate()
+    sd = _sandbox.load_serviced(sb.root)
+    env = sb.env()
+    # Both CLI modes should run from cached bytecode
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    n = max(1, args.iterations)
+    pid = 0
+    try:
+        subprocess.check_call([sb.cli, "daemon", "--detach"], env=env)
+        remote = sd.RemoteClient.connect()
+        if remote is None:
+            sys.exit("daemon did not answer on %s" % sd.CONTROL_SOCKET)
+        pid = remote.ping()["pid"]
+        names = sorted(sb.units)
+        remote.run("start", names, jobs=8)
+        one = ["bench-simple-0.service"]
+
+        def local(names):
+            return lambda: sd.Client(capture_logs=False).statuses(names)
+
+        def forwarded(names):
+            return lambda: remote.statuses(names)
+
+        def cli(extra_env):
+            e = dict(env, **extra_env)
+            argv = [sb.cli, "status", "bench-simple-0"]
+            return lambda: subprocess.call(
+                argv, env=e, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+
+        rows = [
+            ("Client status(one)", time_calls(n, local(one))),
+            ("daemon status(one)", time_calls(n, forwarded(one))),
+            ("Client status(%d)" % len(names), time_calls(n, local(names))),
+            ("daemon status(%d)" % len(names), time_calls(n, forwarded(names))),
+            ("CLI standalone", time_calls(args.cli, cli({"SERVICED_NO_DAEMON": "1"}))),
+            ("CLI via daemon", time_calls(args.cli, cli({}))),
+        ]
+        print("%-28s %10s %10s %10s" % ("CALL", "p50 ms", "p99 ms", "max ms"))
+        print("-" * 62)
+        for label, samples in rows:
+            print(
+                "%-28s %10.3f %10.3f %10.3f"
+                % (
+                    label,
+                    _sandbox.percentile(samples, 50) * 1e3,
+                    _sandbox.percentile(samples, 99) * 1e3,
+                    max(samples) * 1e3,
+                )
+            )
+        remote.shutdown(timeout=2.0)
+    finally:
+        if pid:
+            os.kill(pid, 15)
+        sb.cleanup()
+
+
+if __name__ == "__main__":
+    main()
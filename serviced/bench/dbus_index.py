@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+dbus_index.py - D-Bus activation file lookup cost
+
+Writes --count activation files shaped like a desktop install's (a tenth
+of them with SystemdService=) and times finding and rewriting the ones
+for one BusName= unit on each start: the full scan serviced did before,
+which reads every file, against BusActivationIndex cold (first run, no
+index file), warm (index loaded from DBUS_INDEX_FILE) and in-process.
+Also checks that only the matching file is rewritten, by rename and with
+its mode kept, and that a file added later is picked up.  Exits non-zero
+when a check fails.
+
+    python3 serviced/bench/dbus_index.py --count 500
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import serviced  # noqa: E402
+
+TEMPLATE = "[D-BUS Service]\nName=org.example.Service%d\nExec=/usr/libexec/svc-%d\n"
+
+
+def write_files(act_dir, count):
+    for i in range(count):
+        with open(os.path.join(act_dir, "org.example.Service%d.service" % i), "w") as f:
+            f.write(TEMPLATE % (i, i))
+            if i % 10 == 0:
+                f.write("User=root\nSystemdService=svc-%d.service\n" % i)
+
+
+def legacy_scan(act_dir, bus_name, name):
+    """The lookup serviced did before: read every file."""
+    found = []
+    for fname in os.listdir(act_dir):
+        if not fname.endswith(".service"):
+            continue
+        fpath = os.path.join(act_dir, fname)
+        with open(fpath) as f:
+            content = f.read()
+        if "SystemdService=" not in content:
+            continue
+        if bus_name in content or name.replace(".service", "") in fname:
+            found.append(fpath)
+    return found
+
+
+def check(tmp):
+    failures = []
+    act_dir = os.path.join(tmp, "check")
+    os.mkdir(act_dir)
+    write_files(act_dir, 30)
+    index_file = os.path.join(tmp, "check.index")
+    target = os.path.join(act_dir, "org.example.Service10.service")
+    other = os.path.join(act_dir, "org.example.Service20.service")
+    os.chmod(target, 0o640)
+    ino = os.stat(target).st_ino
+    index = serviced.BusActivationIndex([act_dir], index_file)
+    found = index.lookup("org.example.Service10", "svc-10.service")
+    if found != [target]:
+        failures.append("lookup: got %r" % found)
+    for fpath in found:
+        index.rewrite(fpath)
+    index.save()
+    with open(target) as f:
+        if "SystemdService=" in f.read():
+            failures.append("target still has SystemdService=")
+    st = os.stat(target)
+    if st.st_ino == ino or st.st_mode & 0o777 != 0o640:
+        failures.append("rewrite not by rename or mode lost")
+    with open(other) as f:
+        if "SystemdService=" not in f.read():
+            failures.append("unrelated file rewritten")
+    index = serviced.BusActivationIndex([act_dir], index_file)
+    if index.lookup("org.example.Service10", "svc-10.service"):
+        failures.append("rewritten file still indexed after reload")
+    with open(os.path.join(act_dir, "org.example.Late.service"), "w") as f:
+        f.write("[D-BUS Service]\nName=org.example.Late\nSystemdService=late.service\n")
+    if len(index.lookup("org.example.Late", "late.service")) != 1:
+        failures.append("file added later not found")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--starts", type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="serviced-dbus-")
+    try:
+        failures = check(tmp)
+        print("checks: %s" % ("ok" if not failures else "FAILED"))
+        for failure in failures:
+            print("FAIL: %s" % failure)
+
+        act_dir = os.path.join(tmp, "bench")
+        os.mkdir(act_dir)
+        write_files(act_dir, args.count)
+        index_file = os.path.join(tmp, "bench.index")
+        bus_name, name = "org.example.Service5", "svc-5.service"
+
+        def per_start(fn):
+            t0 = time.perf_counter()
+            for _ in range(args.starts):
+                fn()
+            return (time.perf_counter() - t0) / args.starts
+
+        def fresh():
+            index = serviced.BusActivationIndex([act_dir], index_file)
+            index.lookup(bus_name, name)
+            index.save()
+
+        rows = [("full scan", per_start(lambda: legacy_scan(act_dir, bus_name, name)))]
+        t0 = time.perf_counter()
+        fresh()
+        rows.append(("index cold", time.perf_counter() - t0))
+        rows.append(("index warm", per_start(fresh)))
+        resident = serviced.BusActivationIndex([act_dir], index_file)
+        rows.append(("in-process", per_start(lambda: resident.lookup(bus_name, name))))
+        print("%d activation files, per start" % args.count)
+        print("%-12s %10s" % ("LOOKUP", "ms"))
+        print("-" * 23)
+        for label, dt in rows:
+            print("%-12s %10.3f" % (label, dt * 1e3))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+envfile.py - EnvironmentFile parsing cases and bulk environment cost
+
+Checks parse_environment_text against systemd's EnvironmentFile rules
+(comments, 'export', single and double quotes, escapes, backslash-newline
+continuations, '=' inside values, trailing whitespace, invalid names) and
+that several EnvironmentFile= lines apply in order.  It then builds the
+environment of --count units that share a handful of /etc/default style
+files the way serviced did before (a full os.environ copy plus a re-read
+of the file per unit) against the cached, layered _build_env.  Exits
+non-zero when a case fails.
+
+    python3 serviced/bench/envfile.py --count 3000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import serviced  # noqa: E402
+
+# (file text, expected variables)
+CASES = (
+    ("A=1\nB=2\n", {"A": "1", "B": "2"}),
+    ("A=1", {"A": "1"}),
+    ("# comment\n; comment\n  A = 1  \n", {"A": "1"}),
+    ("export A=1\nexport  B=2\nexported=3\n", {"A": "1", "B": "2", "exported": "3"}),
+    ("A='x \"y\" $z'\n", {"A": 'x "y" $z'}),
+    ('A="x \\"y\\" \\$z \\n"\n', {"A": 'x "y" $z \\n'}),
+    ("A=one\\\ntwo\n", {"A": "onetwo"}),
+    ('A="one\\\ntwo"\n', {"A": "onetwo"}),
+    ('A="multi\nline"\n', {"A": "multi\nline"}),
+    ("A=url?x=1&y=2\n", {"A": "url?x=1&y=2"}),
+    ('A="k=v" B=2\n', {"A": "k=v B=2"}),
+    ("A=a'b c'd\n", {"A": "ab cd"}),
+    ('A="  padded  "\n', {"A": "  padded  "}),
+    ("A=\nB\n1C=x\nD-E=y\n", {"A": ""}),
+    ("#comment \\\nA=1\nB=2\n", {"B": "2"}),
+    ("A=1\r\nB=2\r\n", {"A": "1", "B": "2"}),
+    ("A=1\nA=2\n", {"A": "2"}),
+)
+
+
+def check(tmp):
+    failures = []
+    for text, expected in CASES:
+        got = serviced.parse_environment_text(text)
+        if got != expected:
+            failures.append("%r: got %r, want %r" % (text, got, expected))
+    first = os.path.join(tmp, "first")
+    second = os.path.join(tmp, "second")
+    with open(first, "w") as f:
+        f.write("A=1\nB=1\n")
+    with open(second, "w") as f:
+        f.write("B=2\n")
+    unit = serviced.UnitFile.from_text(
+        "[Service]\n"
+        "EnvironmentFile=%s\n"
+        "EnvironmentFile=-%s\n"
+        "EnvironmentFile=-/nonexistent\n"
+        "Environment=\"C=x y\" D=1\n" % (first, second)
+    )
+    env = serviced.ServiceManager()._build_env(unit)
+    got = tuple(env.get(k) for k in "ABCD")
+    if got != ("1", "2", "x y", "1"):
+        failures.append("EnvironmentFile= order: got %r" % (got,))
+    env["MAINPID"] = "1"
+    if "MAINPID" in os.environ or "MAINPID" in env.maps[1]:
+        failures.append("write to unit environment leaked into the base")
+    with open(second, "w") as f:
+        f.write("B=3 \n")
+    os.utime(second, ns=(0, 0))
+    if serviced.load_environment_file(second).get("B") != "3":
+        failures.append("changed EnvironmentFile not re-read")
+    return failures
+
+
+def legacy_load(path):
+    env = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "=" in line:
+                key, _, value = line.partition("=")
+                env[key.strip()] = value.strip().strip('"').strip("'")
+    return env
+
+
+def legacy_build(unit):
+    env = dict(os.environ)
+    env.update(legacy_load(unit.get("Service", "EnvironmentFile")))
+    env.update(unit.environment)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--count", type=int, default=3000)
+    parser.add_argument("--files", type=int, default=10)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="serviced-envfile-")
+    try:
+        failures = check(tmp)
+        total = len(CASES) + 1
+        print("conformance: %d/%d cases pass" % (total - len(failures), total))
+        for failure in failures:
+            print("FAIL: %s" % failure)
+
+        files = []
+        for i in range(args.files):
+            path = os.path.join(tmp, "default-%d" % i)
+            with open(path, "w") as f:
+                for j in range(30):
+                    f.write('# option %d\nOPT_%d_%d="value %d"\n' % (j, i, j, j))
+            files.append(path)
+        units = [
+            serviced.UnitFile.from_text(
+                "[Service]\nEnvironmentFile=%s\nEnvironment=N=%d\n"
+                % (files[i % len(files)], i)
+            )
+            for i in range(args.count)
+        ]
+        rows = []
+        t0 = time.perf_counter()
+        for unit in units:
+            legacy_build(unit)["MAINPID"] = "1"
+        rows.append(("copy+reparse", time.perf_counter() - t0))
+        serviced._ENV_FILE_CACHE.clear()
+        mgr = serviced.ServiceManager()
+        t0 = time.perf_counter()
+        for unit in units:
+            mgr._build_env(unit)["MAINPID"] = "1"
+        rows.append(("cached layers", time.perf_counter() - t0))
+        print(
+            "%d units, %d shared files, %d variables in os.environ"
+            % (args.count, args.files, len(os.environ))
+        )
+        print("%-14s %10s %12s" % ("BUILD", "ms", "units/s"))
+        print("-" * 38)
+        for label, dt in rows:
+            print("%-14s %10.1f %12.0f" % (label, dt * 1e3, args.count / dt))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+importtime.py - Startup regression check for the serviced CLI
+
+Runs the cached-path commands (--version, status, list) under
+`python3 -X importtime` against a sandbox (see _sandbox.py) and fails if
+any of them pulls in a module from the HEAVY list, or if the median wall
+time of a command goes over the budget.  Commands that legitimately need
+a heavy module name it in ALLOWED.
+
+    python3 serviced/bench/importtime.py --budget-ms 50
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _sandbox  # noqa: E402
+
+HEAVY = (
+    "argparse",
+    "concurrent.futures",
+    "fnmatch",
+    "grp",
+    "json",
+    "pwd",
+    "re",
+    "shlex",
+    "signal",
+    "socket",
+    "subprocess",
+    "threading",
+)
+
+# argv -> heavy modules the command is allowed to import
+COMMANDS = (
+    (("--version",), ()),
+    (("status", "bench-simple-0"), ()),
+    (("list",), ()),
+    (("list-running",), ()),
+)
+
+
+def imported_modules(stderr):
+    """Module names from `-X importtime` output."""
+    mods = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") < 2:
+            continue
+        name = line.rsplit("|", 1)[1].strip()
+        if name != "package":
+            mods.append(name)
+    return mods
+
+
+def run(cli, argv, env, python_flags=()):
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable] + list(python_flags) + [cli] + list(argv),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    return time.perf_counter() - t0, proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument(
+        "--budget-ms", type=float, default=50.0, help="median wall time per command"
+    )
+    args = parser.parse_args()
+
+    sb = _sandbox.Sandbox().build()
+    env = sb.env()
+    # The cached path is what we guard: let the first run write bytecode.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    failures = []
+    try:
+        subprocess.call(
+            [sb.cli, "start", "bench-simple-0"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        print("%-28s %10s %10s  %s" % ("COMMAND", "p50 ms", "max ms", "HEAVY IMPORTS"))
+        print("-" * 72)
+        for argv, allowed in COMMANDS:
+            label = " ".join(argv)
+            _, proc = run(sb.cli, argv, env, ("-X", "importtime"))
+            mods = imported_modules(proc.stderr)
+            heavy = [m for m in mods if m in HEAVY and m not in allowed]
+            samples = sorted(run(sb.cli, argv, env)[0] for _ in range(args.iterations))
+            p50 = samples[len(samples) // 2] * 1000.0
+            print(
+                "%-28s %10.1f %10.1f  %s"
+                % (label, p50, samples[-1] * 1000.0, ", ".join(heavy) or "-")
+            )
+            if heavy:
+                failures.append("%s imports %s" % (label, ", ".join(heavy)))
+            if p50 > args.budget_ms:
+                failures.append(
+                    "%s: p50 %.1f ms over budget %.1f ms" % (label, p50, args.budget_ms)
+                )
+    finally:
+        sb.cleanup()
+    for failure in failures:
+        print("FAIL: %s" % failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
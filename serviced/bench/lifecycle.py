@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+lifecycle.py - End-to-end start/stop latency benchmark for serviced
+
+Builds a sandboxed unit tree (see _sandbox.py) with stub daemons for
+Type=simple, forking (PIDFile=), oneshot, dbus (behind a fake system bus)
+and notify, then measures p50/p99 wall time of start, stop, restart,
+reload and status per type, plus a full start_all_enabled.  Every
+operation uses a fresh ServiceManager so discovery is paid like a CLI
+call would pay it.  --storm fires many CLI processes at once.
+
+Runs offline on a plain Linux box, no root and no real D-Bus needed:
+
+    python3 serviced/bench/lifecycle.py -n 10 --storm 40
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _sandbox  # noqa: E402
+
+OPS = ("start", "stop", "restart", "reload", "status")
+
+# A transaction still running after this long counts as hung
+CYCLE_TIMEOUT = 10.0
+
+
+def summarize(samples):
+    return {
+        "n": len(samples),
+        "p50_ms": _sandbox.percentile(samples, 50) * 1000.0,
+        "p99_ms": _sandbox.percentile(samples, 99) * 1000.0,
+        "max_ms": max(samples) * 1000.0 if samples else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        yield
+
+
+class Bench:
+    def __init__(self, sandbox, iterations):
+        self.sb = sandbox
+        self.iterations = iterations
+        self.sd = _sandbox.load_serviced(sandbox.root)
+        self.results = []
+        self.hung = False
+
+    def mgr(self):
+        return self.sd.ServiceManager()
+
+    def call(self, op, name):
+        with quiet():
+            if op == "status":
+                return self.sd.Client(capture_logs=False).status(name).active
+            return getattr(self.mgr(), op)(name)
+
+    def timed(self, op, name):
+        t0 = time.perf_counter()
+        ok = self.call(op, name)
+        return time.perf_counter() - t0, ok
+
+    def record(self, label, op, samples, failures):
+        row = {"unit": label, "op": op, "failures": failures}
+        row.update(summarize(samples))
+        self.results.append(row)
+
+    def run_ops(self):
+        for stype in self.sb.TYPES:
+            name = "bench-%s-0.service" % stype
+            for op in OPS:
+                if op == "reload" and stype == "oneshot":
+                    continue
+                samples, failures = [], 0
+                for _ in range(self.iterations):
+                    if op == "start":
+                        self.call("stop", name)
+                    elif op in ("stop", "restart", "reload", "status"):
+                        self.call("start", name)
+                    dt, ok = self.timed(op, name)
+                    samples.append(dt)
+                    failures += 0 if ok else 1
+                self.record(stype, op, samples, failures)
+            self.call("stop", name)
+
+    def run_cycle(self):
+        """Start two units that Want= each other as one transaction: they
+        land in one layer, and neither worker may wait for the other's
+        job for ever."""
+        stub = os.path.join(self.sb.bin_dir, "bsimple0")
+        names = ["bench-cycle-a.service", "bench-cycle-b.service"]
+        for name, other in zip(names, names[::-1]):
+            self.sb._unit(
+                name,
+                "[Unit]\nWants=%s\n\n[Service]\nType=simple\nExecStart=%s\n"
+                % (other, stub),
+            )
+        results = {}
+        worker = threading.Thread(
+            target=lambda: results.update(
+                self.mgr().run_transaction("start", names, jobs=2)
+            ),
+            daemon=True,
+        )
+        t0 = time.perf_counter()
+        with quiet():
+            worker.start()
+            worker.join(CYCLE_TIMEOUT)
+        dt = time.perf_counter() - t0
+        self.hung = hung = worker.is_alive()
+        ok = not hung and all(results.get(n) for n in names)
+        self.record("cycle", "start (Wants= loop)", [dt], 0 if ok else 1)
+        if not hung:
+            for name in names:
+                self.call("stop", name)
+
+    def run_boot(self):
+        self.sb.enable_all()
+        samples = []
+        for _ in range(self.iterations):
+            for name in self.sb.units:
+                self.call("stop", name)
+            t0 = time.perf_counter()
+            with quiet():
+                self.mgr().start_all_enabled()
+            samples.append(time.perf_counter() - t0)
+        self.record("%d units" % len(self.sb.units), "start_all_enabled", samples, 0)
+        for name in self.sb.units:
+            self.call("stop", name)
+
+    def run_cli(self, argv, count):
+        env = self.sb.env()
+        samples, failures = [], 0
+        for _ in range(count):
+            t0 = time.perf_counter()
+            rc = subprocess.call(
+                [self.sb.cli] + argv,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            samples.append(time.perf_counter() - t0)
+            failures += 0 if rc in (0, 3) else 1
+        self.record("cli", " ".join(argv), samples, failures)
+
+    def run_storm(self, size, command):
+        """Launch `size` CLI invocations at once, round-robin over units."""
+        env = self.sb.env()
+        names = sorted(self.sb.units)
+        procs = []
+        t0 = time.perf_counter()
+        for i in range(size):
+            argv = [self.sb.cli, command, names[i % len(names)]]
+            procs.append(
+                (
+                    time.perf_counter(),
+                    subprocess.Popen(
+                        argv,
+                        env=env,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    ),
+                )
+            )
+        samples, failures = [], 0
+        pending = list(procs)
+        while pending:
+            still = []
+            for started, p in pending:
+                rc = p.poll()
+                if rc is None:
+                    still.append((started, p))
+                    continue
+                samples.append(time.perf_counter() - started)
+                failures += 0 if rc in (0, 3) else 1
+            pending = still
+            if pending:
+                time.sleep(0.002)
+        wall = time.perf_counter() - t0
+        self.record("storm x%d" % size, command, samples, failures)
+        self.results[-1]["wall_ms"] = wall * 1000.0
+        if command == "start":
+            for name in names:
+                self.call("stop", name)
+
+
+def print_table(rows):
+    print(
+        "%-16s %-20s %5s %10s %10s %10s %6s"
+        % ("UNIT", "OP", "N", "p50 ms", "p99 ms", "max ms", "FAIL")
+    )
+    print("-" * 84)
+    for r in rows:
+        line = "%-16s %-20s %5d %10.1f %10.1f %10.1f %6d" % (
+            r["unit"],
+            r["op"],
+            r["n"],
+            r["p50_ms"],
+            r["p99_ms"],
+            r["max_ms"],
+            r["failures"],
+        )
+        if "wall_ms" in r:
+            line += "   (wall %.1f ms)" % r["wall_ms"]
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-n", "--iterations", type=int, default=5)
+    parser.add_argument(
+        "--copies", type=int, default=2, help="stub units per Type= (default: 2)"
+    )
+    parser.add_argument(
+        "--storm", type=int, default=0, help="concurrent CLI invocations (0 = skip)"
+    )
+    parser.add_argument("--storm-command", default="status")
+    parser.add_argument("--cli", type=int, default=10, help="serial CLI status calls")
+    parser.add_argument("--skip-ops", action="store_true")
+    parser.add_argument("--skip-boot", action="store_true")
+    parser.add_argument("--json", action="store_true", help="emit JSON results")
+    parser.add_argument("--keep", action="store_true", help="keep the sandbox")
+    args = parser.parse_args()
+
+    sb = _sandbox.Sandbox(copies=max(1, args.copies)).build()
+    sb.activate()
+    bench = Bench(sb, max(1, args.iterations))
+    try:
+        if not args.skip_ops:
+            bench.run_ops()
+            bench.run_cycle()
+        if not args.skip_boot:
+            bench.run_boot()
+        if args.cli:
+            bench.run_cli(["status", "bench-simple-0"], args.cli)
+            bench.run_cli(["-o", "json", "status", "--all"], args.cli)
+        if args.storm:
+            bench.run_storm(args.storm, args.storm_command)
+    finally:
+        if args.keep:
+            sb.kill_all()
+            print("Sandbox kept at %s" % sb.root, file=sys.stderr)
+        else:
+            sb.cleanup()
+    if args.json:
+        json.dump(bench.results, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(bench.results)
+    if bench.hung:
+        # The stuck transaction's pool threads would block interpreter exit
+        sys.stdout.flush()
+        os._exit(1)
+
+
+if __name__ == "__main__":
+    main()
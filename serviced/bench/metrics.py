@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+metrics.py - Cost of a metrics scrape
+
+Starts the sandbox units (see _sandbox.py), runs a few restarts so the
+counters and histograms have data, and times collect_metrics() (what a
+'serviced metrics' call, a GET /metrics on the daemon socket or a
+textfile refresh renders) -n times, reporting wall and CPU time per
+scrape and the share of one core a scrape every --interval seconds would
+use.
+
+    python3 serviced/bench/metrics.py --copies 10 -n 50
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _sandbox  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("-n", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=15.0)
+    args = parser.parse_args()
+
+    sb = _sandbox.Sandbox(copies=args.copies).build()
+    try:
+        serviced = _sandbox.load_serviced(sb.root)
+        client = serviced.Client(capture_logs=False)
+        names = sorted(sb.units)
+        client.start(names, jobs=8)
+        client.restart(names[: len(names) // 4], jobs=8)
+        text = client.metrics()
+        walls = []
+        cpus = []
+        for _ in range(args.n):
+            w0, c0 = time.perf_counter(), time.process_time()
+            client.metrics()
+            walls.append(time.perf_counter() - w0)
+            cpus.append(time.process_time() - c0)
+        client.shutdown(timeout=5.0)
+    finally:
+        sb.cleanup()
+    walls.sort()
+    cpus.sort()
+    print(
+        "%d units, %d lines per scrape, %d samples"
+        % (len(names), len(text.splitlines()), args.n)
+    )
+    print("%-10s %10s %10s" % ("", "p50 ms", "max ms"))
+    for label, samples in (("wall", walls), ("cpu", cpus)):
+        print(
+            "%-10s %10.2f %10.2f"
+            % (label, samples[len(samples) // 2] * 1e3, samples[-1] * 1e3)
+        )
+    print(
+        "load at one scrape per %gs: %.3f%% of a core"
+        % (args.interval, cpus[len(cpus) // 2] / args.interval * 100.0)
+    )
+
+
+if __name__ == "__main__":
+    main()
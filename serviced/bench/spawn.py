@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+spawn.py - Process spawn latency microbenchmark
+
+Compares the old way serviced spawned commands (a Python preexec_fn
+calling setsid, which forces a full fork of the interpreter) with the
+keyword-only spawn_options() path (start_new_session / process_group /
+user= / group=, which lets CPython use vfork or posix_spawn).  --rss
+inflates the parent first, since fork cost grows with its page tables.
+Also times the NSS lookups _credentials() now caches.
+
+    python3 serviced/bench/spawn.py -n 200 --rss 256
+"""
+
+from __future__ import print_function
+
+import argparse
+import grp
+import os
+import pwd
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import _sandbox  # noqa: E402
+import serviced  # noqa: E402
+
+
+def time_spawns(n, argv, **kwargs):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, **kwargs)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def time_calls(n, fn):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-n", "--iterations", type=int, default=100)
+    parser.add_argument(
+        "--rss", type=int, default=0, help="MiB to allocate in the parent first"
+    )
+    parser.add_argument("--cmd", default="/bin/true", help="command to spawn")
+    args = parser.parse_args()
+
+    ballast = bytearray(args.rss * 1024 * 1024)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+
+    argv = [args.cmd]
+    n = max(1, args.iterations)
+    me = pwd.getpwuid(os.getuid())
+    with tempfile.NamedTemporaryFile("w", suffix=".service") as f:
+        f.write("[Service]\nUser=%s\nExecStart=%s\n" % (me.pw_name, args.cmd))
+        f.flush()
+        unit = serviced.UnitFile(f.name)
+    rows = [
+        ("preexec_fn=os.setsid", time_spawns(n, argv, preexec_fn=os.setsid)),
+        (
+            "spawn_options(new_session)",
+            time_spawns(n, argv, **serviced.spawn_options(new_session=True)),
+        ),
+        (
+            "spawn_options(own_group)",
+            time_spawns(n, argv, **serviced.spawn_options(own_group=True)),
+        ),
+        (
+            "getpwnam+getgrouplist",
+            time_calls(
+                n,
+                lambda: (
+                    pwd.getpwnam(me.pw_name),
+                    os.getgrouplist(me.pw_name, me.pw_gid),
+                    grp.getgrgid(me.pw_gid),
+                ),
+            ),
+        ),
+    ]
+    mgr = serviced.ServiceManager()
+    cached = time_calls(n, lambda: mgr._credentials(unit))
+    rows.append(("_credentials (cached)", cached))
+
+    print("Python %s, parent RSS ballast %d MiB" % (sys.version.split()[0], args.rss))
+    print("%-28s %10s %10s %10s" % ("METHOD", "p50 us", "p99 us", "max us"))
+    print("-" * 62)
+    for label, samples in rows:
+        print(
+            "%-28s %10.1f %10.1f %10.1f"
+            % (
+                label,
+                _sandbox.percentile(samples, 50) * 1e6,
+                _sandbox.percentile(samples, 99) * 1e6,
+                max(samples) * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+units.py - Memory and access cost of parsed unit files
+
+Writes a synthetic unit tree shaped like a full distro's (--count files
+sharing the usual targets, Exec lines and Environment= keys), parses it
+with serviced.UnitFile and with LegacyUnitFile, the dict-of-lists layout
+it replaced, and reports retained memory (tracemalloc), parse time and
+the time of a graph scan that reads every dependency list, the Exec
+lines and the environment of every unit --rounds times.
+
+    python3 serviced/bench/units.py --count 3000 --rounds 20
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import serviced  # noqa: E402
+
+TARGETS = (
+    "network.target",
+    "network-online.target",
+    "local-fs.target",
+    "remote-fs.target",
+    "nss-lookup.target",
+    "time-sync.target",
+    "sysinit.target",
+    "basic.target",
+    "dbus.socket",
+    "systemd-journald.socket",
+)
+
+
+class LegacyUnitFile:
+    """The layout UnitFile had before: section -> key -> list, with
+    properties re-splitting or copying on every access."""
+
+    def __init__(self, path):
+        self.path = path
+        self._data = {}
+        section = None
+        with open(path, "r") as f:
+            prev_line = ""
+            for raw_line in f:
+                line = raw_line.rstrip("\n")
+                if line.endswith("\\"):
+                    prev_line += line[:-1].strip() + " "
+                    continue
+                if prev_line:
+                    line = prev_line + line.strip()
+                    prev_line = ""
+                line = line.strip()
+                if not line or line.startswith("#") or line.startswith(";"):
+                    continue
+                if line.startswith("[") and line.endswith("]") and len(line) > 2:
+                    section = line[1:-1]
+                    if section not in self._data:
+                        self._data[section] = {}
+                    continue
+                if section and "=" in line:
+                    key, _, value = line.partition("=")
+                    key = key.strip()
+                    value = value.strip()
+                    if key not in self._data[section]:
+                        self._data[section][key] = []
+                    if value == "":
+                        self._data[section][key] = []
+                    else:
+                        self._data[section][key].append(value)
+
+    def get(self, section, key, default=""):
+        try:
+            values = self._data[section][key]
+            return values[-1] if values else default
+        except KeyError:
+            return default
+
+    def getlist(self, section, key):
+        try:
+            return list(self._data[section][key])
+        except KeyError:
+            return []
+
+    def _split(self, key):
+        val = self.get("Unit", key, "")
+        return val.split() if val else []
+
+    requires = property(lambda self: self._split("Requires"))
+    wants = property(lambda self: self._split("Wants"))
+    after = property(lambda self: self._split("After"))
+    before = property(lambda self: self._split("Before"))
+    binds_to = property(lambda self: self._split("BindsTo"))
+    exec_start = property(lambda self: self.getlist("Service", "ExecStart"))
+
+    @property
+    def environment(self):
+        env = {}
+        for val in self.getlist("Service", "Environment"):
+            val = val.strip('"').strip("'")
+            if "=" in val:
+                k, _, v = val.partition("=")
+                env[k.strip()] = v.strip()
+        return env
+
+
+def write_tree(root, count):
+    for i in range(count):
+        deps = " ".join(TARGETS[j % len(TARGETS)] for j in range(i % 4, i % 4 + 3))
+        with open(os.path.join(root, "unit-%05d.service" % i), "w") as f:
+            f.write(
+                "[Unit]\n"
+                "Description=Synthetic service number %d\n"
+                "Documentation=man:unit-%d(8) https://example.org/unit-%d\n"
+                "After=%s\n"
+                "Wants=%s\n"
+                "Requires=unit-%05d.service\n"
+                "\n"
+                "[Service]\n"
+                "Type=%s\n"
+                "User=daemon\n"
+                "Environment=LANG=C.UTF-8\n"
+                "Environment=CONF=/etc/unit-%d.conf\n"
+                "EnvironmentFile=-/etc/default/unit-%d\n"
+                "ExecStartPre=/usr/bin/test -f /etc/unit-%d.conf\n"
+                "ExecStart=/usr/sbin/unit-%d --foreground --config $CONF\n"
+                "ExecReload=/bin/kill -HUP $MAINPID\n"
+                "Restart=on-failure\n"
+                "TimeoutStopSec=30\n"
+                "\n"
+                "[Install]\n"
+                "WantedBy=multi-user.target\n"
+                % (
+                    i,
+                    i,
+                    i,
+                    deps,
+                    deps,
+                    max(0, i - 1),
+                    ("simple", "forking", "notify", "oneshot")[i % 4],
+                    i,
+                    i,
+                    i,
+                    i,
+                )
+            )
+
+
+def load(cls, paths):
+    """Parsed units, bytes they retain, and parse time (timed on a second,
+    untraced pass)."""
+    gc.collect()
+    tracemalloc.start()
+    units = [cls(p) for p in paths]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    units = [cls(p) for p in paths]
+    return units, size, time.perf_counter() - t0
+
+
+def scan(units, rounds):
+    t0 = time.perf_counter()
+    edges = 0
+    for _ in range(rounds):
+        for u in units:
+            edges += len(u.requires + u.wants + u.after + u.binds_to)
+            edges += len(u.before) + len(u.exec_start) + len(u.environment)
+    return time.perf_counter() - t0, edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--count", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="serviced-units-")
+    try:
+        write_tree(root, args.count)
+        paths = sorted(os.path.join(root, f) for f in os.listdir(root))
+        rows = []
+        layouts = (("legacy _data", LegacyUnitFile), ("UnitFile", serviced.UnitFile))
+        for label, cls in layouts:
+            units, size, parse_s = load(cls, paths)
+            scan_s, edges = scan(units, args.rounds)
+            rows.append((label, size, parse_s, scan_s, edges))
+            del units
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print("%d unit files, graph scan x%d" % (args.count, args.rounds))
+    print(
+        "%-14s %12s %10s %10s %12s"
+        % ("LAYOUT", "KiB retained", "B/unit", "parse ms", "scan ms")
+    )
+    print("-" * 62)
+    for label, size, parse_s, scan_s, _ in rows:
+        print(
+            "%-14s %12.0f %10.0f %10.1f %12.1f"
+            % (
+                label,
+                size / 1024.0,
+                size / float(args.count),
+                parse_s * 1e3,
+                scan_s * 1e3,
+            )
+        )
+    if rows[0][4] != rows[1][4]:
+        print("WARNING: layouts disagree (%d vs %d edges)" % (rows[0][4], rows[1][4]))
+
+
+if __name__ == "__main__":
+    main()
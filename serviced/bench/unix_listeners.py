@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+unix_listeners.py - Unix socket liveness from /proc/net/unix
+
+Binds --count listening stream sockets, a datagram socket, an abstract
+socket, one listener whose backlog is full, and leaves stale socket files
+from closed listeners.  Checks that UnixListeners tells them apart (and
+that no listener saw a connection while it did), then times checking
+every path with the connect() probes serviced used before against one
+/proc/net/unix snapshot.  Exits non-zero when a check fails.
+
+    python3 serviced/bench/unix_listeners.py --count 200
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import serviced  # noqa: E402
+
+
+def listener(path, stype=socket.SOCK_STREAM, backlog=16):
+    s = socket.socket(socket.AF_UNIX, stype)
+    s.bind(path)
+    if stype == socket.SOCK_STREAM:
+        s.listen(backlog)
+        s.setblocking(False)
+    return s
+
+
+def legacy_alive(path):
+    """The probe serviced used before: connect, stream then datagram."""
+    if not os.path.exists(path):
+        return False
+    for stype in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+        try:
+            s = socket.socket(socket.AF_UNIX, stype)
+            s.settimeout(1)
+            s.connect(path)
+            s.close()
+            return True
+        except OSError:
+            continue
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="serviced-unix-")
+    keep = []
+    failures = []
+    try:
+        live = [os.path.join(tmp, "live-%d.sock" % i) for i in range(args.count)]
+        keep.extend(listener(p) for p in live)
+        stale = [os.path.join(tmp, "stale-%d.sock" % i) for i in range(args.count)]
+        for p in stale:
+            listener(p).close()
+        dgram = os.path.join(tmp, "dgram.sock")
+        keep.append(listener(dgram, socket.SOCK_DGRAM))
+        abstract = "@serviced-bench-%d" % os.getpid()
+        keep.append(listener("\0" + abstract[1:]))
+        full = os.path.join(tmp, "full.sock")
+        keep.append(listener(full, backlog=0))
+        for _ in range(4):
+            c = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            c.setblocking(False)
+            try:
+                c.connect(full)
+            except OSError:
+                pass
+            keep.append(c)
+
+        snap = serviced.UnixListeners()
+        expect = [(p, True) for p in live[:5]] + [(p, False) for p in stale[:5]]
+        expect += [(dgram, True), (abstract, True), (full, True)]
+        expect += [("@serviced-bench-missing", False), (tmp + "/none", False)]
+        for path, want in expect:
+            if snap.alive(path) != want:
+                failures.append("%s: got %r, want %r" % (path, not want, want))
+        for s in keep[: args.count]:
+            try:
+                s.accept()
+                failures.append("listener saw a connection from the snapshot")
+                break
+            except BlockingIOError:
+                pass
+        print("checks: %s" % ("ok" if not failures else "FAILED"))
+        for failure in failures:
+            print("FAIL: %s" % failure)
+
+        paths = live + stale
+        rows = []
+        t0 = time.perf_counter()
+        for p in paths:
+            legacy_alive(p)
+        rows.append(("connect", time.perf_counter() - t0))
+        t0 = time.perf_counter()
+        snap = serviced.UnixListeners()
+        for p in paths:
+            snap.alive(p)
+        rows.append(("snapshot", time.perf_counter() - t0))
+        print("%d live + %d stale sockets" % (len(live), len(stale)))
+        print("%-10s %10s" % ("CHECK", "ms"))
+        print("-" * 21)
+        for label, dt in rows:
+            print("%-10s %10.1f" % (label, dt * 1e3))
+    finally:
+        for s in keep:
+            s.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,20 +24,51 @@ Repository : https://github.com/sabamdarif/chroot-distro
 
 from __future__ import print_function
 
-import argparse
-import datetime
-import grp
-import json
+import _thread
 import os
-import pwd
-import re
-import shlex
-import signal
-import socket as socketmod
-import subprocess
 import sys
 import time
 
+
+class _LazyModule:
+    """Module-global stand-in that imports the real module on first
+    attribute access and rebinds the global to it. `serviced status` is
+    run on every login, and eager imports cost more than the query.
+    """
+
+    def __init__(self, name, alias=None):
+        self._name = name
+        self._alias = alias or name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        __import__(self._name)
+        mod = sys.modules[self._name]
+        globals()[self._alias] = mod
+        return getattr(mod, attr)
+
+
+_socket = _LazyModule("_socket")
+argparse = _LazyModule("argparse")
+collections = _LazyModule("collections")
+ctypes = _LazyModule("ctypes")
+datetime = _LazyModule("datetime")
+fcntl = _LazyModule("fcntl")
+fnmatch = _LazyModule("fnmatch")
+futures = _LazyModule("concurrent.futures", "futures")
+grp = _LazyModule("grp")
+json = _LazyModule("json")
+marshal = _LazyModule("marshal")
+pwd = _LazyModule("pwd")
+re = _LazyModule("re")
+select = _LazyModule("select")
+shlex = _LazyModule("shlex")
+signal = _LazyModule("signal")
+socketmod = _LazyModule("socket", "socketmod")
+subprocess = _LazyModule("subprocess")
+threading = _LazyModule("threading")
+
 VERSION = "0.1.7"
 
 SYSTEM_UNIT_PATHS = [
@@ -65,12 +96,70 @@ STATE_DIR = "/tmp/serviced"
 PID_DIR = os.path.join(STATE_DIR, "pids")
 LOG_DIR = os.path.join(STATE_DIR, "logs")
 STATUS_DIR = os.path.join(STATE_DIR, "status")
+BOOT_TIMINGS_FILE = os.path.join(STATE_DIR, "boot-timings.json")
+BOOT_PROGRESS_FILE = os.path.join(STATE_DIR, "boot-progress.json")
+BOOT_LOG_FILE = os.path.join(STATE_DIR, "boot.log")
+CONTROL_SOCKET = os.path.join(STATE_DIR, "control.sock")
+DBUS_INDEX_FILE = os.path.join(STATE_DIR, "dbus-activation.index")
+METRICS_FILE = os.path.join(STATE_DIR, "metrics.dat")
+LOCK_DIR = os.path.join(STATE_DIR, "locks")
+FROZEN_DIR = os.path.join(STATE_DIR, "frozen")
+SHED_FILE = os.path.join(STATE_DIR, "shed.dat")
 
 ENABLED_DIR = "/var/lib/serviced/enabled"
 ACTION_LOG_FILE = "/var/lib/serviced/serviced.log"
 
 SYSTEM_BUS_SOCKET = "/run/dbus/system_bus_socket"
 
+DBUS_ACTIVATION_DIRS = [
+    "/usr/share/dbus-1/system-services",
+    "/usr/share/dbus-1/services",
+    "/usr/local/share/dbus-1/system-services",
+    "/usr/local/share/dbus-1/services",
+]
+
+# systemd's DefaultTimeoutStartSec=/DefaultTimeoutStopSec=
+DEFAULT_TIMEOUT_SEC = 90.0
+# How long a timed-out helper gets between KillSignal= and SIGKILL
+HELPER_KILL_GRACE = 5.0
+# Helper output is copied to the log in chunks; longer lines are split
+HELPER_LINE_MAX = 4096
+# How long helper output is still read after the helper exits, when a
+# daemonized grandchild keeps the pipe open
+HELPER_DRAIN_SEC = 0.2
+
+# How long a job waits for another process holding the same unit's lock
+# before it goes ahead anyway (and warns); guards against lock cycles
+LOCK_WAIT_SEC = DEFAULT_TIMEOUT_SEC
+# How long 'serviced daemon' answers status from memory without an event
+DAEMON_STATUS_TTL = 1.0
+# How often the daemon samples units with X-ServicedIdleFreezeSec=, and
+# how often it looks for connections waiting on the ones it froze
+IDLE_CHECK_SEC = 5.0
+IDLE_THAW_POLL_SEC = 0.25
+
+PSI_MEMORY = "/proc/pressure/memory"
+# PSI trigger the daemon sleeps on: some task stalled on memory for this
+# many microseconds within the window. Windows that are a multiple of 2 s
+# are accepted without CAP_SYS_RESOURCE too.
+MEMORY_PRESSURE_TRIGGER = "some 200000 2000000"
+# "some" avg10 (percent) from which a wakeup counts as sustained pressure
+MEMORY_PRESSURE_AVG10 = 10.0
+# Time a shedding action gets to take effect before the next one
+MEMORY_PRESSURE_COOLDOWN_SEC = 20.0
+
+# X-ServicedPriority= classes in the order units are shed under memory
+# pressure, and the oom_score_adj each gets when OOMScoreAdjust= is not
+# set (None leaves the inherited value). critical units are never shed.
+PRIORITY_CLASSES = ("low", "normal", "high", "critical")
+# Highest class shed unless SERVICED_SHED_PRIORITY= says otherwise: only
+# units that opted in with X-ServicedPriority=low
+SHED_PRIORITY_DEFAULT = "low"
+PRIORITY_OOM_SCORE = {"low": 500, "normal": None, "high": -250, "critical": -500}
+
+# Upper bounds (seconds) of the start/stop/ExecStartPre= duration histograms
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
 CRITICAL_SERVICES = {
     "systemd-halt",
     "systemd-poweroff",
@@ -112,14 +201,28 @@ Lightweight service manager for systemd .service files (v%s).
 
 Service Commands:
   start UNIT...                       Start (activate) one or more units
-  stop UNIT...                        Stop (deactivate) one or more units
+  start [--background]                Start every enabled unit; --background
+                                      returns once login-critical units are up
+  stop UNIT... | --all                Stop (deactivate) one or more units
   reload UNIT...                      Reload one or more units
   restart UNIT...                     Start or restart one or more units
   kill UNIT...                        Send signal to processes of a unit
-  status UNIT                         Show runtime status of a unit
-  cat UNIT...                         Show files and drop-ins of specified units
+  freeze UNIT...                      Suspend every process of one or more units
+  thaw UNIT...                        Resume units suspended by freeze
+  status UNIT... | --all              Show runtime status of one or more units
+  cat [--effective] UNIT...           Show files and drop-ins of specified units,
+                                      or with --effective the merged result
   help UNIT...                        Show documentation of specified units
   log UNIT                            Show service log (last N lines)
+  boot-status | status --boot         Show what the current or last boot has
+                                      started, is starting and has failed
+  events [UNIT...]                    Stream unit state changes as NDJSON
+  watch [UNIT...]                     Live table of unit states
+  blame                               Show slowest units of the last boot
+  analyze [UNIT]                      Show the critical chain of the last boot
+  daemon [--detach]                   Stay resident and serve other serviced calls
+  metrics [--textfile FILE]           Print Prometheus metrics, or write them
+                                      atomically to FILE
 
 Unit File Commands:
   enable UNIT...                      Enable one or more unit files
@@ -131,33 +234,106 @@ Options:
   -h --help                           Show this help
      --version                        Show package version
      --dry-run                        Show what would be done without doing it
+  -j --jobs N                         Units to start/stop in parallel (default: 4)
   -v --verbose                        Show debug output
+     --timings                        Print per-phase timings after the command
+  -o --output MODE                    Output format for list, list-running,
+                                      status, cat and log (text|json|ndjson)
+     --timeout SEC                    Grace period of stop --all (default: 5)
   -s --signal SIGNAL                  Signal to send (kill command, default: SIGTERM)
      --kill-who WHO                   Who to send signal to (main|all, default: all)
+     --trace FILE                     Write a Chrome trace-event JSON (analyze)
+     --svg FILE                       Write an SVG boot timeline (analyze)
   -n --lines NUM                      Number of log lines to show (default: 50)
      --user                           Talk to the service manager of the calling user
 
+UNIT may be a shell glob such as 'php*-fpm'. Units named on one command
+line run as one transaction, ordered by the dependencies among them.
+stop --all takes every running unit down in reverse dependency order and
+SIGKILLs whatever is left, including strays in unit sessions, at the
+deadline.
+
+While serviced daemon runs, start/stop/restart/reload/status/list are
+forwarded to it over a socket in the state directory and status comes
+from memory; units it starts get the daemon's environment, not the
+caller's. Set SERVICED_NO_DAEMON=1 to bypass it. The daemon also
+answers GET /metrics on that socket, and with SERVICED_METRICS_TEXTFILE
+set every job rewrites that file with the current metrics.
+
+start --background starts the units with X-ServicedLoginCritical=yes
+and what they need, then boots the rest in a detached process that logs
+to boot.log in the state directory; boot-status follows its progress.
+
+events and watch follow the status, PID, freeze and lock files with
+inotify and report starting, active, reloading, stopping, frozen,
+failed, exited (exit code when the daemon reaped it) and inactive. On a
+terminal watch rewrites only the rows that changed.
+
+freeze uses cgroup.freeze when the unit has a cgroup v2 group of its
+own, SIGSTOP on its process tree otherwise; list and status show the
+unit as frozen. With X-ServicedIdleFreezeSec= in [Service], the daemon
+freezes a unit idle that long and thaws it when a connection arrives.
+
+The daemon also sleeps on a PSI trigger on /proc/pressure/memory. Under
+sustained pressure it sheds one running unit at a time, largest first,
+among those with X-ServicedPriority=low, as X-ServicedPressureAction=
+says (stop, freeze or restart). SERVICED_SHED_PRIORITY=normal (or high)
+lets it go on to those classes, lowest first; critical is never shed. Units get the
+oom_score_adj of OOMScoreAdjust= or of their priority class at start.
+
 See serviced list for available units.
 """
     % VERSION
 )
 
 
+# Each message goes out in a single write() so lines from worker threads
+# of a transaction do not interleave. With a handler installed (see
+# set_log_handler) nothing is written and handler(level, text) is called
+# instead; level is INFO, WARN, ERROR, DEBUG or PROGRESS.
+_LOG_HANDLER = None
+
+
+def set_log_handler(handler):
+    """Route all messages to handler(level, text), or back to the
+    terminal with None. Returns the previous handler."""
+    global _LOG_HANDLER
+    previous, _LOG_HANDLER = _LOG_HANDLER, handler
+    return previous
+
+
+def _log(stream, level, msg, args):
+    text = msg % args if args else msg
+    if _LOG_HANDLER is not None:
+        _LOG_HANDLER(level, text)
+    elif level == "PROGRESS":
+        stream.write(text + "\n")
+    else:
+        stream.write("[%s] %s\n" % (level, text))
+
+
 def log_info(msg, *args):
-    print("[INFO]", msg % args if args else msg)
+    _log(sys.stdout, "INFO", msg, args)
 
 
 def log_warn(msg, *args):
-    print("[WARN]", msg % args if args else msg, file=sys.stderr)
+    _log(sys.stderr, "WARN", msg, args)
 
 
 def log_error(msg, *args):
-    print("[ERROR]", msg % args if args else msg, file=sys.stderr)
+    _log(sys.stderr, "ERROR", msg, args)
 
 
 def log_debug(msg, *args):
     if VERBOSE:
-        print("[DEBUG]", msg % args if args else msg, file=sys.stderr)
+        _log(sys.stderr, "DEBUG", msg, args)
+
+
+def log_job(ok, done_verb, fail_verb, name):
+    """A systemctl-style "[  OK  ] Started foo.service." progress line."""
+    mark = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
+    verb = done_verb if ok else fail_verb
+    _log(sys.stdout, "PROGRESS", "%s %s %s.", (mark, verb, name))
 
 
 def log_action(msg, *args):
@@ -170,6 +346,275 @@ def log_action(msg, *args):
         pass
 
 
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("rec", "idx")
+
+    def __init__(self, rec, idx):
+        self.rec = rec
+        self.idx = idx
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.rec._close(self.idx)
+        return False
+
+
+class Timings:
+    """Monotonic-clock phase spans for --timings and the boot blame file.
+    While disabled, span() returns a shared no-op context manager.
+    Each span is [phase, unit, depth, parent_index, start, end] with times
+    relative to the first span. Nesting is tracked per thread; spans opened
+    by worker threads hang off the span that was open when the pool started.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.root = -1
+        # Made up front, as the first span() may come from several worker
+        # threads at once; _thread is loaded anyway, unlike threading
+        self._local = _thread._local()
+        self._lock = _thread.allocate_lock()
+        self._origin = None
+
+    @property
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, phase, unit=None):
+        if not self.enabled:
+            return _NULL_SPAN
+        stack = self._stack
+        with self._lock:
+            now = time.monotonic()
+            if self._origin is None:
+                self._origin = now
+            parent = stack[-1] if stack else self.root
+            if unit is None:
+                unit = self.spans[parent][1] if parent >= 0 else ""
+            depth = self.spans[parent][2] + 1 if parent >= 0 else 0
+            self.spans.append([phase, unit, depth, parent, now - self._origin, None])
+            idx = len(self.spans) - 1
+        stack.append(idx)
+        return _Span(self, idx)
+
+    def current(self):
+        """Index of the innermost open span of this thread, or -1."""
+        stack = self._stack
+        return stack[-1] if stack else -1
+
+    def mark(self, phase, unit=None):
+        """Record an instantaneous event such as a unit becoming ready."""
+        if self.enabled:
+            with self.span(phase, unit):
+                pass
+
+    def _close(self, idx):
+        self.spans[idx][5] = time.monotonic() - self._origin
+        stack = self._stack
+        if stack and stack[-1] == idx:
+            stack.pop()
+        elif idx in stack:
+            stack.remove(idx)
+
+    def records(self):
+        """Spans as dicts (ms), in start order. Open spans count as 0 ms."""
+        out = []
+        for phase, unit, depth, parent, start, end in self.spans:
+            if end is None:
+                end = start
+            out.append(
+                {
+                    "phase": phase,
+                    "unit": unit,
+                    "depth": depth,
+                    "parent": parent,
+                    "start_ms": round(start * 1000.0, 3),
+                    "duration_ms": round((end - start) * 1000.0, 3),
+                }
+            )
+        return out
+
+    def save(self, path, command):
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(
+                    {
+                        "command": command,
+                        "timestamp": datetime.datetime.now().isoformat(),
+                        "spans": self.records(),
+                    },
+                    f,
+                )
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            log_debug("Failed to save timings to %s: %s", path, e)
+
+
+TIMINGS = Timings()
+
+
+def unit_self_times(records):
+    """Exclusive 'start' time per unit: a unit's start span minus the
+    start spans of dependencies it pulled in.
+    """
+    totals = {}
+    for i, r in enumerate(records):
+        if r["phase"] == "start":
+            totals[i] = r["duration_ms"]
+    for i in totals:
+        p = records[i]["parent"]
+        while p >= 0:
+            if records[p]["phase"] == "start":
+                totals[p] -= records[i]["duration_ms"]
+                break
+            p = records[p]["parent"]
+    result = {}
+    for i, ms in totals.items():
+        unit = records[i]["unit"]
+        result[unit] = result.get(unit, 0.0) + max(ms, 0.0)
+    return result
+
+
+def print_timings(records, limit=0):
+    """Print spans sorted by duration, slowest first."""
+    if not records:
+        print("No timing data recorded.")
+        return
+    rows = sorted(records, key=lambda r: r["duration_ms"], reverse=True)
+    if limit:
+        rows = rows[:limit]
+    print("%10s  %-40s %s" % ("TIME", "UNIT", "PHASE"))
+    print("-" * 80)
+    for r in rows:
+        print(
+            "%8.1fms  %-40s %s%s"
+            % (r["duration_ms"], r["unit"] or "-", "  " * r["depth"], r["phase"])
+        )
+
+
+def boot_unit_times(records):
+    """Per-unit activation timestamps (ms since the first span):
+    {unit: {"activating", "ready", "end", "self_ms", "ok", "pulled_by"}}.
+    A unit that never reached ready is reported with ok=False.
+    """
+    units = {}
+    self_times = unit_self_times(records)
+    for i, r in enumerate(records):
+        if r["phase"] != "start" or r["unit"] in units:
+            continue
+        pulled_by = ""
+        p = r["parent"]
+        while p >= 0:
+            if records[p]["phase"] == "start":
+                pulled_by = records[p]["unit"]
+                break
+            p = records[p]["parent"]
+        units[r["unit"]] = {
+            "activating": r["start_ms"],
+            "ready": None,
+            "end": r["start_ms"] + r["duration_ms"],
+            "self_ms": self_times.get(r["unit"], r["duration_ms"]),
+            "ok": False,
+            "pulled_by": pulled_by,
+        }
+    for r in records:
+        u = units.get(r["unit"])
+        if r["phase"] == "ready" and u and u["ready"] is None:
+            u["ready"] = r["start_ms"]
+            u["ok"] = True
+    for u in units.values():
+        if u["ready"] is None:
+            u["ready"] = u["end"]
+    return units
+
+
+def chrome_trace(records):
+    """Convert spans to Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+    events = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": 1,
+            "args": {"name": "serviced boot"},
+        }
+    ]
+    for r in records:
+        base = {
+            "name": r["unit"] if r["phase"] == "start" else r["phase"],
+            "cat": r["phase"],
+            "pid": 1,
+            "tid": 1,
+            "ts": int(r["start_ms"] * 1000),
+            "args": {"unit": r["unit"]},
+        }
+        if r["phase"] == "ready":
+            base.update({"ph": "i", "s": "t", "name": "%s ready" % r["unit"]})
+        else:
+            base.update({"ph": "X", "dur": int(r["duration_ms"] * 1000)})
+        events.append(base)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def svg_timeline(units):
+    """Render an activation timeline similar to systemd-analyze plot."""
+    rows = sorted(units.items(), key=lambda kv: kv[1]["activating"])
+    total = max([u["end"] for _, u in rows] or [1.0]) or 1.0
+    width, label_w, row_h = 1000.0, 260, 18
+    scale = (width - label_w - 20) / total
+    height = row_h * (len(rows) + 2)
+    out = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+        'font-family="monospace" font-size="11">' % (width, height),
+        '<rect width="100%" height="100%" fill="white"/>',
+        '<text x="4" y="12">serviced boot: %.1f ms</text>' % total,
+    ]
+    for i, (name, u) in enumerate(rows):
+        y = row_h * (i + 1)
+        x0 = label_w + u["activating"] * scale
+        x1 = label_w + u["ready"] * scale
+        x2 = label_w + u["end"] * scale
+        out.append(
+            '<text x="4" y="%d">%s</text>'
+            % (y + 12, name.replace("&", "&amp;").replace("<", "&lt;"))
+        )
+        out.append(
+            '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s"/>'
+            % (x0, y + 2, max(x1 - x0, 1), row_h - 4, "#e07070" if u["ok"] else "#a00")
+        )
+        if x2 > x1:
+            out.append(
+                '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="#70b070"/>'
+                % (x1, y + 2, x2 - x1, row_h - 4)
+            )
+        out.append(
+            '<text x="%.1f" y="%d">%.0fms</text>'
+            % (max(x1, x2) + 3, y + 12, u["self_ms"])
+        )
+    out.append("</svg>")
+    return "\n".join(out) + "\n"
+
+
 def _xdg_defaults():
     """Return XDG base directory defaults for the current user."""
     home = os.path.expanduser("~")
@@ -206,7 +651,7 @@ def resolve_unit_paths(user_mode=False):
 
 
 def ensure_dirs():
-    for d in [STATE_DIR, PID_DIR, LOG_DIR, STATUS_DIR]:
+    for d in [STATE_DIR, PID_DIR, LOG_DIR, STATUS_DIR, FROZEN_DIR, LOCK_DIR]:
         os.makedirs(d, mode=0o755, exist_ok=True)
     try:
         os.makedirs(ENABLED_DIR, mode=0o755, exist_ok=True)
@@ -244,13 +689,237 @@ def pid_exists(pid):
     return True
 
 
-def is_socket_alive(path):
-    if not os.path.exists(path):
+class ProcSnapshot:
+    """One listing of /proc shared by every PID check of a query, so
+    status/list over many units costs a single directory scan.
+    """
+
+    def __init__(self):
+        try:
+            self.pids = set(int(p) for p in os.listdir("/proc") if p.isdigit())
+        except OSError:
+            self.pids = None
+        self._zombie = {}
+        self._listeners = None
+
+    def socket_alive(self, path):
+        """is_socket_alive() from one /proc/net/unix read per snapshot."""
+        if not path.startswith("@") and not os.path.exists(path):
+            return False
+        if self._listeners is None:
+            self._listeners = UnixListeners()
+        return self._listeners.alive(path)
+
+    def alive(self, pid):
+        if pid <= 0:
+            return False
+        if self.pids is None:
+            return pid_exists(pid)
+        if pid not in self.pids:
+            return False
+        zombie = self._zombie.get(pid)
+        if zombie is None:
+            try:
+                with open("/proc/%d/stat" % pid) as f:
+                    zombie = f.read().rsplit(")", 1)[-1].split()[0] == "Z"
+            except (IOError, OSError, IndexError):
+                zombie = True
+            self._zombie[pid] = zombie
+        return not zombie
+
+    def session_members(self, sids):
+        """Live PIDs other than our own whose session id is in `sids`."""
+        if self.pids is None or not sids:
+            return set()
+        me = os.getpid()
+        found = set()
+        for pid in self.pids:
+            if pid == me:
+                continue
+            try:
+                with open("/proc/%d/stat" % pid) as f:
+                    fields = f.read().rsplit(")", 1)[-1].split()
+            except (IOError, OSError):
+                continue
+            try:
+                if fields[0] != "Z" and int(fields[3]) in sids:
+                    found.add(pid)
+            except (IndexError, ValueError):
+                continue
+        return found
+
+
+def process_tree(pid, proc=None):
+    """`pid` and, when it leads its own session (every unit spawned with
+    setsid() does), the other live members of that session."""
+    tree = {pid}
+    try:
+        if os.getsid(pid) == pid:
+            tree |= (proc or ProcSnapshot()).session_members({pid})
+    except OSError:
+        pass
+    return tree
+
+
+# Popen grew user=/group=/extra_groups= in 3.9 and process_group= in 3.11.
+# Without a preexec_fn CPython can spawn through vfork/posix_spawn instead
+# of a full fork of the interpreter, and stays safe to call from threads.
+_POPEN_CREDENTIALS = sys.version_info >= (3, 9)
+_POPEN_PROCESS_GROUP = sys.version_info >= (3, 11)
+
+
+def spawn_options(
+    uid=None, gid=None, groups=None, new_session=False, own_group=False
+):
+    """Popen keyword arguments that put the child in a new session (or
+    just its own process group) and switch to uid/gid with supplementary
+    `groups`. Falls back to a preexec_fn only on Pythons that lack the
+    keywords.
+    """
+    opts = {}
+    if new_session:
+        opts["start_new_session"] = True
+    elif own_group and _POPEN_PROCESS_GROUP:
+        opts["process_group"] = 0
+    if uid is None and gid is None:
+        return opts
+    if _POPEN_CREDENTIALS:
+        if gid is not None:
+            opts["group"] = gid
+        if groups is not None:
+            opts["extra_groups"] = groups
+        if uid is not None:
+            opts["user"] = uid
+        return opts
+
+    def preexec():
+        if groups is not None:
+            os.setgroups(groups)
+        if gid is not None:
+            os.setgid(gid)
+        if uid is not None:
+            os.setuid(uid)
+
+    opts["preexec_fn"] = preexec
+    return opts
+
+
+def stream_output(proc, out, tag, deadline=None, keep=20):
+    """Copy proc's stdout into the binary file `out` as it arrives, each
+    line prefixed with "[tag] ", until EOF, HELPER_DRAIN_SEC after the
+    process exits, or until the monotonic `deadline` passes. Memory stays
+    bounded: the pipe is read in chunks and lines longer than
+    HELPER_LINE_MAX are split. Returns (finished, tail) where tail holds
+    the last `keep` lines as text.
+    """
+    fd = proc.stdout.fileno()
+    prefix = ("[%s] " % tag).encode() if tag else b""
+    tail = []
+    partial = b""
+    finished = True
+    exited = None
+
+    def emit(lines):
+        if any(len(line) > HELPER_LINE_MAX for line in lines):
+            lines = [
+                line[i : i + HELPER_LINE_MAX]
+                for line in lines
+                for i in range(0, max(len(line), 1), HELPER_LINE_MAX)
+            ]
+        if out is not None:
+            out.write(b"".join(prefix + line + b"\n" for line in lines))
+            out.flush()
+        tail.extend(lines[-keep:])
+        del tail[:-keep]
+
+    while True:
+        wait = 0.1
+        now = time.monotonic()
+        if exited is None and proc.poll() is not None:
+            exited = now
+        if exited is not None:
+            # Exited, but a daemonized grandchild may hold the pipe open
+            left = exited + HELPER_DRAIN_SEC - now
+            if left <= 0:
+                _drain_detached(fd, out)
+                break
+            wait = min(wait, left)
+        if deadline is not None:
+            left = deadline - now
+            if left <= 0:
+                finished = False
+                break
+            wait = min(wait, left)
+        ready, _, _ = select.select([fd], [], [], wait)
+        if not ready:
+            continue
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        if len(partial) > HELPER_LINE_MAX:
+            lines.append(partial)
+            partial = b""
+        if lines:
+            emit(lines)
+    if partial:
+        emit([partial])
+    return finished, [t.decode("utf-8", "replace") for t in tail]
+
+
+def _drain_detached(fd, out):
+    """Leave the rest of a pipe that a daemonized grandchild still holds
+    to a detached cat appending to `out` (unprefixed), so the grandchild
+    does not get SIGPIPE once we close our end."""
+    try:
+        subprocess.Popen(
+            ["cat"],
+            stdin=fd,
+            stdout=subprocess.DEVNULL if out is None else out,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        log_debug("Cannot hand over helper output: %s", e)
+
+
+def stop_process_group(proc, signum, grace):
+    """Send `signum` to proc's process group (just proc when it shares
+    ours), then SIGKILL whatever is left after `grace` seconds."""
+    try:
+        pgid = os.getpgid(proc.pid)
+    except OSError:
+        pgid = None
+    own = pgid is not None and pgid != os.getpgid(0)
+
+    def send(sig):
+        try:
+            if own:
+                os.killpg(pgid, sig)
+            else:
+                os.kill(proc.pid, sig)
+        except OSError:
+            pass
+
+    send(signum)
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    send(signal.SIGKILL)
+    proc.wait()
+
+
+def _connect_probe(path, timeout=1.0):
+    if path.startswith("@"):
+        path = "\0" + path[1:]
+    elif not os.path.exists(path):
         return False
     for stype in (socketmod.SOCK_STREAM, socketmod.SOCK_DGRAM):
         try:
             s = socketmod.socket(socketmod.AF_UNIX, stype)
-            s.settimeout(1)
+            s.settimeout(timeout)
             s.connect(path)
             s.close()
             return True
@@ -259,6 +928,331 @@ def is_socket_alive(path):
     return False
 
 
+class UnixListeners:
+    """One parse of /proc/net/unix: every bound path that accepts
+    connections (a listening stream/seqpacket socket or a bound datagram
+    socket), so liveness checks of many sockets cost one read and no
+    connect() that could block on a full backlog or show up as a client.
+
+    The kernel lists paths as they were bound, so a socket bound under
+    another root (a bind mount, the host side of a chroot) or by a
+    relative path appears under a different name; only then, and for
+    abstract names, alive() falls back to connecting.
+    """
+
+    ACCEPTCON = 0x10000
+
+    def __init__(self, path="/proc/net/unix"):
+        self.paths = set()
+        self.abstract = set()
+        self._names = set()
+        try:
+            lines = _read_proc(path).splitlines()
+        except (IOError, OSError):
+            self.paths = None
+            return
+        for line in lines[1:]:
+            fields = line.split(None, 7)
+            if len(fields) < 8:
+                continue
+            try:
+                flags = int(fields[3], 16)
+            except ValueError:
+                continue
+            if fields[4] != "0002" and not flags & self.ACCEPTCON:
+                continue
+            bound = fields[7]
+            if bound.startswith("@"):
+                self.abstract.add(bound[1:])
+            else:
+                self.paths.add(bound)
+                self._names.add(bound.rpartition("/")[2])
+
+    def alive(self, path):
+        if self.paths is None:
+            return _connect_probe(path)
+        if path.startswith("@"):
+            return path[1:] in self.abstract or _connect_probe(path, 0.2)
+        if path in self.paths:
+            return os.path.exists(path)
+        if path.rpartition("/")[2] in self._names:
+            return _connect_probe(path)
+        return False
+
+
+def is_socket_alive(path, listeners=None):
+    """Whether something accepts connections on unix socket `path` (a
+    filesystem path or '@abstract'). Pass a UnixListeners to share one
+    snapshot between several checks."""
+    if listeners is None:
+        if not path.startswith("@") and not os.path.exists(path):
+            return False
+        listeners = UnixListeners()
+    return listeners.alive(path)
+
+
+def any_socket_alive(paths):
+    """Whether any of `paths` is alive, from one /proc/net/unix snapshot."""
+    paths = [p for p in paths if p.startswith("@") or os.path.exists(p)]
+    if not paths:
+        return False
+    listeners = UnixListeners()
+    return any(listeners.alive(p) for p in paths)
+
+
+def socket_inodes(pids):
+    """Inodes of every socket the processes `pids` hold open."""
+    inodes = set()
+    for pid in pids:
+        fd_dir = "/proc/%d/fd" % pid
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(int(target[8:-1]))
+    return inodes
+
+
+def tcp_listeners():
+    """{port: set of socket inodes} for every listening TCP socket in
+    /proc/net/tcp and /proc/net/tcp6."""
+    ports = {}
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            lines = _read_proc(path).splitlines()
+        except (IOError, OSError):
+            continue
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 10 or fields[3] != "0A":
+                continue
+            try:
+                port = int(fields[1].rpartition(":")[2], 16)
+                ports.setdefault(port, set()).add(int(fields[9]))
+            except ValueError:
+                continue
+    return ports
+
+
+def pending_connections(inodes):
+    """The listening sockets among `inodes` with connections queued that
+    nobody has accepted yet: TCP ones whose accept backlog (rx_queue of
+    the LISTEN line) is not empty, and unix ones that have a server end
+    listed under their path with no inode, which the kernel gives it only
+    at accept()."""
+    found = set()
+    if not inodes:
+        return found
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            lines = _read_proc(path).splitlines()
+        except (IOError, OSError):
+            continue
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 10 or fields[3] != "0A":
+                continue
+            try:
+                inode = int(fields[9])
+                if inode in inodes and int(fields[4].partition(":")[2], 16):
+                    found.add(inode)
+            except ValueError:
+                continue
+    try:
+        lines = _read_proc("/proc/net/unix").splitlines()
+    except (IOError, OSError):
+        return found
+    listening = {}
+    embryos = set()
+    for line in lines[1:]:
+        fields = line.split(None, 7)
+        if len(fields) < 8:
+            continue
+        try:
+            flags = int(fields[3], 16)
+            inode = int(fields[6])
+        except ValueError:
+            continue
+        if flags & UnixListeners.ACCEPTCON:
+            if inode in inodes:
+                listening[fields[7]] = inode
+        elif inode == 0:
+            embryos.add(fields[7])
+    found.update(inode for path, inode in listening.items() if path in embryos)
+    return found
+
+
+# Mount point of the cgroup v2 hierarchy, looked up once: [path or None]
+_CGROUP2_MOUNT = []
+
+
+def cgroup2_mount():
+    if not _CGROUP2_MOUNT:
+        found = None
+        try:
+            for line in _read_proc("/proc/self/mountinfo").splitlines():
+                left, _, right = line.partition(" - ")
+                if right.split(" ", 1)[0] == "cgroup2":
+                    found = left.split()[4]
+                    break
+        except (IOError, OSError, IndexError):
+            pass
+        _CGROUP2_MOUNT.append(found)
+    return _CGROUP2_MOUNT[0]
+
+
+def unit_cgroup(pid):
+    """The cgroup v2 directory of `pid` when it is not the root one and
+    has cgroup.freeze (Linux 5.2+), else None."""
+    mount = cgroup2_mount()
+    if not mount:
+        return None
+    try:
+        text = _read_proc("/proc/%d/cgroup" % pid)
+    except (IOError, OSError):
+        return None
+    for line in text.splitlines():
+        if line.startswith("0::"):
+            rel = line[3:]
+            if rel in ("", "/") or rel.endswith(" (deleted)"):
+                return None
+            path = mount + rel
+            if os.path.exists(os.path.join(path, "cgroup.freeze")):
+                return path
+    return None
+
+
+def cgroup_procs(path):
+    """PIDs in cgroup `path`, or None if it cannot be read."""
+    try:
+        text = _read_text(os.path.join(path, "cgroup.procs"))
+        return set(int(p) for p in text.split())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def cgroup_set_frozen(path, frozen, timeout=1.0):
+    """Write cgroup.freeze and wait (up to `timeout`) for cgroup.events
+    to report the new state. False if the write failed."""
+    try:
+        with open(os.path.join(path, "cgroup.freeze"), "w") as f:
+            f.write("1" if frozen else "0")
+    except (IOError, OSError) as e:
+        log_debug("cgroup.freeze of %s: %s", path, e)
+        return False
+    want = "frozen %d" % bool(frozen)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if want in _read_text(os.path.join(path, "cgroup.events")).splitlines():
+                break
+        except (IOError, OSError):
+            break
+        time.sleep(0.01)
+    return True
+
+
+class ReadinessProbe:
+    """Opt-in readiness check for units started like Type=simple, read
+    from [Service] keys systemd ignores, usually set in a drop-in:
+
+        X-ServicedReadyListen=8080 [::1]:9090   TCP ports to listen on
+        X-ServicedReadySocket=/run/app.sock     unix sockets to listen on
+        X-ServicedReadyLog=^Server started      regex the output must match
+        X-ServicedReadyTimeoutSec=30            default TimeoutStartSec=
+
+    The unit is ready once every configured condition holds. A TCP port
+    only counts when the socket listening on it belongs to the unit's
+    session (its process tree), so another process holding the port does
+    not make it ready; the log is searched from where it stood at spawn.
+    """
+
+    def __init__(self, unit, log_file):
+        self.ports = []
+        for word in unit.getlist("Service", "X-ServicedReadyListen"):
+            for spec in word.split():
+                try:
+                    self.ports.append(int(spec.rpartition(":")[2]))
+                except ValueError:
+                    log_warn("Ignoring X-ServicedReadyListen=%s", spec)
+        self.sockets = []
+        for word in unit.getlist("Service", "X-ServicedReadySocket"):
+            self.sockets.extend(word.split())
+        self.pattern = None
+        text = unit.get("Service", "X-ServicedReadyLog", "")
+        if text:
+            try:
+                self.pattern = re.compile(text, re.M)
+            except re.error as e:
+                log_warn("Ignoring X-ServicedReadyLog=%s: %s", text, e)
+        self.timeout = parse_timespan(
+            unit.get("Service", "X-ServicedReadyTimeoutSec", ""),
+            unit.timeout_start,
+        )
+        self.log_file = log_file
+        try:
+            self._offset = os.path.getsize(log_file)
+        except OSError:
+            self._offset = 0
+        self._tail = ""
+        self._log_seen = self.pattern is None
+
+    @classmethod
+    def for_unit(cls, unit, log_file):
+        """A probe for `unit`, or None if it configures none."""
+        for key in ("X-ServicedReadyListen", "X-ServicedReadySocket"):
+            if unit.getlist("Service", key):
+                return cls(unit, log_file)
+        if unit.get("Service", "X-ServicedReadyLog", ""):
+            return cls(unit, log_file)
+        return None
+
+    def __bool__(self):
+        return bool(self.ports or self.sockets or self.pattern)
+
+    def _log_matches(self):
+        try:
+            with open(self.log_file, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except (IOError, OSError):
+            return False
+        if not data:
+            return False
+        self._offset += len(data)
+        text = self._tail + data.decode("utf-8", "replace")
+        if self.pattern.search(text):
+            return True
+        self._tail = text[-HELPER_LINE_MAX:]
+        return False
+
+    def pending(self, pid):
+        """The conditions not met yet, as text; empty once ready."""
+        left = []
+        if self.ports:
+            mine = socket_inodes(process_tree(pid))
+            listening = tcp_listeners()
+            left.extend(
+                "port %d" % port
+                for port in self.ports
+                if not listening.get(port, set()) & mine
+            )
+        if self.sockets:
+            listeners = UnixListeners()
+            left.extend(p for p in self.sockets if not listeners.alive(p))
+        if not self._log_seen:
+            self._log_seen = self._log_matches()
+            if not self._log_seen:
+                left.append("log /%s/" % self.pattern.pattern)
+        return ", ".join(left)
+
+
 def resolve_signal(sig):
     """Resolve signal name or number ('SIGTERM', 'TERM', '15') to int."""
     if isinstance(sig, int):
@@ -273,49 +1267,173 @@ def resolve_signal(sig):
     return getattr(signal, s, None)
 
 
+def order_layers(names, edges):
+    """Group `names` into layers so that every unit comes after the units
+    it depends on (`edges` maps name -> set of names it must follow).
+    Units within a layer are independent of each other. A cycle is broken
+    by emitting all remaining units as one layer, in input order.
+    """
+    remaining = list(names)
+    done = set()
+    layers = []
+    while remaining:
+        layer = [n for n in remaining if edges.get(n, set()) <= done]
+        if not layer:
+            log_debug("Ordering cycle among: %s", " ".join(remaining))
+            layer = list(remaining)
+        layers.append(layer)
+        done.update(layer)
+        remaining = [n for n in remaining if n not in done]
+    return layers
+
+
+def emit_records(records, output):
+    """Write records as one JSON array, or as NDJSON one line at a time
+    so consumers see each record as soon as it is built.
+    """
+    if output == "ndjson":
+        for rec in records:
+            sys.stdout.write(json.dumps(rec) + "\n")
+            sys.stdout.flush()
+        return
+    json.dump(list(records), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def _read_text(path):
+    """Whole file as str from unbuffered os.read() calls; a third of the
+    cost of open().read() for the small files a unit tree is made of."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        chunks = [os.read(fd, 65536)]
+        while len(chunks[-1]) == 65536:
+            chunks.append(os.read(fd, 65536))
+    finally:
+        os.close(fd)
+    return b"".join(chunks).decode("utf-8", "replace")
+
+
+def _read_proc(path):
+    """Like _read_text for /proc files, which come a page per read()."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        chunks = [os.read(fd, 65536)]
+        while chunks[-1]:
+            chunks.append(os.read(fd, 65536))
+    finally:
+        os.close(fd)
+    return b"".join(chunks).decode("utf-8", "replace")
+
+
+def _parse_unit_text(text, data, origins=None, source=None):
+    """Tokenise one unit file in a single pass over its lines into
+    data[section][key] -> tuple, with systemd's rules: whitespace around
+    lines, keys and values is dropped; a line ending in an unescaped
+    backslash continues on the next one, the backslash becoming a space;
+    comment lines (# or ;) inside a continuation are skipped; an empty
+    assignment clears the values. Quotes are left to the key's own
+    parser. Malformed lines and keys outside a section are ignored.
+    With `origins`, origins[(section, key)] = source for each assignment.
+    """
+    intern = sys.intern
+    name = section = None
+    pending = None
+    lines = text.split("\n")
+    if lines[-1]:
+        lines.append("")  # flushes a continuation on the last line
+    for line in lines:
+        line = line.strip()
+        if pending is not None:
+            if line and line[0] in "#;":
+                continue
+            line = pending + line
+            pending = None
+            if line.isspace():
+                continue
+        elif not line or line[0] in "#;":
+            continue
+        if line[-1] == "\\" and (len(line) - len(line.rstrip("\\"))) % 2:
+            pending = line[:-1] + " "
+            continue
+        if line[0] == "[":
+            if line[-1] == "]" and len(line) > 2:
+                name = intern(line[1:-1])
+                section = data.setdefault(name, {})
+            else:
+                section = None
+            continue
+        if section is None:
+            continue
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        key = intern(key.strip())
+        value = value.strip()
+        if not value:
+            section[key] = ()
+        elif key in section:
+            section[key] += (value,)
+        else:
+            section[key] = (value,)
+        if origins is not None:
+            origins[(name, key)] = source
+
+
 class UnitFile:
-    def __init__(self, path=None):
+    """One parsed unit file. Each section maps interned key names to a
+    tuple of values. Derived views (dependency names, Environment=) are
+    built on first use and kept, so graph walks over a large tree do not
+    re-split or copy anything; treat whatever they return as read-only.
+    """
+
+    __slots__ = ("path", "dropins", "_data", "_cache", "_origins")
+
+    def __init__(self, path=None, dropins=()):
         self.path = path
+        self.dropins = tuple(dropins)
         self._data = {}
+        self._cache = {}
+        self._origins = None
         if path:
-            self.parse(path)
-
-    def parse(self, path):
+            self.parse(path, dropins)
+
+    @classmethod
+    def from_text(cls, text, path=None):
+        unit = cls()
+        unit.path = path
+        _parse_unit_text(text, unit._data)
+        return unit
+
+    def parse(self, path, dropins=()):
+        """Read `path`, then each drop-in in order into the same sections,
+        so a drop-in's empty Key= clears what the unit file set.
+        """
         self.path = path
+        self.dropins = tuple(dropins)
+        self._cache = {}
         self._data = {}
-        section = None
-        try:
-            with open(path, "r") as f:
-                prev_line = ""
-                for raw_line in f:
-                    line = raw_line.rstrip("\n")
-                    if line.endswith("\\"):
-                        prev_line += line[:-1].strip() + " "
-                        continue
-                    if prev_line:
-                        line = prev_line + line.strip()
-                        prev_line = ""
-                    line = line.strip()
-                    if not line or line.startswith("#") or line.startswith(";"):
-                        continue
-                    m = re.match(r"^\[(.+)\]$", line)
-                    if m:
-                        section = m.group(1)
-                        if section not in self._data:
-                            self._data[section] = {}
-                        continue
-                    if section and "=" in line:
-                        key, _, value = line.partition("=")
-                        key = key.strip()
-                        value = value.strip()
-                        if key not in self._data[section]:
-                            self._data[section][key] = []
-                        if value == "":
-                            self._data[section][key] = []
-                        else:
-                            self._data[section][key].append(value)
-        except (IOError, OSError) as e:
-            log_debug("Failed to parse %s: %s", path, e)
+        # Without drop-ins every key comes from `path`; skip the bookkeeping
+        self._origins = {} if self.dropins else None
+        for fpath in (path,) + self.dropins:
+            try:
+                text = _read_text(fpath)
+            except (IOError, OSError) as e:
+                log_debug("Failed to parse %s: %s", fpath, e)
+                continue
+            _parse_unit_text(text, self._data, self._origins, fpath)
+
+    def origin(self, section, key):
+        """The file whose assignment of section/key took effect last (an
+        empty one included), None if no file sets it."""
+        if self._origins is not None:
+            return self._origins.get((section, key))
+        return self.path if key in self._data.get(section, ()) else None
+
+    def items(self):
+        """(section, key, values) for every key set, in file order."""
+        for section, keys in self._data.items():
+            for key, values in keys.items():
+                yield section, key, values
 
     def get(self, section, key, default=""):
         try:
@@ -325,10 +1443,11 @@ class UnitFile:
             return default
 
     def getlist(self, section, key):
+        """Every value of section/key in order, as a tuple."""
         try:
-            return list(self._data[section][key])
+            return self._data[section][key]
         except KeyError:
-            return []
+            return ()
 
     def getbool(self, section, key, default=False):
         val = self.get(section, key, "")
@@ -339,6 +1458,20 @@ class UnitFile:
     def has_section(self, section):
         return section in self._data
 
+    def _split(self, section, key):
+        """Whitespace-separated names from every section/key line, as a
+        cached tuple of interned strings (unit names repeat across a tree).
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        names = tuple(
+            sys.intern(n) for value in self.getlist(section, key) for n in value.split()
+        )
+        self._cache[key] = names
+        return names
+
     @property
     def description(self):
         return self.get("Unit", "Description", os.path.basename(self.path or "unknown"))
@@ -349,28 +1482,27 @@ class UnitFile:
 
     @property
     def requires(self):
-        val = self.get("Unit", "Requires", "")
-        return val.split() if val else []
+        return self._split("Unit", "Requires")
 
     @property
     def wants(self):
-        val = self.get("Unit", "Wants", "")
-        return val.split() if val else []
+        return self._split("Unit", "Wants")
 
     @property
     def after(self):
-        val = self.get("Unit", "After", "")
-        return val.split() if val else []
+        return self._split("Unit", "After")
+
+    @property
+    def before(self):
+        return self._split("Unit", "Before")
 
     @property
     def binds_to(self):
-        val = self.get("Unit", "BindsTo", "")
-        return val.split() if val else []
+        return self._split("Unit", "BindsTo")
 
     @property
     def part_of(self):
-        val = self.get("Unit", "PartOf", "")
-        return val.split() if val else []
+        return self._split("Unit", "PartOf")
 
     @property
     def condition_path_exists(self):
@@ -418,17 +1550,27 @@ class UnitFile:
 
     @property
     def environment(self):
-        env = {}
-        for val in self.getlist("Service", "Environment"):
-            val = val.strip('"').strip("'")
-            if "=" in val:
-                k, _, v = val.partition("=")
-                env[k.strip()] = v.strip()
+        """Environment= assignments; each line holds one or more
+        space-separated, optionally quoted KEY=VALUE words."""
+        env = self._cache.get("Environment")
+        if env is None:
+            env = {}
+            for val in self.getlist("Service", "Environment"):
+                try:
+                    words = shlex.split(val)
+                except ValueError:
+                    words = val.split()
+                for word in words:
+                    k, sep, v = word.partition("=")
+                    if sep and env_name_is_valid(k):
+                        env[k] = v
+            self._cache["Environment"] = env
         return env
 
     @property
-    def environment_file(self):
-        return self.get("Service", "EnvironmentFile", "")
+    def environment_files(self):
+        """Every EnvironmentFile= path in order, '-' marking optional ones."""
+        return self.getlist("Service", "EnvironmentFile")
 
     @property
     def remain_after_exit(self):
@@ -446,10 +1588,56 @@ class UnitFile:
     def kill_signal(self):
         return self.get("Service", "KillSignal", "SIGTERM")
 
+    @property
+    def login_critical(self):
+        """X-ServicedLoginCritical=: start --background starts the unit
+        before it detaches, so login waits for it."""
+        return self.getbool("Service", "X-ServicedLoginCritical", False)
+
+    @property
+    def priority(self):
+        """X-ServicedPriority=, one of PRIORITY_CLASSES; "normal" if unset
+        or unknown."""
+        value = self.get("Service", "X-ServicedPriority", "").lower()
+        return value if value in PRIORITY_OOM_SCORE else "normal"
+
+    @property
+    def oom_score_adjust(self):
+        """OOMScoreAdjust=, else the default of the priority class; None
+        to leave the inherited value alone."""
+        try:
+            value = int(self.get("Service", "OOMScoreAdjust", ""))
+        except ValueError:
+            return PRIORITY_OOM_SCORE[self.priority]
+        return max(-1000, min(1000, value))
+
+    @property
+    def pressure_action(self):
+        """X-ServicedPressureAction=: stop (default), freeze or restart."""
+        value = self.get("Service", "X-ServicedPressureAction", "").lower()
+        return value if value in ("freeze", "restart") else "stop"
+
+    @property
+    def timeout_start(self):
+        """TimeoutStartSec= in seconds, None for no limit. Like systemd,
+        Type=oneshot units wait forever unless told otherwise."""
+        default = None if self.service_type == "oneshot" else DEFAULT_TIMEOUT_SEC
+        value = self.get("Service", "TimeoutStartSec", "") or self.get(
+            "Service", "TimeoutSec", ""
+        )
+        return parse_timespan(value, default)
+
+    @property
+    def timeout_stop(self):
+        """TimeoutStopSec= in seconds, None for no limit."""
+        value = self.get("Service", "TimeoutStopSec", "") or self.get(
+            "Service", "TimeoutSec", ""
+        )
+        return parse_timespan(value, DEFAULT_TIMEOUT_SEC)
+
     @property
     def sockets(self):
-        val = self.get("Service", "Sockets", "")
-        return val.split() if val else []
+        return self._split("Service", "Sockets")
 
     @property
     def listen_stream(self):
@@ -460,40 +1648,419 @@ class UnitFile:
         return self.get("Socket", "Service", "")
 
 
-def parse_exec_cmd(cmd_str):
-    """Parse a systemd ExecStart= line, handling prefix chars like '-+!@:'."""
-    cmd = cmd_str.strip()
-    check_errors = True
-    while cmd and cmd[0] in "-+!@:":
-        if cmd[0] == "-":
-            check_errors = False
-        cmd = cmd[1:]
-    cmd = cmd.strip()
-    if not cmd:
-        return check_errors, []
-    try:
-        parts = shlex.split(cmd)
-    except ValueError:
-        parts = cmd.split()
-    return check_errors, parts
+# Keys where each assignment adds to a list; for every other key the
+# last assignment wins. Condition*= and Assert*= accumulate as well.
+LIST_KEYS = frozenset(
+    (
+        "After",
+        "Alias",
+        "Also",
+        "Before",
+        "BindsTo",
+        "Conflicts",
+        "Documentation",
+        "Environment",
+        "EnvironmentFile",
+        "ExecReload",
+        "ExecStart",
+        "ExecStartPost",
+        "ExecStartPre",
+        "ExecStop",
+        "ExecStopPost",
+        "ListenDatagram",
+        "ListenStream",
+        "PartOf",
+        "RequiredBy",
+        "Requires",
+        "Requisite",
+        "Sockets",
+        "Upholds",
+        "WantedBy",
+        "Wants",
+        "X-ServicedReadyListen",
+        "X-ServicedReadySocket",
+    )
+)
 
 
-def expand_env(cmd_parts, env):
-    result = []
-    for part in cmd_parts:
-        expanded = part
-        for m in re.finditer(r"\$\{([^}]+)\}", part):
-            var = m.group(1)
-            val = env.get(var, os.environ.get(var, ""))
-            expanded = expanded.replace(m.group(0), val)
-        for m in re.finditer(r"\$([A-Za-z_][A-Za-z0-9_]*)", expanded):
-            var = m.group(1)
-            val = env.get(var, os.environ.get(var, ""))
-            expanded = expanded.replace(m.group(0), val)
-        if expanded == "" and part != expanded:
+def is_list_key(key):
+    return key in LIST_KEYS or key.startswith(("Condition", "Assert"))
+
+
+# Parsed units by (unit file, unit name), reused while the stamps of the
+# file, its drop-in directories and drop-ins are unchanged; see
+# ServiceManager._unit_file.
+_UNIT_CACHE = {}
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def dropin_dir_names(name):
+    """Drop-in directory names for unit `name`, most specific first:
+    foo-bar-baz.service.d, foo-bar-.service.d, foo-.service.d, service.d
+    for foo-bar-baz.service; foo-bar@x.service.d, foo-bar@.service.d,
+    foo-.service.d, service.d for foo-bar@x.service.
+    """
+    base, _, suffix = name.rpartition(".")
+    names = [name + ".d"]
+    if "@" in base:
+        base = base.split("@", 1)[0]
+        names.append("%s@.%s.d" % (base, suffix))
+    parts = base.split("-")
+    for i in range(len(parts) - 1, 0, -1):
+        names.append("%s-.%s.d" % ("-".join(parts[:i]), suffix))
+    names.append(suffix + ".d")
+    return names
+
+
+def collect_dropins(dirs):
+    """The *.conf files of drop-in directories listed most specific and
+    highest priority first, as systemd applies them: one file per name,
+    the first directory having it wins (a /dev/null symlink masks the
+    name), applied in file name order whichever directory they sit in.
+    """
+    chosen = {}
+    for d in dirs:
+        try:
+            entries = os.listdir(d)
+        except OSError:
             continue
-        result.append(expanded)
-    return result
+        for fname in entries:
+            if fname.endswith(".conf") and fname not in chosen:
+                chosen[fname] = os.path.join(d, fname)
+    dropins = []
+    for fname in sorted(chosen):
+        path = chosen[fname]
+        if os.path.islink(path) and os.readlink(path) == "/dev/null":
+            continue
+        dropins.append(path)
+    return tuple(dropins)
+
+
+_TIMESPAN_UNITS = {
+    "usec": 1e-6,
+    "us": 1e-6,
+    "msec": 1e-3,
+    "ms": 1e-3,
+    "seconds": 1.0,
+    "second": 1.0,
+    "sec": 1.0,
+    "s": 1.0,
+    "minutes": 60.0,
+    "minute": 60.0,
+    "min": 60.0,
+    "m": 60.0,
+    "hours": 3600.0,
+    "hour": 3600.0,
+    "hr": 3600.0,
+    "h": 3600.0,
+    "days": 86400.0,
+    "day": 86400.0,
+    "d": 86400.0,
+}
+
+
+def parse_timespan(value, default=None):
+    """Seconds for a systemd time span ("90", "1min 30s", "500ms").
+    "infinity" and "0" mean no limit and give None; anything unparsable
+    gives `default`.
+    """
+    value = (value or "").strip().lower()
+    if not value:
+        return default
+    if value == "infinity":
+        return None
+    total = 0.0
+    pos = 0
+    for m in re.finditer(r"\s*([0-9]+(?:\.[0-9]*)?)\s*([a-z]*)", value):
+        unit = m.group(2)
+        if m.start() != pos or (unit and unit not in _TIMESPAN_UNITS):
+            return default
+        total += float(m.group(1)) * _TIMESPAN_UNITS.get(unit, 1.0)
+        pos = m.end()
+    if pos != len(value):
+        return default
+    return total or None
+
+
+def unit_unescape(text):
+    """systemd's unit name unescaping: '-' is '/', \\xNN a byte."""
+    if "-" not in text and "\\" not in text:
+        return text
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "-":
+            out.append("/")
+        elif c == "\\" and text[i + 1 : i + 2] == "x" and i + 4 <= n:
+            try:
+                out.append(chr(int(text[i + 2 : i + 4], 16)))
+                i += 4
+                continue
+            except ValueError:
+                out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return ""
+
+
+def unit_specifier(ch, name, unit, user_mode=False):
+    """Value of the systemd specifier %<ch> in unit `name`, None when it
+    is not one serviced knows. User specifiers follow User= and fall back
+    to the user serviced runs as.
+    """
+    prefix = name.rpartition(".")[0] or name
+    head, _, instance = prefix.partition("@")
+    if ch == "%":
+        return "%"
+    if ch == "n":
+        return name
+    if ch == "N":
+        return prefix
+    if ch == "p":
+        return head
+    if ch == "P":
+        return unit_unescape(head)
+    if ch == "i":
+        return instance
+    if ch == "I":
+        return unit_unescape(instance)
+    if ch == "j":
+        return head.rsplit("-", 1)[-1]
+    if ch == "J":
+        return unit_unescape(head.rsplit("-", 1)[-1])
+    if ch == "f":
+        return "/" + unit_unescape(instance or head).lstrip("/")
+    if ch in "hugUG":
+        try:
+            pw = pwd.getpwnam(unit.user) if unit.user else pwd.getpwuid(os.geteuid())
+        except KeyError:
+            return None
+        if ch == "h":
+            return pw.pw_dir
+        if ch == "u":
+            return pw.pw_name
+        if ch == "U":
+            return str(pw.pw_uid)
+        try:
+            gr = grp.getgrnam(unit.group) if unit.group else grp.getgrgid(pw.pw_gid)
+        except KeyError:
+            return None
+        return gr.gr_name if ch == "g" else str(gr.gr_gid)
+    if ch in "tSCLE":
+        if not user_mode:
+            return {
+                "t": "/run",
+                "S": "/var/lib",
+                "C": "/var/cache",
+                "L": "/var/log",
+                "E": "/etc",
+            }[ch]
+        home = os.path.expanduser("~")
+        if ch == "t":
+            return os.environ.get("XDG_RUNTIME_DIR") or "/run/user/%d" % os.getuid()
+        if ch == "S":
+            return os.environ.get("XDG_STATE_HOME") or home + "/.local/state"
+        if ch == "C":
+            return os.environ.get("XDG_CACHE_HOME") or home + "/.cache"
+        if ch == "L":
+            state = os.environ.get("XDG_STATE_HOME") or home + "/.local/state"
+            return state + "/log"
+        return os.environ.get("XDG_CONFIG_HOME") or home + "/.config"
+    if ch == "T":
+        return os.environ.get("TMPDIR") or "/tmp"
+    if ch == "V":
+        return os.environ.get("TMPDIR") or "/var/tmp"
+    if ch == "H":
+        return os.uname().nodename
+    if ch == "l":
+        return os.uname().nodename.split(".", 1)[0]
+    if ch == "v":
+        return os.uname().release
+    if ch == "m":
+        return _read_first_line("/etc/machine-id")
+    if ch == "b":
+        return _read_first_line("/proc/sys/kernel/random/boot_id").replace("-", "")
+    return None
+
+
+def expand_specifiers(text, resolve):
+    """Replace %X in `text` with resolve(X); unknown ones stay as they are."""
+    if "%" not in text:
+        return text
+    out = []
+    i = 0
+    while True:
+        j = text.find("%", i)
+        if j < 0 or j + 1 >= len(text):
+            out.append(text[i:])
+            break
+        out.append(text[i:j])
+        value = resolve(text[j + 1])
+        if value is None:
+            out.append(text[j : j + 2])
+        else:
+            out.append(value)
+        i = j + 2
+    return "".join(out)
+
+
+def _var_end(word, start):
+    """End of the variable name starting at word[start]."""
+    end = start
+    n = len(word)
+    if end < n and (word[end].isdigit() or not word[end].isascii()):
+        return start
+    while end < n and word[end].isascii() and (word[end].isalnum() or word[end] == "_"):
+        end += 1
+    return end
+
+
+def _compile_word(word):
+    """(split, pieces) for one word: pieces are literal strings and
+    (name, op, arg) references, op being None, "-" (${VAR:-arg}) or "+"
+    (${VAR:+arg}). split is set for a word that is exactly $VAR.
+    """
+    if word[:1] == "$" and len(word) > 1 and _var_end(word, 1) == len(word):
+        return True, ((word[1:], None, None),)
+    pieces = []
+    lit = []
+    i = 0
+    while True:
+        j = word.find("$", i)
+        if j < 0:
+            lit.append(word[i:])
+            break
+        lit.append(word[i:j])
+        nxt = word[j + 1 : j + 2]
+        if nxt == "$":
+            lit.append("$")
+            i = j + 2
+            continue
+        if nxt == "{":
+            k = word.find("}", j + 2)
+            body = word[j + 2 : k] if k >= 0 else ""
+            name, op, arg = body, None, None
+            for marker in (":-", ":+"):
+                if marker in body:
+                    name, _, arg = body.partition(marker)
+                    op = marker[1]
+                    break
+            if k < 0 or not name or _var_end(name, 0) != len(name):
+                lit.append("$")
+                i = j + 1
+                continue
+            ref = (name, op, arg)
+            i = k + 1
+        else:
+            end = _var_end(word, j + 1)
+            if end == j + 1:
+                lit.append("$")
+                i = j + 1
+                continue
+            ref = (word[j + 1 : end], None, None)
+            i = end
+        if lit:
+            pieces.append("".join(lit))
+            lit = []
+        pieces.append(ref)
+    text = "".join(lit)
+    if text or not pieces:
+        pieces.append(text)
+    return False, tuple(pieces)
+
+
+def _escaped_dollars(resolve):
+    """resolve() with $ in its values doubled, for _compile_word."""
+
+    def wrapped(c):
+        value = resolve(c)
+        return value if value is None else value.replace("$", "$$")
+
+    return wrapped
+
+
+class ExecCommand:
+    """One Exec*= line compiled once per unit: the prefix flags and, per
+    word, literal pieces and variable references with %-specifiers
+    already substituted. argv(env) then expands it in a single pass.
+
+    As in systemd, a word that is exactly $VAR becomes the value split at
+    whitespace (zero or more arguments), ${VAR} anywhere stays inside one
+    argument, $$ is a literal $, and unset variables are empty. Prefixes:
+    '-' ignores the exit status, '@' takes argv[0] from the second word,
+    ':' turns off variable expansion, '+' and '!' skip User=/Group=.
+    """
+
+    __slots__ = ("line", "ignore_failure", "privileged", "expand_env", "argv0", "words")
+
+    def __init__(self, line, specifier=None):
+        self.line = line
+        cmd = line.strip()
+        flags = ""
+        while cmd and cmd[0] in "-+!@:":
+            flags += cmd[0]
+            cmd = cmd[1:]
+        self.ignore_failure = "-" in flags
+        self.privileged = "+" in flags or "!" in flags
+        self.expand_env = ":" not in flags
+        self.argv0 = "@" in flags
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            words = cmd.split()
+        if specifier is not None:
+            # Per word, after splitting: a value with spaces or quotes
+            # stays one argument, and its $ is not taken for a variable.
+            if self.expand_env:
+                specifier = _escaped_dollars(specifier)
+            words = [expand_specifiers(w, specifier) for w in words]
+        if self.expand_env:
+            self.words = tuple(_compile_word(w) for w in words)
+        else:
+            self.words = tuple((False, (w,)) for w in words)
+
+    def argv(self, env):
+        """The argument list for environment `env`; [] for an empty line."""
+        args = []
+        for split, pieces in self.words:
+            if split:
+                args.extend(env.get(pieces[0][0], "").split())
+                continue
+            if len(pieces) == 1 and pieces[0].__class__ is str:
+                args.append(pieces[0])
+                continue
+            out = []
+            for piece in pieces:
+                if piece.__class__ is str:
+                    out.append(piece)
+                    continue
+                name, op, arg = piece
+                value = env.get(name, "")
+                if op == "-":
+                    value = value or arg
+                elif op == "+":
+                    value = arg if value else ""
+                out.append(value)
+            args.append("".join(out))
+        return args
 
 
 def strip_socket_activation(cmd_parts):
@@ -530,31 +2097,132 @@ def strip_systemd_args(cmd_parts):
     return result
 
 
+def env_name_is_valid(name):
+    if not name or name[0].isdigit() or not name.isascii():
+        return False
+    return name.replace("_", "a").isalnum()
+
+
+def parse_environment_text(text):
+    """KEY=VALUE pairs of an EnvironmentFile, parsed like systemd does:
+    '#'/';' comment lines, an optional 'export ' before the key, single
+    quotes taken literally, double quotes with \\ \" \` \$ escapes,
+    backslash-newline continuing a value, quotes and plain text mixing
+    within one value, and unquoted trailing whitespace dropped.
+    """
+    env = {}
+    state = "pre_key"
+    key = []
+    value = []
+    keep = 0
+    for c in text:
+        if state == "pre_key":
+            if c in "#;":
+                state = "comment"
+            elif not c.isspace():
+                key = [c]
+                state = "key"
+        elif state == "key":
+            if c == "=":
+                value = []
+                keep = 0
+                state = "pre_value"
+            elif c == "\n":
+                state = "pre_key"
+            else:
+                key.append(c)
+        elif state in ("pre_value", "value"):
+            if c == "\n":
+                _env_assign(env, key, value[:keep])
+                state = "pre_key"
+            elif c == "'":
+                state = "single"
+            elif c == '"':
+                state = "double"
+            elif c == "\\":
+                state = "value_escape"
+            elif state == "value" or not c.isspace():
+                value.append(c)
+                if not c.isspace():
+                    keep = len(value)
+                state = "value"
+        elif state == "value_escape":
+            if c != "\n":
+                value.append(c)
+                keep = len(value)
+            state = "value"
+        elif state == "single":
+            if c == "'":
+                state = "value"
+            else:
+                value.append(c)
+                keep = len(value)
+        elif state == "double":
+            if c == '"':
+                state = "value"
+            elif c == "\\":
+                state = "double_escape"
+            else:
+                value.append(c)
+                keep = len(value)
+        elif state == "double_escape":
+            if c in '"\\`$':
+                value.append(c)
+            elif c != "\n":
+                value.append("\\")
+                value.append(c)
+            keep = len(value)
+            state = "double"
+        elif state == "comment":
+            if c == "\\":
+                state = "comment_escape"
+            elif c == "\n":
+                state = "pre_key"
+        else:
+            state = "comment"
+    if state not in ("pre_key", "key", "comment", "comment_escape"):
+        _env_assign(env, key, value[:keep])
+    return env
+
+
+def _env_assign(env, key, value):
+    name = "".join(key).rstrip()
+    if name.startswith("export") and name[6:7].isspace():
+        name = name[6:].lstrip()
+    if env_name_is_valid(name):
+        env[name] = "".join(value)
+
+
+_ENV_FILE_CACHE = {}
+
+
 def load_environment_file(path):
     """Load KEY=VALUE pairs from a systemd EnvironmentFile.
-    Paths prefixed with '-' are optional.
+    Paths prefixed with '-' are optional. Parsed files are kept in
+    _ENV_FILE_CACHE and re-read only when their stat changes, so units
+    sharing /etc/default/foo parse it once; callers must not modify the
+    returned dict.
     """
-    env = {}
     optional = False
     if path.startswith("-"):
         optional = True
         path = path[1:].strip()
-    if not os.path.isfile(path):
+    stamp = _file_stamp(path)
+    cached = _ENV_FILE_CACHE.get(path)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+    if stamp is None:
+        _ENV_FILE_CACHE.pop(path, None)
         if not optional:
             log_warn("EnvironmentFile not found: %s", path)
-        return env
+        return {}
     try:
-        with open(path) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    key, _, value = line.partition("=")
-                    env[key.strip()] = value.strip().strip('"').strip("'")
+        env = parse_environment_text(_read_text(path))
     except (IOError, OSError) as e:
         if not optional:
             log_warn("Failed to read EnvironmentFile %s: %s", path, e)
+        return {}
+    _ENV_FILE_CACHE[path] = (stamp, env)
     return env
 
 
@@ -581,6 +2249,32 @@ def check_dbus_bus_name(bus_name, timeout=5.0):
         return False
 
 
+def list_dbus_names(timeout=5.0):
+    """Return the set of names currently on the system bus, or None when
+    the bus cannot be queried. One call answers BusName= for every unit.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "dbus-send",
+                "--system",
+                "--print-reply",
+                "--dest=org.freedesktop.DBus",
+                "/org/freedesktop/DBus",
+                "org.freedesktop.DBus.ListNames",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.SubprocessError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    out = result.stdout.decode("utf-8", "replace")
+    return set(re.findall(r'string "([^"]+)"', out))
+
+
 def wait_for_dbus_name(bus_name, pid, timeout=10.0):
     if not bus_name:
         return True
@@ -595,6 +2289,396 @@ def wait_for_dbus_name(bus_name, pid, timeout=10.0):
     return False
 
 
+def _replace_file(path, data):
+    """Write `data` (str or bytes) to `path` through a temp file and
+    rename(), so readers never see it half written."""
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), _thread.get_ident())
+    with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+# Locks held by this process: lock path -> [thread id, depth]
+_HELD_LOCKS = {}
+_HELD_LOCKS_GUARD = _thread.allocate_lock()
+
+
+class StateLock:
+    """flock() on LOCK_DIR/<key>.lock: one per unit, "boot" for a boot.
+
+    run() is single-flight across processes. The holder writes what it
+    is doing (op, pid, start time) into the lock file and, when done, the
+    result. A caller that finds the lock taken waits; if the holder was
+    running the same op, the caller returns that result instead of
+    running it again. Re-entry from the thread holding the lock (a
+    dependency cycle) runs fn directly. Unrelated units have unrelated
+    locks, so they still run in parallel.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.path = os.path.join(LOCK_DIR, key + ".lock")
+        self.shared = False
+        self._held = None
+
+    def _open(self):
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        except FileNotFoundError:
+            os.makedirs(LOCK_DIR, mode=0o755, exist_ok=True)
+            return os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+
+    @staticmethod
+    def _read(fd):
+        try:
+            rec = marshal.loads(os.pread(fd, 65536, 0))
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+        return rec if isinstance(rec, dict) else {}
+
+    @staticmethod
+    def _write(fd, rec):
+        data = marshal.dumps(rec)
+        os.pwrite(fd, data, 0)
+        os.ftruncate(fd, len(data))
+
+    def busy(self):
+        """Whether some job (of any process) holds this lock right now."""
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CLOEXEC)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+
+    def current(self):
+        """{"op", "pid", "started"} of the job holding this lock now, or
+        None. Reads what the holder wrote instead of taking the lock."""
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            return None
+        try:
+            rec = self._read(fd)
+        finally:
+            os.close(fd)
+        if "op" not in rec or "result" in rec or not pid_exists(rec.get("pid", 0)):
+            return None
+        return rec
+
+    def hold(self, op):
+        """Take the lock for an `op` job without waiting, for a job that
+        does not fit in one run() call. False when it is busy. Until
+        release(), run() from this thread (or from a child forked by it)
+        runs its fn directly and other processes wait, as with run()."""
+        fd = self._open()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        with _HELD_LOCKS_GUARD:
+            _HELD_LOCKS[self.path] = [_thread.get_ident(), 0]
+        rec = {"op": op, "pid": os.getpid(), "started": time.time()}
+        self._write(fd, rec)
+        self._held = (fd, rec)
+        return True
+
+    def release(self, result=None, done=True):
+        """Let go of a lock taken by hold(), recording `result` for the
+        processes that waited. A parent that has forked the job off
+        passes done=False: the child shares the lock and records the
+        result when it is through."""
+        fd, rec = self._held
+        self._held = None
+        if done:
+            rec["result"] = result
+            try:
+                self._write(fd, rec)
+            except (OSError, ValueError):
+                pass
+        with _HELD_LOCKS_GUARD:
+            _HELD_LOCKS.pop(self.path, None)
+        os.close(fd)
+
+    def run(self, op, fn, timeout=None):
+        me = _thread.get_ident()
+        with _HELD_LOCKS_GUARD:
+            held = _HELD_LOCKS.get(self.path)
+            if held is not None and held[0] == me:
+                held[1] += 1
+        if held is not None and held[0] == me:
+            try:
+                return fn()
+            finally:
+                with _HELD_LOCKS_GUARD:
+                    held[1] -= 1
+        fd = self._open()
+        try:
+            locked, seen = self._acquire(fd, op, timeout)
+            if seen:
+                rec = self._read(fd)
+                if (
+                    "result" in rec
+                    and rec.get("op") == op
+                    and rec.get("pid") == seen.get("pid")
+                    and rec.get("started") == seen.get("started")
+                ):
+                    log_debug("%s: result shared from PID %s", self.key, rec["pid"])
+                    self.shared = True
+                    return rec["result"]
+            if not locked:
+                return fn()
+            with _HELD_LOCKS_GUARD:
+                _HELD_LOCKS[self.path] = [me, 0]
+            rec = {"op": op, "pid": os.getpid(), "started": time.time()}
+            self._write(fd, rec)
+            result = None
+            try:
+                result = fn()
+            finally:
+                rec["result"] = result
+                try:
+                    self._write(fd, rec)
+                except (OSError, ValueError):
+                    pass
+                with _HELD_LOCKS_GUARD:
+                    _HELD_LOCKS.pop(self.path, None)
+            return result
+        finally:
+            os.close(fd)
+
+    def _acquire(self, fd, op, timeout):
+        """(locked, record of the job waited for or None)."""
+        seen = None
+        deadline = time.monotonic() + (LOCK_WAIT_SEC if timeout is None else timeout)
+        delay = 0.01
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, seen
+            except BlockingIOError:
+                pass
+            if seen is None:
+                seen = self._read(fd)
+                log_info(
+                    "%s: waiting for PID %s (%s)",
+                    self.key,
+                    seen.get("pid", "?"),
+                    seen.get("op", "?"),
+                )
+            if time.monotonic() >= deadline:
+                log_warn(
+                    "%s: still locked by PID %s, going ahead with %s",
+                    self.key,
+                    seen.get("pid", "?"),
+                    op,
+                )
+                return False, None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+
+class BusActivationIndex:
+    """D-Bus activation files that still carry SystemdService=, per
+    directory, as (file name, Name=, SystemdService=) entries.
+
+    A directory is rescanned only when its mtime changes, which package
+    managers cause by renaming files into place, and the index is kept in
+    DBUS_INDEX_FILE so later runs start from it. Files without
+    SystemdService= are never indexed, so after the first rewrite a
+    lookup touches nothing but the directory stats.
+    """
+
+    def __init__(self, dirs=None, path=None):
+        self.dirs = DBUS_ACTIVATION_DIRS if dirs is None else dirs
+        self.path = DBUS_INDEX_FILE if path is None else path
+        self._dirty = False
+        try:
+            with open(self.path, "rb") as f:
+                self._dirs = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            self._dirs = {}
+        if not isinstance(self._dirs, dict):
+            self._dirs = {}
+
+    def _entries(self, act_dir):
+        try:
+            mtime = os.stat(act_dir).st_mtime_ns
+        except OSError:
+            return ()
+        cached = self._dirs.get(act_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        entries = []
+        for fname in sorted(os.listdir(act_dir)):
+            if not fname.endswith(".service"):
+                continue
+            try:
+                text = _read_text(os.path.join(act_dir, fname))
+            except (IOError, OSError):
+                continue
+            if "SystemdService=" not in text:
+                continue
+            bus_name = service = ""
+            for line in text.splitlines():
+                key, sep, value = line.partition("=")
+                key = key.strip()
+                if sep and key == "Name":
+                    bus_name = value.strip()
+                elif sep and key == "SystemdService":
+                    service = value.strip()
+            entries.append((fname, bus_name, service))
+        entries = tuple(entries)
+        self._dirs[act_dir] = (mtime, entries)
+        self._dirty = True
+        return entries
+
+    def lookup(self, bus_name, name):
+        """Paths of the activation files for D-Bus name `bus_name` or unit
+        `name`: Name= or SystemdService= equal to them, or a file named
+        after either."""
+        if not name.endswith(".service"):
+            name += ".service"
+        fnames = (name, bus_name + ".service")
+        out = []
+        for act_dir in self.dirs:
+            for fname, file_bus, service in self._entries(act_dir):
+                if file_bus == bus_name or service == name or fname in fnames:
+                    out.append(os.path.join(act_dir, fname))
+        return out
+
+    def rewrite(self, fpath):
+        """Drop SystemdService= from `fpath` via a temp file and rename,
+        then record the file as done."""
+        act_dir, fname = os.path.split(fpath)
+        tmp = os.path.join(act_dir, ".%s.serviced-tmp" % fname)
+        try:
+            content = _read_text(fpath)
+            new = (
+                "\n".join(
+                    line
+                    for line in content.splitlines()
+                    if not line.strip().startswith("SystemdService=")
+                )
+                + "\n"
+            )
+            if new != content:
+                st = os.stat(fpath)
+                with open(tmp, "w") as f:
+                    f.write(new)
+                    os.fchown(f.fileno(), st.st_uid, st.st_gid)
+                    os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                os.replace(tmp, fpath)
+                log_debug("Removed SystemdService= from %s", fpath)
+        except (IOError, OSError) as e:
+            if isinstance(e, PermissionError):
+                log_debug("Cannot modify %s (permission denied)", fpath)
+            else:
+                log_debug("Error processing %s: %s", fpath, e)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+        cached = self._dirs.get(act_dir)
+        if cached is not None:
+            try:
+                mtime = os.stat(act_dir).st_mtime_ns
+            except OSError:
+                mtime = None
+            entries = tuple(e for e in cached[1] if e[0] != fname)
+            self._dirs[act_dir] = (mtime, entries)
+            self._dirty = True
+        return True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+            with open(tmp, "wb") as f:
+                marshal.dump(self._dirs, f)
+            os.rename(tmp, self.path)
+            self._dirty = False
+        except (IOError, OSError) as e:
+            log_debug("Failed to save %s: %s", self.path, e)
+
+
+class BootProgress:
+    """BOOT_PROGRESS_FILE, what the current or last boot has got to, for
+    'serviced boot-status': {"pid", "started", "finished", "order",
+    "units": {name: [state, started, finished]}} with state pending,
+    starting, done or failed and times from time.time(). Rewritten
+    whole on every change, so readers never see half of it.
+    """
+
+    def __init__(self, names=(), rec=None):
+        self.rec = rec or {
+            "pid": os.getpid(),
+            "started": time.time(),
+            "finished": None,
+            "order": list(names),
+            "units": dict((n, ["pending", None, None]) for n in names),
+        }
+
+    @classmethod
+    def load(cls):
+        """The record on disk, or None."""
+        try:
+            with open(BOOT_PROGRESS_FILE) as f:
+                rec = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return cls(rec=rec) if isinstance(rec, dict) and "units" in rec else None
+
+    def save(self):
+        try:
+            os.makedirs(STATE_DIR, mode=0o755, exist_ok=True)
+            _replace_file(BOOT_PROGRESS_FILE, json.dumps(self.rec))
+        except (IOError, OSError) as e:
+            log_debug("Failed to save %s: %s", BOOT_PROGRESS_FILE, e)
+
+    def state(self, name):
+        entry = self.rec["units"].get(name)
+        return entry[0] if entry else None
+
+    def mark(self, name, state):
+        entry = self.rec["units"].setdefault(name, ["pending", None, None])
+        if name not in self.rec["order"]:
+            self.rec["order"].append(name)
+        entry[0] = state
+        if state == "starting":
+            entry[1] = time.time()
+        elif state in ("done", "failed"):
+            entry[2] = time.time()
+        self.save()
+
+    def finish(self):
+        self.rec["finished"] = time.time()
+        self.save()
+
+    def summary(self):
+        """The record plus "state": running, finished or interrupted (the
+        booting process is gone without finishing)."""
+        rec = dict(self.rec)
+        if rec.get("finished"):
+            rec["state"] = "finished"
+        elif pid_exists(rec.get("pid") or 0):
+            rec["state"] = "running"
+        else:
+            rec["state"] = "interrupted"
+        return rec
+
+
 class ServiceManager:
     def __init__(self, dry_run=False, user_mode=False):
         self.dry_run = dry_run
@@ -603,6 +2687,15 @@ class ServiceManager:
         self._units = {}
         self._sockets = {}
         self._discovered = False
+        self._dropin_index = None
+        self._base_env = None
+        self._txn = None
+        self._txn_lock = None
+        self._txn_waits = None
+        # pid -> Popen of every daemon spawned. A dropped Popen whose
+        # process still runs goes on subprocess._active, and the next
+        # Popen() anywhere would reap it behind Daemon._reap's back.
+        self.children = {}
 
     def discover_services(self):
         """Scan unit directories for .service and .socket files.
@@ -610,36 +2703,47 @@ class ServiceManager:
         """
         if self._discovered:
             return
-        seen = set()
-        for unit_dir in self._unit_paths:
-            if not os.path.isdir(unit_dir):
-                continue
-            for fname in sorted(os.listdir(unit_dir)):
-                is_svc = fname.endswith(".service")
-                is_sock = fname.endswith(".socket")
-                if not is_svc and not is_sock:
-                    continue
-                if fname in seen:
+        with TIMINGS.span("discover"):
+            listings = []
+            index = {}
+            for unit_dir in self._unit_paths:
+                try:
+                    entries = sorted(os.listdir(unit_dir))
+                except OSError:
                     continue
-                seen.add(fname)
-                fpath = os.path.join(unit_dir, fname)
-                if os.path.islink(fpath):
-                    target = os.readlink(fpath)
-                    if target == "/dev/null":
+                listings.append((unit_dir, entries))
+                for fname in entries:
+                    if fname.endswith(".d"):
+                        index.setdefault(fname, []).append(unit_dir)
+            self._dropin_index = index
+            seen = set()
+            for unit_dir, entries in listings:
+                for fname in entries:
+                    is_svc = fname.endswith(".service")
+                    is_sock = fname.endswith(".socket")
+                    if not is_svc and not is_sock:
                         continue
-                    if not os.path.isabs(target):
-                        target = os.path.join(unit_dir, target)
-                    if not os.path.exists(target):
+                    if fname in seen:
                         continue
-                    fpath = target
-                try:
-                    unit = UnitFile(fpath)
-                    if is_svc:
-                        self._units[fname] = unit
-                    else:
-                        self._sockets[fname] = unit
-                except Exception as e:
-                    log_debug("Failed to load %s: %s", fpath, e)
+                    seen.add(fname)
+                    fpath = os.path.join(unit_dir, fname)
+                    if os.path.islink(fpath):
+                        target = os.readlink(fpath)
+                        if target == "/dev/null":
+                            continue
+                        if not os.path.isabs(target):
+                            target = os.path.join(unit_dir, target)
+                        if not os.path.exists(target):
+                            continue
+                        fpath = target
+                    try:
+                        unit = self._unit_file(fpath, fname)
+                        if is_svc:
+                            self._units[fname] = unit
+                        else:
+                            self._sockets[fname] = unit
+                    except Exception as e:
+                        log_debug("Failed to load %s: %s", fpath, e)
         self._discovered = True
         log_debug(
             "Discovered %d services, %d sockets from %d paths",
@@ -648,17 +2752,114 @@ class ServiceManager:
             len(self._unit_paths),
         )
 
+    def _load_unit(self, fname):
+        """Find and parse one unit file without a full discovery, with the
+        same first-directory-wins and /dev/null masking rules.
+        """
+        for unit_dir in self._unit_paths:
+            fpath = os.path.join(unit_dir, fname)
+            if not os.path.lexists(fpath):
+                continue
+            if os.path.islink(fpath):
+                target = os.readlink(fpath)
+                if target == "/dev/null":
+                    return None
+                if not os.path.isabs(target):
+                    target = os.path.join(unit_dir, target)
+                if not os.path.exists(target):
+                    return None
+                fpath = target
+            try:
+                return self._unit_file(fpath, fname)
+            except Exception as e:
+                log_debug("Failed to load %s: %s", fpath, e)
+                return None
+        return None
+
+    def _dropin_dirs(self, name):
+        """Existing drop-in directories of `name`, most specific first and
+        by unit path priority within that."""
+        dirs = []
+        index = self._dropin_index
+        for dname in dropin_dir_names(name):
+            if index is not None:
+                dirs.extend(os.path.join(d, dname) for d in index.get(dname, ()))
+            else:
+                for unit_dir in self._unit_paths:
+                    path = os.path.join(unit_dir, dname)
+                    if os.path.isdir(path):
+                        dirs.append(path)
+        return dirs
+
+    def _unit_file(self, fpath, name):
+        """UnitFile for `fpath` with the drop-ins of `name` merged in. It is
+        reused from _UNIT_CACHE while the file, the drop-in directories and
+        the drop-ins keep their mtime, size and inode, so only stat() is
+        paid for unchanged units after refresh().
+        """
+        dirs = self._dropin_dirs(name)
+        stamp = (_file_stamp(fpath),) + tuple(_file_stamp(d) for d in dirs)
+        key = (fpath, name)
+        hit = _UNIT_CACHE.get(key)
+        if hit is not None and hit[0] == stamp:
+            if all(_file_stamp(p) == st for p, st in hit[2]):
+                return hit[1]
+        dropins = collect_dropins(dirs)
+        stamps = tuple((p, _file_stamp(p)) for p in dropins)
+        unit = UnitFile(fpath, dropins)
+        _UNIT_CACHE[key] = (stamp, unit, stamps)
+        return unit
+
+    def invalidate(self):
+        """Forget every parsed unit so the next lookup looks at the files
+        again (unchanged ones come back from _UNIT_CACHE)."""
+        self._units = {}
+        self._sockets = {}
+        self._discovered = False
+        self._dropin_index = None
+
     def get_unit(self, name):
-        self.discover_services()
         if not name.endswith(".service"):
             name += ".service"
+        if not self._discovered and name not in self._units:
+            unit = self._load_unit(name)
+            if unit:
+                self._units[name] = unit
+            return unit
         return self._units.get(name)
 
+    def get_socket(self, name):
+        if not self._discovered and name not in self._sockets:
+            unit = self._load_unit(name)
+            if unit:
+                self._sockets[name] = unit
+            return unit
+        return self._sockets.get(name)
+
     def resolve_name(self, name):
         if not name.endswith(".service"):
             name += ".service"
         return name
 
+    def expand_units(self, patterns):
+        """Resolve names and shell globs ('php*-fpm') to service names in
+        command-line order without duplicates. Returns (names, unmatched).
+        """
+        names = []
+        unmatched = []
+        for pat in patterns:
+            if any(c in pat for c in "*?["):
+                self.discover_services()
+                matches = fnmatch.filter(sorted(self._units), self.resolve_name(pat))
+                if not matches:
+                    unmatched.append(pat)
+            else:
+                matches = [self.resolve_name(pat)]
+            for m in matches:
+                if m not in names:
+                    names.append(m)
+        return names, unmatched
+
     def _pid_path(self, name):
         return os.path.join(PID_DIR, name + ".pid")
 
@@ -677,8 +2878,7 @@ class ServiceManager:
 
     def _write_pid(self, name, pid):
         ensure_dirs()
-        with open(self._pid_path(name), "w") as f:
-            f.write(str(pid))
+        _replace_file(self._pid_path(name), str(pid))
 
     def _remove_pid(self, name):
         try:
@@ -686,7 +2886,7 @@ class ServiceManager:
         except (IOError, OSError):
             pass
 
-    def _write_status(self, name, state, pid=0, msg=""):
+    def _write_status(self, name, state, pid=0, msg="", exit_code=None):
         ensure_dirs()
         data = {
             "state": state,
@@ -694,8 +2894,9 @@ class ServiceManager:
             "message": msg,
             "timestamp": datetime.datetime.now().isoformat(),
         }
-        with open(self._status_path(name), "w") as f:
-            json.dump(data, f)
+        if exit_code is not None:
+            data["exit_code"] = exit_code
+        _replace_file(self._status_path(name), json.dumps(data))
 
     def _read_status(self, name):
         try:
@@ -711,37 +2912,44 @@ class ServiceManager:
             pass
 
     def _build_env(self, unit):
-        env = dict(os.environ)
-        ef = unit.environment_file
-        if ef:
-            env.update(load_environment_file(ef))
-        env.update(unit.environment)
-        return env
+        """Environment for the unit's commands: a fresh overlay holding its
+        EnvironmentFile= files in order and then Environment=, over the
+        process environment copied once per manager. Writes such as
+        MAINPID land in the overlay only. In 'serviced daemon' that copy
+        is the daemon's own environment from when it started, not the
+        caller's, as with systemd."""
+        base = self._base_env
+        if base is None:
+            base = self._base_env = dict(os.environ)
+        overlay = {}
+        for path in unit.environment_files:
+            overlay.update(load_environment_file(path))
+        overlay.update(unit.environment)
+        return collections.ChainMap(overlay, base)
 
     def _find_related_sockets(self, name, unit):
-        self.discover_services()
         result = set()
         for s in unit.sockets:
             sock = s if s.endswith(".socket") else s + ".socket"
-            if sock in self._sockets:
+            if self.get_socket(sock):
                 result.add(sock)
         for dep in unit.requires + unit.wants:
-            if dep.endswith(".socket") and dep in self._sockets:
+            if dep.endswith(".socket") and self.get_socket(dep):
                 result.add(dep)
         base = name.replace(".service", "")
         matching = base + ".socket"
-        if matching in self._sockets:
+        if self.get_socket(matching):
             result.add(matching)
         return result
 
     def _get_socket_paths(self, socket_name):
-        sock_unit = self._sockets.get(socket_name)
+        sock_unit = self.get_socket(socket_name)
         if not sock_unit:
             return []
         return [v.strip() for v in sock_unit.listen_stream if v.strip().startswith("/")]
 
     def _find_service_for_socket(self, socket_name):
-        sock_unit = self._sockets.get(socket_name)
+        sock_unit = self.get_socket(socket_name)
         if sock_unit:
             explicit = sock_unit.socket_service
             if explicit:
@@ -833,9 +3041,7 @@ class ServiceManager:
                 if paths:
                     needed[dep] = paths
         if unit.bus_name or unit.service_type == "dbus":
-            if not (
-                os.path.exists(SYSTEM_BUS_SOCKET) and is_socket_alive(SYSTEM_BUS_SOCKET)
-            ):
+            if not is_socket_alive(SYSTEM_BUS_SOCKET):
                 sock_map = self._build_socket_path_map()
                 if SYSTEM_BUS_SOCKET in sock_map:
                     sock_name, _ = sock_map[SYSTEM_BUS_SOCKET]
@@ -849,7 +3055,7 @@ class ServiceManager:
             return True
         all_ok = True
         for sock_name, paths in needed.items():
-            if any(os.path.exists(p) and is_socket_alive(p) for p in paths):
+            if any_socket_alive(paths):
                 log_debug("Socket %s already available", sock_name)
                 continue
             svc_name = self._find_service_for_socket(sock_name)
@@ -866,7 +3072,7 @@ class ServiceManager:
             if svc_pid and pid_exists(svc_pid):
                 found = False
                 for _ in range(15):
-                    if any(os.path.exists(p) and is_socket_alive(p) for p in paths):
+                    if any_socket_alive(paths):
                         found = True
                         break
                     time.sleep(0.2)
@@ -889,7 +3095,7 @@ class ServiceManager:
             if success:
                 found = False
                 for _ in range(20):
-                    if any(os.path.exists(p) and is_socket_alive(p) for p in paths):
+                    if any_socket_alive(paths):
                         found = True
                         break
                     time.sleep(0.2)
@@ -908,49 +3114,22 @@ class ServiceManager:
         return all_ok
 
     def _fix_bus_activation_files(self, name, unit):
-        """Remove SystemdService= from D-Bus activation files so
-        dbus-daemon falls back to direct Exec= activation.
+        """Remove SystemdService= from the D-Bus activation files for
+        `unit` so dbus-daemon falls back to direct Exec= activation. The
+        files are found through BusActivationIndex rather than by reading
+        every activation file.
         """
         if self.dry_run:
             return
         bus_name = unit.bus_name
         if not bus_name:
             return
-        activation_dirs = [
-            "/usr/share/dbus-1/system-services",
-            "/usr/share/dbus-1/services",
-            "/usr/local/share/dbus-1/system-services",
-            "/usr/local/share/dbus-1/services",
-        ]
-        for act_dir in activation_dirs:
-            if not os.path.isdir(act_dir):
-                continue
-            for fname in os.listdir(act_dir):
-                if not fname.endswith(".service"):
-                    continue
-                fpath = os.path.join(act_dir, fname)
-                try:
-                    with open(fpath, "r") as f:
-                        content = f.read()
-                    if "SystemdService=" not in content:
-                        continue
-                    if bus_name in content or name.replace(".service", "") in fname:
-                        new = (
-                            "\n".join(
-                                line
-                                for line in content.splitlines()
-                                if not line.strip().startswith("SystemdService=")
-                            )
-                            + "\n"
-                        )
-                        if new != content:
-                            with open(fpath, "w") as f:
-                                f.write(new)
-                            log_debug("Removed SystemdService= from %s", fpath)
-                except PermissionError:
-                    log_debug("Cannot modify %s (permission denied)", fpath)
-                except (IOError, OSError) as e:
-                    log_debug("Error processing %s: %s", fpath, e)
+        index = getattr(self, "_bus_index", None)
+        if index is None:
+            index = self._bus_index = BusActivationIndex()
+        for fpath in index.lookup(bus_name, name):
+            index.rewrite(fpath)
+        index.save()
 
     def _build_service_binary_map(self):
         if hasattr(self, "_binary_map"):
@@ -1111,6 +3290,8 @@ class ServiceManager:
         except (OSError, subprocess.SubprocessError):
             pass
         for dep_name in self._collect_stop_dependencies(name, unit):
+            if self._in_transaction("start", dep_name) or StateLock(dep_name).busy():
+                continue
             dep_unit = self.get_unit(dep_name)
             if dep_unit:
                 dp = self._read_pid(dep_name)
@@ -1129,27 +3310,38 @@ class ServiceManager:
                     self._remove_pid(dep_name)
                     self._write_status(dep_name, "inactive")
 
-    def _run_cmd(self, cmd_str, env, unit, wait=True, log_file=None):
-        check, parts = parse_exec_cmd(cmd_str)
-        if not parts:
-            return (0, 0)
-        parts = expand_env(parts, env)
-        parts = strip_socket_activation(parts)
-        parts = strip_systemd_args(parts)
-        if not parts:
-            return (0, 0)
-        log_debug("Running: %s", " ".join(parts))
-        if self.dry_run:
-            log_info("[DRY RUN] Would execute: %s", " ".join(parts))
-            return (0, 12345)
-        cwd = unit.working_directory or None
-        if cwd and not os.path.isdir(cwd):
-            cwd = None
-        uid = gid = None
+    def _exec(self, name, unit, line):
+        """ExecCommand for one Exec*= line of `unit` run as `name`,
+        compiled on first use and kept with the unit."""
+        key = ("exec", name, self.user_mode, line)
+        cmd = unit._cache.get(key)
+        if cmd is None:
+            cmd = ExecCommand(
+                line, lambda ch: unit_specifier(ch, name, unit, self.user_mode)
+            )
+            unit._cache[key] = cmd
+        return cmd
+
+    def _credentials(self, unit):
+        """(uid, gid, groups) for the unit's User=/Group=, each None when
+        unset. groups are the user's supplementary groups as initgroups()
+        would set them. NSS is asked once per (User=, Group=) pair for the
+        life of the manager, not once per Exec line.
+        """
+        if not hasattr(self, "_cred_cache"):
+            self._cred_cache = {}
+        key = (unit.user, unit.group)
+        if key in self._cred_cache:
+            return self._cred_cache[key]
+        uid = gid = groups = None
         if unit.user:
             try:
                 pw = pwd.getpwnam(unit.user)
                 uid, gid = pw.pw_uid, pw.pw_gid
+                try:
+                    groups = os.getgrouplist(unit.user, gid)
+                except OSError:
+                    groups = [gid]
             except KeyError:
                 log_warn("User '%s' not found, running as current user", unit.user)
         if unit.group:
@@ -1157,64 +3349,278 @@ class ServiceManager:
                 gid = grp.getgrnam(unit.group).gr_gid
             except KeyError:
                 log_warn("Group '%s' not found", unit.group)
-
-        def preexec():
-            os.setsid()
-            if gid is not None:
-                try:
-                    os.setgid(gid)
-                except OSError:
-                    pass
-            if uid is not None:
-                try:
-                    os.setuid(uid)
-                except OSError:
-                    pass
-
+        if os.geteuid() != 0 and (uid is not None or gid is not None):
+            # Only root can switch; keep running as ourselves like before.
+            log_debug("Not root, ignoring User=/Group= of %s", unit.path)
+            uid = gid = groups = None
+        self._cred_cache[key] = (uid, gid, groups)
+        return uid, gid, groups
+
+    def _run_helper_proc(self, parts, unit, log_file, phase, timeout, **popen):
+        proc = subprocess.Popen(parts, **popen)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        out = None
+        if log_file:
+            try:
+                out = open(log_file, "ab")
+            except (IOError, OSError) as e:
+                log_debug("Cannot open %s: %s", log_file, e)
         try:
-            if wait:
-                result = subprocess.run(
-                    parts,
-                    env=env,
-                    cwd=cwd,
-                    preexec_fn=preexec if (uid or gid) else None,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=120,
-                )
-                if result.returncode != 0:
-                    err = result.stderr.decode("utf-8", errors="replace").strip()
-                    if err:
-                        log_debug("stderr: %s", err)
-                    if log_file and err:
-                        try:
-                            with open(log_file, "a") as lf:
-                                lf.write(err + "\n")
-                        except (IOError, OSError):
-                            pass
-                return (result.returncode, 0)
-            else:
-                lf = open(log_file, "a") if log_file else open(os.devnull, "w")
-                proc = subprocess.Popen(
-                    parts,
-                    env=env,
-                    cwd=cwd,
-                    preexec_fn=preexec if (uid or gid) else os.setsid,
+            finished, tail = stream_output(proc, out, phase, deadline)
+        finally:
+            proc.stdout.close()
+            if out is not None:
+                out.close()
+        if not finished:
+            log_warn(
+                "%s timed out after %.1fs: %s", phase or "Command", timeout, parts[0]
+            )
+            signum = resolve_signal(unit.kill_signal) or signal.SIGTERM
+            stop_process_group(proc, signum, min(HELPER_KILL_GRACE, timeout))
+            return (124, 0)
+        rc = proc.wait()
+        if rc != 0 and tail:
+            log_debug("output: %s", "\n".join(tail))
+        return (rc, 0)
+
+    def _run_helper(self, name, unit, phase, cmd, env, timeout=None):
+        """Run an Exec*= helper to completion with its output in the unit
+        log. The limit is TimeoutStopSec= for ExecStop*, TimeoutStartSec=
+        otherwise, capped by `timeout` when given. Returns the exit code.
+        """
+        if phase.startswith("ExecStop"):
+            limit = unit.timeout_stop
+        else:
+            limit = unit.timeout_start
+        if timeout is not None:
+            limit = timeout if limit is None else min(limit, timeout)
+        rc, _ = self._run_cmd(
+            cmd,
+            env,
+            unit,
+            wait=True,
+            log_file=self._log_path(name),
+            timeout=limit,
+            phase=phase,
+            name=name,
+        )
+        return rc
+
+    def _run_cmd(
+        self,
+        cmd_str,
+        env,
+        unit,
+        wait=True,
+        log_file=None,
+        timeout=None,
+        phase=None,
+        name=None,
+    ):
+        """Run one Exec line. wait=False spawns it as a daemon with output
+        appended to log_file and returns (None, pid). wait=True streams
+        its output into log_file tagged by `phase` and returns (rc, 0);
+        past `timeout` seconds the helper's process group gets KillSignal=
+        and then SIGKILL, and rc is 124. `name` is the unit name the
+        specifiers refer to (default: the unit file's).
+        """
+        cmd = self._exec(name or os.path.basename(unit.path or ""), unit, cmd_str)
+        parts = cmd.argv(env)
+        executable = None
+        if cmd.argv0 and parts:
+            executable = parts.pop(0)
+        parts = strip_socket_activation(parts)
+        parts = strip_systemd_args(parts)
+        if not parts:
+            return (0, 0)
+        log_debug("Running: %s", " ".join(parts))
+        if self.dry_run:
+            log_info("[DRY RUN] Would execute: %s", " ".join(parts))
+            return (0, 12345)
+        cwd = unit.working_directory or None
+        if cwd and not os.path.isdir(cwd):
+            cwd = None
+        if cmd.privileged:
+            uid = gid = groups = None
+        else:
+            uid, gid, groups = self._credentials(unit)
+        switch = uid is not None or gid is not None
+        try:
+            if wait:
+                return self._run_helper_proc(
+                    parts,
+                    unit,
+                    log_file,
+                    phase,
+                    timeout,
+                    executable=executable,
+                    env=env,
+                    cwd=cwd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    **spawn_options(
+                        uid, gid, groups, new_session=switch, own_group=True
+                    )
+                )
+            else:
+                lf = open(log_file, "a") if log_file else open(os.devnull, "w")
+                proc = subprocess.Popen(
+                    parts,
+                    executable=executable,
+                    env=env,
+                    cwd=cwd,
                     stdout=lf,
                     stderr=subprocess.STDOUT,
                     stdin=subprocess.DEVNULL,
+                    **spawn_options(uid, gid, groups, new_session=True)
                 )
+                self.children[proc.pid] = proc
                 return (None, proc.pid)
         except FileNotFoundError:
-            log_error("Command not found: %s", parts[0])
+            log_error("Command not found: %s", executable or parts[0])
             return (127, 0)
         except PermissionError:
-            log_error("Permission denied: %s", parts[0])
+            log_error("Permission denied: %s", executable or parts[0])
             return (126, 0)
         except Exception as e:
-            log_error("Failed to execute %s: %s", parts[0], e)
+            log_error("Failed to execute %s: %s", executable or parts[0], e)
             return (1, 0)
 
+    # ---- Transactions ----
+
+    def _single_flight(self, op, name, fn):
+        """Run fn(name) as the `op` job for `name`. Inside a transaction
+        each (op, name) runs once; concurrent and later callers wait for
+        and share the first result. Re-entry from the owning thread (a
+        dependency cycle) returns True like the old recursion guards, and
+        so does a wait that would close a cycle of threads each waiting
+        for the next one's job (units in one layer needing each other).
+        """
+        txn = self._txn
+        if txn is None:
+            with TIMINGS.span(op, name):
+                return self._locked(op, name, fn)
+        key = (op, name)
+        me = threading.get_ident()
+        with self._txn_lock:
+            flight = txn.get(key)
+            owner = flight is None
+            if owner:
+                flight = txn[key] = {"done": threading.Event(), "ok": None, "tid": me}
+            elif not flight["done"].is_set():
+                if self._waits_on(flight, me):
+                    return True
+                self._txn_waits[me] = flight
+        if not owner:
+            try:
+                flight["done"].wait()
+            finally:
+                with self._txn_lock:
+                    self._txn_waits.pop(me, None)
+            return flight["ok"]
+        try:
+            with TIMINGS.span(op, name):
+                flight["ok"] = self._locked(op, name, fn)
+        finally:
+            flight["done"].set()
+        return flight["ok"]
+
+    def _waits_on(self, flight, me):
+        """Whether the owner of `flight` is (through the flights other
+        threads wait for) waiting on thread `me`. Caller holds _txn_lock."""
+        waits = self._txn_waits
+        tid = flight["tid"]
+        for _ in range(len(waits) + 1):
+            if tid == me:
+                return True
+            nxt = waits.get(tid)
+            if nxt is None or nxt["done"].is_set():
+                return False
+            tid = nxt["tid"]
+        return False
+
+    def _locked(self, op, name, fn, timeout=None):
+        """fn(name) under the unit's StateLock, so another serviced
+        process running the same job is waited for and not repeated."""
+        if self.dry_run:
+            return fn(name)
+        return StateLock(name).run(op, lambda: fn(name), timeout)
+
+    def _in_transaction(self, op, name):
+        txn = self._txn
+        return txn is not None and (op, name) in txn
+
+    def _ordering_edges(self, names):
+        """name -> set of names it must follow, from Requires=/Wants=/
+        After=/BindsTo= and the reverse of Before=, restricted to `names`.
+        A .socket dependency orders after the service providing it.
+        """
+        wanted = set(names)
+        edges = dict((n, set()) for n in names)
+
+        def norm(dep):
+            if dep.endswith(".socket"):
+                return self._find_service_for_socket(dep)
+            return dep if "." in dep else dep + ".service"
+
+        for n in names:
+            unit = self.get_unit(n)
+            if not unit:
+                continue
+            for dep in unit.requires + unit.wants + unit.after + unit.binds_to:
+                d = norm(dep)
+                if d in wanted and d != n:
+                    edges[n].add(d)
+            for dep in unit.before:
+                d = norm(dep)
+                if d in wanted and d != n:
+                    edges[d].add(n)
+        return edges
+
+    def run_transaction(self, op, names, jobs=4, on_done=None):
+        """Run start, stop or reload on `names` as one transaction. Units
+        are layered by the dependencies among them (reversed for stop),
+        each layer runs on a pool of `jobs` workers, and dependencies
+        shared by several units are started or stopped only once.
+        Returns {name: ok}; on_done(name, ok) fires as each unit finishes.
+        """
+        if len(names) == 1:
+            ok = bool(getattr(self, op)(names[0]))
+            if on_done:
+                on_done(names[0], ok)
+            return {names[0]: ok}
+        self.discover_services()
+        layers = order_layers(names, self._ordering_edges(names))
+        if op == "stop":
+            layers.reverse()
+        method = getattr(self, op)
+        results = {}
+        saved_root = TIMINGS.root
+        TIMINGS.root = TIMINGS.current()
+        if self._txn_lock is None:
+            self._txn_lock = threading.Lock()
+        self._txn = {}
+        self._txn_waits = {}
+        try:
+            with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                for layer in layers:
+                    pending = dict((pool.submit(method, n), n) for n in layer)
+                    for fut in futures.as_completed(pending):
+                        n = pending[fut]
+                        try:
+                            ok = bool(fut.result())
+                        except Exception as e:
+                            log_error("%s %s: %s", op, n, e)
+                            ok = False
+                        results[n] = ok
+                        if on_done:
+                            on_done(n, ok)
+        finally:
+            self._txn = None
+            TIMINGS.root = saved_root
+        return dict((n, results.get(n, False)) for n in names)
+
     # ---- Start ----
 
     def _start_dependencies(self, name, unit):
@@ -1234,12 +3640,14 @@ class ServiceManager:
                 if not du or du.service_type in UNSUPPORTED_TYPES:
                     continue
                 ok = self.start(dep)
-                msg = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-                print("%s %s %s." % (msg, "Started" if ok else "Failed to start", dep))
+                log_job(ok, "Started", "Failed to start", dep)
         self._starting.discard(name)
 
     def start(self, name):
         name = self.resolve_name(name)
+        return self._single_flight("start", name, self._start)
+
+    def _start(self, name):
         log_action("START request for %s", name)
         if is_critical_service(name):
             log_error("Refusing to manage critical service: %s", name)
@@ -1252,7 +3660,8 @@ class ServiceManager:
         if stype in UNSUPPORTED_TYPES:
             log_error("Unsupported service type '%s' for %s", stype, name)
             return False
-        self._pkill_service(name, unit)
+        with TIMINGS.span("pkill"):
+            self._pkill_service(name, unit)
         cond = unit.condition_path_exists
         if cond:
             negate = cond.startswith("!")
@@ -1262,12 +3671,41 @@ class ServiceManager:
                 if VERBOSE:
                     log_warn("ConditionPathExists failed for %s: %s", name, cond)
                 return False
-        if not self._ensure_socket_services(name, unit):
+        with TIMINGS.span("ensure_socket_services"):
+            sockets_ok = self._ensure_socket_services(name, unit)
+        if not sockets_ok:
             log_error("Cannot start %s: required socket services not available", name)
             return False
         if unit.bus_name:
-            self._fix_bus_activation_files(name, unit)
-        self._start_dependencies(name, unit)
+            with TIMINGS.span("fix_bus_activation"):
+                self._fix_bus_activation_files(name, unit)
+        with TIMINGS.span("start_dependencies"):
+            self._start_dependencies(name, unit)
+        events = []
+        t0 = time.monotonic()
+        ok = self._activate(name, unit, stype, events)
+        events.append(("start", time.monotonic() - t0, ok))
+        if ok and not self.dry_run and unit.oom_score_adjust is not None:
+            self._apply_oom_score(name, unit.oom_score_adjust)
+        self._record_metrics({name: events})
+        return ok
+
+    def _apply_oom_score(self, name, adj):
+        """Write oom_score_adj for every process of the unit; whatever it
+        forks from now on inherits the value."""
+        pid = self._read_pid(name)
+        if not pid:
+            return
+        for p in process_tree(pid):
+            try:
+                with open("/proc/%d/oom_score_adj" % p, "w") as f:
+                    f.write(str(adj))
+            except (IOError, OSError) as e:
+                log_debug("oom_score_adj of %s (PID %d): %s", name, p, e)
+
+    def _activate(self, name, unit, stype, events):
+        """The part of a start after the dependencies: ExecStartPre= and
+        the type-specific start. Appends metric events to `events`."""
         if VERBOSE:
             log_info("Starting %s (%s)...", name, unit.description)
         env = self._build_env(unit)
@@ -1279,14 +3717,21 @@ class ServiceManager:
                     "\n--- %s START %s ---\n"
                     % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name)
                 )
+        t0 = time.monotonic()
         for cmd in unit.exec_start_pre:
-            chk, _ = parse_exec_cmd(cmd)
-            rc, _ = self._run_cmd(cmd, env, unit, wait=True)
+            chk = not self._exec(name, unit, cmd).ignore_failure
+            with TIMINGS.span("exec_start_pre"):
+                rc = self._run_helper(name, unit, "ExecStartPre", cmd, env)
             if rc and chk:
                 log_error("ExecStartPre failed for %s (exit %d)", name, rc)
                 if not self.dry_run:
-                    self._write_status(name, "failed", msg="ExecStartPre failed")
+                    self._write_status(
+                        name, "failed", msg="ExecStartPre failed", exit_code=rc
+                    )
+                events.append(("exec_start_pre", time.monotonic() - t0, False))
                 return False
+        if unit.exec_start_pre:
+            events.append(("exec_start_pre", time.monotonic() - t0, True))
         self._ensure_socket_dirs(name, unit)
         if stype == "oneshot":
             return self._start_oneshot(name, unit, env)
@@ -1305,7 +3750,11 @@ class ServiceManager:
             self._write_status(name, "failed", msg="No ExecStart")
             return False
         env["MAINPID"] = ""
-        rc, pid = self._run_cmd(cmds[-1], env, unit, wait=False, log_file=log_file)
+        probe = ReadinessProbe.for_unit(unit, log_file)
+        with TIMINGS.span("spawn"):
+            rc, pid = self._run_cmd(
+                cmds[-1], env, unit, wait=False, log_file=log_file, name=name
+            )
         if pid <= 0 and not self.dry_run:
             log_error("Failed to start %s", name)
             self._write_status(name, "failed", msg="Failed to start process")
@@ -1315,8 +3764,14 @@ class ServiceManager:
             self._write_status(name, "active", pid=pid)
         env["MAINPID"] = str(pid)
         if not self.dry_run:
-            wt = 1.5 if unit.service_type in ("notify", "notify-reload") else 0.5
-            time.sleep(wt)
+            with TIMINGS.span("wait_ready"):
+                if probe:
+                    ready = self._wait_ready(name, unit, pid, probe)
+                    if ready is False:
+                        return False
+                else:
+                    notify = unit.service_type in ("notify", "notify-reload")
+                    time.sleep(1.5 if notify else 0.5)
             if not pid_exists(pid):
                 if unit.remain_after_exit:
                     log_info("%s started and exited (RemainAfterExit=yes)", name)
@@ -1330,10 +3785,42 @@ class ServiceManager:
                     return False
         if VERBOSE:
             log_info("%s started (PID %d)", name, pid)
+        TIMINGS.mark("ready")
         for cmd in unit.exec_start_post:
-            self._run_cmd(cmd, env, unit, wait=True)
+            with TIMINGS.span("exec_start_post"):
+                self._run_helper(name, unit, "ExecStartPost", cmd, env)
         return True
 
+    def _wait_ready(self, name, unit, pid, probe):
+        """Poll `probe` until the unit is ready (True), its main process
+        exits (None, left to the caller) or the probe times out: then the
+        unit is killed, marked failed and False returned."""
+        deadline = None
+        if probe.timeout is not None:
+            deadline = time.monotonic() + probe.timeout
+        delay = 0.02
+        while True:
+            if not pid_exists(pid):
+                return None
+            left = probe.pending(pid)
+            if not left:
+                log_debug("%s is ready", name)
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        log_error("%s not ready after %gs, waiting for %s", name, probe.timeout, left)
+        self._signal_unit(pid, unit)
+        limit = time.monotonic() + HELPER_KILL_GRACE
+        while time.monotonic() < limit and pid_exists(pid):
+            time.sleep(0.05)
+        if pid_exists(pid):
+            self._signal_unit(pid, unit, signal.SIGKILL)
+        self._write_status(name, "failed", pid=0, msg="Readiness timeout")
+        self._remove_pid(name)
+        return False
+
     def _start_dbus(self, name, unit, env):
         log_file = self._log_path(name)
         cmds = unit.exec_start
@@ -1342,7 +3829,10 @@ class ServiceManager:
             self._write_status(name, "failed", msg="No ExecStart")
             return False
         env["MAINPID"] = ""
-        rc, pid = self._run_cmd(cmds[-1], env, unit, wait=False, log_file=log_file)
+        with TIMINGS.span("spawn"):
+            rc, pid = self._run_cmd(
+                cmds[-1], env, unit, wait=False, log_file=log_file, name=name
+            )
         if pid <= 0 and not self.dry_run:
             log_error("Failed to start %s", name)
             self._write_status(name, "failed", msg="Failed to start process")
@@ -1355,7 +3845,9 @@ class ServiceManager:
             bn = unit.bus_name
             if bn:
                 log_debug("Waiting for %s to acquire bus name '%s'...", name, bn)
-                if wait_for_dbus_name(bn, pid, timeout=10.0):
+                with TIMINGS.span("wait_ready"):
+                    acquired = wait_for_dbus_name(bn, pid, timeout=10.0)
+                if acquired:
                     log_debug("%s acquired bus name '%s'", name, bn)
                 elif pid_exists(pid):
                     log_warn(
@@ -1372,7 +3864,8 @@ class ServiceManager:
                     self._remove_pid(name)
                     return False
             else:
-                time.sleep(0.5)
+                with TIMINGS.span("wait_ready"):
+                    time.sleep(0.5)
                 if not pid_exists(pid):
                     if unit.remain_after_exit:
                         self._write_status(
@@ -1387,36 +3880,41 @@ class ServiceManager:
                         return False
         if VERBOSE:
             log_info("%s started (PID %d, Type=dbus)", name, pid)
+        TIMINGS.mark("ready")
         for cmd in unit.exec_start_post:
-            self._run_cmd(cmd, env, unit, wait=True)
+            with TIMINGS.span("exec_start_post"):
+                self._run_helper(name, unit, "ExecStartPost", cmd, env)
         return True
 
     def _start_forking(self, name, unit, env):
-        log_file = self._log_path(name)
         cmds = unit.exec_start
         if not cmds:
             log_error("No ExecStart defined for %s", name)
             return False
         for cmd in cmds:
-            rc, _ = self._run_cmd(cmd, env, unit, wait=True, log_file=log_file)
-            chk, _ = parse_exec_cmd(cmd)
+            with TIMINGS.span("spawn"):
+                rc = self._run_helper(name, unit, "ExecStart", cmd, env)
+            chk = not self._exec(name, unit, cmd).ignore_failure
             if rc and chk:
                 log_error("ExecStart failed for %s (exit %d)", name, rc)
-                self._write_status(name, "failed", msg="ExecStart failed")
+                self._write_status(
+                    name, "failed", msg="ExecStart failed", exit_code=rc
+                )
                 return False
         pid = 0
         pf = unit.pid_file
         if pf:
-            for _ in range(20):
-                if os.path.isfile(pf):
-                    try:
-                        with open(pf) as f:
-                            pid = int(f.read().strip())
-                        break
-                    except (IOError, ValueError):
-                        pass
-                if not self.dry_run:
-                    time.sleep(0.2)
+            with TIMINGS.span("wait_ready"):
+                for _ in range(20):
+                    if os.path.isfile(pf):
+                        try:
+                            with open(pf) as f:
+                                pid = int(f.read().strip())
+                            break
+                        except (IOError, ValueError):
+                            pass
+                    if not self.dry_run:
+                        time.sleep(0.2)
         if pid and pid_exists(pid):
             if not self.dry_run:
                 self._write_pid(name, pid)
@@ -1428,44 +3926,61 @@ class ServiceManager:
                 log_warn("%s: forking service started but no PID tracked", name)
             if not self.dry_run:
                 self._write_status(name, "active", pid=0, msg="PID unknown")
+        TIMINGS.mark("ready")
         for cmd in unit.exec_start_post:
-            self._run_cmd(cmd, env, unit, wait=True)
+            with TIMINGS.span("exec_start_post"):
+                self._run_helper(name, unit, "ExecStartPost", cmd, env)
         return True
 
     def _start_oneshot(self, name, unit, env):
-        log_file = self._log_path(name)
         cmds = unit.exec_start
         if not cmds:
             log_error("No ExecStart defined for %s", name)
             return False
         for cmd in cmds:
-            chk, _ = parse_exec_cmd(cmd)
-            rc, _ = self._run_cmd(cmd, env, unit, wait=True, log_file=log_file)
+            chk = not self._exec(name, unit, cmd).ignore_failure
+            with TIMINGS.span("spawn"):
+                rc = self._run_helper(name, unit, "ExecStart", cmd, env)
             if rc and chk:
                 log_error("ExecStart failed for %s (exit %d)", name, rc)
                 self._write_status(
-                    name, "failed", msg="ExecStart failed (exit %d)" % rc
+                    name, "failed", msg="ExecStart failed (exit %d)" % rc, exit_code=rc
                 )
                 return False
         if unit.remain_after_exit:
             if not self.dry_run:
                 self._write_status(
-                    name, "active", pid=0, msg="Completed (RemainAfterExit)"
+                    name,
+                    "active",
+                    pid=0,
+                    msg="Completed (RemainAfterExit)",
+                    exit_code=0,
                 )
         else:
             if not self.dry_run:
                 self._write_status(
-                    name, "inactive", pid=0, msg="Completed successfully"
+                    name, "inactive", pid=0, msg="Completed successfully", exit_code=0
                 )
         log_info("%s completed", name)
+        TIMINGS.mark("ready")
         for cmd in unit.exec_start_post:
-            self._run_cmd(cmd, env, unit, wait=True)
+            with TIMINGS.span("exec_start_post"):
+                self._run_helper(name, unit, "ExecStartPost", cmd, env)
         return True
 
     # ---- Stop ----
 
     def stop(self, name):
         name = self.resolve_name(name)
+        return self._single_flight("stop", name, self._measured_stop)
+
+    def _measured_stop(self, name):
+        t0 = time.monotonic()
+        ok = self._stop(name)
+        self._record_metrics({name: [("stop", time.monotonic() - t0, ok)]})
+        return ok
+
+    def _stop(self, name):
         log_action("STOP request for %s", name)
         if is_critical_service(name):
             log_error("Refusing to manage critical service: %s", name)
@@ -1476,12 +3991,12 @@ class ServiceManager:
             return False
         related_sockets = self._find_related_sockets(name, unit)
         if related_sockets:
+            listeners = UnixListeners()
             alive = [
                 s
                 for s in related_sockets
                 if any(
-                    os.path.exists(p) and is_socket_alive(p)
-                    for p in self._get_socket_paths(s)
+                    is_socket_alive(p, listeners) for p in self._get_socket_paths(s)
                 )
             ]
             if alive:
@@ -1490,14 +4005,16 @@ class ServiceManager:
                     name,
                     "\n  ".join(alive),
                 )
-        stop_deps = self._collect_stop_dependencies(name, unit)
+        with TIMINGS.span("collect_stop_dependencies"):
+            stop_deps = self._collect_stop_dependencies(name, unit)
         pid = self._read_pid(name)
         if not pid or not pid_exists(pid):
             if VERBOSE:
                 log_info("%s is not running", name)
             self._remove_pid(name)
             self._write_status(name, "inactive")
-            self._stop_dependencies(name, stop_deps)
+            with TIMINGS.span("stop_dependencies"):
+                self._stop_dependencies(name, stop_deps)
             return True
         if pid in (1, 2):
             log_error("Refusing to kill PID %d", pid)
@@ -1507,16 +4024,18 @@ class ServiceManager:
         if self.dry_run:
             log_info("[DRY RUN] Would stop PID %d", pid)
             return True
+        self._thaw_before_signal(name, pid)
         exec_stop = unit.exec_stop
         if exec_stop:
             env = self._build_env(unit)
             env["MAINPID"] = str(pid)
-            for cmd in exec_stop:
-                self._run_cmd(cmd, env, unit, wait=True)
-            for _ in range(15):
-                if not pid_exists(pid):
-                    break
-                time.sleep(0.2)
+            with TIMINGS.span("exec_stop"):
+                for cmd in exec_stop:
+                    self._run_helper(name, unit, "ExecStop", cmd, env)
+                for _ in range(15):
+                    if not pid_exists(pid):
+                        break
+                    time.sleep(0.2)
         if pid_exists(pid):
             try:
                 os.kill(pid, signal.SIGTERM)
@@ -1525,25 +4044,29 @@ class ServiceManager:
             except PermissionError:
                 log_error("Permission denied killing PID %d", pid)
                 return False
-            for _ in range(25):
-                if not pid_exists(pid):
-                    break
-                time.sleep(0.2)
+            with TIMINGS.span("sigterm_wait"):
+                for _ in range(25):
+                    if not pid_exists(pid):
+                        break
+                    time.sleep(0.2)
         if pid_exists(pid):
             try:
                 os.kill(pid, signal.SIGKILL)
                 log_warn("Sent SIGKILL to PID %d", pid)
             except (ProcessLookupError, PermissionError):
                 pass
-            time.sleep(0.5)
+            with TIMINGS.span("sigkill_wait"):
+                time.sleep(0.5)
         if pid_exists(pid):
             log_error("Failed to stop %s (PID %d still alive)", name, pid)
             self._write_status(name, "failed", pid=pid, msg="Could not kill")
             return False
         self._remove_pid(name)
+        self._remove_frozen(name)
         self._write_status(name, "inactive")
         log_info("%s stopped", name)
-        self._stop_dependencies(name, stop_deps)
+        with TIMINGS.span("stop_dependencies"):
+            self._stop_dependencies(name, stop_deps)
         return True
 
     def _stop_dependencies(self, parent, dep_list):
@@ -1563,15 +4086,208 @@ class ServiceManager:
             if self._is_needed_by_others(dep, exclude={parent}):
                 continue
             ok = self.stop(dep)
-            msg = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-            print("%s %s %s." % (msg, "Stopped" if ok else "Failed to stop", dep))
+            log_job(ok, "Stopped", "Failed to stop", dep)
         self._stopping.discard(parent)
 
     def restart(self, name):
         name = self.resolve_name(name)
         self.stop(name)
         time.sleep(0.5)
-        return self.start(name)
+        ok = self.start(name)
+        self._record_metrics({name: [("restart", None, ok)]})
+        return ok
+
+    # ---- Metrics ----
+
+    def _record_metrics(self, events):
+        """Add {name: [(event, seconds or None, ok), ...]} to METRICS_FILE
+        and refresh the textfile, if one is configured."""
+        if self.dry_run or not events:
+            return
+        MetricsStore().record(events)
+        self._metrics_changed()
+
+    def _metrics_changed(self):
+        path = os.environ.get("SERVICED_METRICS_TEXTFILE")
+        if path:
+            write_metrics_textfile(path, collect_metrics(self))
+
+    # ---- Shutdown ----
+
+    def _active_units(self):
+        """Every unit with a pid file or an active status record."""
+        names = set()
+        try:
+            names.update(f[:-4] for f in os.listdir(PID_DIR) if f.endswith(".pid"))
+        except OSError:
+            pass
+        try:
+            for f in os.listdir(STATUS_DIR):
+                if f.endswith(".json"):
+                    st = self._read_status(f[:-5]) or {}
+                    if st.get("state") == "active":
+                        names.add(f[:-5])
+        except OSError:
+            pass
+        return sorted(n for n in names if not is_critical_service(n))
+
+    def _shutdown_unit(self, name, pid, deadline):
+        """ExecStop= (bounded by the deadline), then KillSignal= to the
+        unit's process group. Does not wait for the process to exit.
+        """
+        unit = self.get_unit(name)
+        if not pid or not pid_exists(pid):
+            return
+        self._thaw_before_signal(name, pid)
+        if unit and unit.exec_stop:
+            env = self._build_env(unit)
+            env["MAINPID"] = str(pid)
+            with TIMINGS.span("exec_stop", name):
+                for cmd in unit.exec_stop:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._run_helper(name, unit, "ExecStop", cmd, env, timeout=left)
+        if not pid_exists(pid):
+            return
+        self._signal_unit(pid, unit)
+
+    def _signal_unit(self, pid, unit, signum=None):
+        """KillSignal= (or `signum`) to the unit's process group, or to
+        the main PID alone for KillMode=process/mixed."""
+        if signum is None:
+            signum = resolve_signal(unit.kill_signal if unit else "SIGTERM")
+        if signum is None:
+            signum = signal.SIGTERM
+        try:
+            pgid = os.getpgid(pid)
+            if pgid == os.getpgid(0) or (
+                unit and unit.kill_mode in ("process", "mixed")
+            ):
+                os.kill(pid, signum)
+            else:
+                os.killpg(pgid, signum)
+        except OSError:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def shutdown(self, timeout=5.0, jobs=4, on_done=None):
+        """Stop every running unit in reverse dependency order, bounded by
+        one overall deadline. Each layer gets ExecStop= and SIGTERM
+        concurrently and is waited on only while the deadline allows;
+        then everything still alive - main PIDs and any other process
+        left in the sessions serviced created - gets SIGKILL. Units are
+        signalled and marked stopped under their StateLock, so a job on
+        one of them in another process is not cut short.
+        Returns {name: ok}; on_done(name, ok) fires per unit.
+        """
+        log_action("SHUTDOWN request (timeout=%.1fs)", timeout)
+        deadline = time.monotonic() + max(0.0, timeout)
+        names = self._active_units()
+        if not names:
+            return {}
+        pids = dict((n, self._read_pid(n)) for n in names)
+        if self.dry_run:
+            for n in names:
+                log_info("[DRY RUN] Would stop %s (PID %d)", n, pids[n])
+            return dict((n, True) for n in names)
+        sessions = set()
+        started = {}
+        stopped = {}
+
+        def signal_unit(n):
+            # Under the unit's lock, so a start running elsewhere finishes
+            # (and writes its PID) before the unit is taken down
+            pid = pids[n] = self._read_pid(n)
+            started[n] = time.monotonic()
+            # Units spawned with setsid() lead their own session, so the
+            # main PID doubles as the session id even after the leader
+            # has exited. A main PID living in some other session (a
+            # forking daemon that never detached) must not drag that
+            # whole session down with it.
+            if pid > 2:
+                try:
+                    if os.getsid(pid) == pid:
+                        sessions.add(pid)
+                except OSError:
+                    sessions.add(pid)
+            self._shutdown_unit(n, pid, deadline)
+            return True
+
+        def signal_locked(n):
+            left = max(0.0, deadline - time.monotonic())
+            self._locked("stop", n, signal_unit, timeout=left)
+            started.setdefault(n, time.monotonic())
+
+        self.discover_services()
+        layers = order_layers(names, self._ordering_edges(names))
+        layers.reverse()
+        with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            for layer in layers:
+                for _ in pool.map(signal_locked, layer):
+                    pass
+                with TIMINGS.span("sigterm_wait"):
+                    pending = [n for n in layer if pids[n] > 2]
+                    while pending:
+                        now = time.monotonic()
+                        for n in pending:
+                            if not pid_exists(pids[n]):
+                                stopped[n] = now
+                        pending = [n for n in pending if n not in stopped]
+                        if now >= deadline:
+                            break
+                        time.sleep(0.05)
+        try:
+            sessions.discard(os.getsid(0))
+        except OSError:
+            pass
+
+        with TIMINGS.span("sigkill_wait"):
+            proc = ProcSnapshot()
+            survivors = proc.session_members(sessions)
+            survivors.update(p for p in pids.values() if p > 2 and proc.alive(p))
+            for pid in survivors:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            if survivors:
+                log_warn("Sent SIGKILL to %d process(es)", len(survivors))
+                limit = time.monotonic() + 1.0
+                while time.monotonic() < limit and any(
+                    pid_exists(p) for p in survivors
+                ):
+                    time.sleep(0.02)
+
+        results = {}
+        events = {}
+
+        def record(n):
+            pid = pids[n]
+            ok = not (pid > 2 and pid_exists(pid))
+            if self._read_pid(n) != pid:
+                # Started again by someone else since it was signalled
+                return ok
+            if ok:
+                self._remove_pid(n)
+                self._remove_frozen(n)
+                self._write_status(n, "inactive")
+            else:
+                log_error("Failed to stop %s (PID %d still alive)", n, pid)
+                self._write_status(n, "failed", pid=pid, msg="Could not kill")
+            return ok
+
+        for n in names:
+            ok = self._locked("stop", n, record, timeout=1.0)
+            results[n] = ok
+            elapsed = stopped.get(n, time.monotonic()) - started[n]
+            events[n] = [("stop", elapsed, ok)]
+            if on_done:
+                on_done(n, ok)
+        self._record_metrics(events)
+        return results
 
     # ---- Reload ----
 
@@ -1580,6 +4296,9 @@ class ServiceManager:
         Fails if the service is not currently active.
         """
         name = self.resolve_name(name)
+        return self._single_flight("reload", name, self._reload)
+
+    def _reload(self, name):
         log_action("RELOAD request for %s", name)
         if is_critical_service(name):
             log_error("Refusing to manage critical service: %s", name)
@@ -1592,6 +4311,8 @@ class ServiceManager:
         if not pid or not pid_exists(pid):
             log_error("%s is not active, cannot reload.", name)
             return False
+        if not self.dry_run:
+            self._thaw_before_signal(name, pid)
         exec_reload = unit.exec_reload
         if not exec_reload:
             log_warn("No ExecReload= defined for %s, sending SIGHUP.", name)
@@ -1623,8 +4344,9 @@ class ServiceManager:
                 % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), name)
             )
         for cmd in exec_reload:
-            chk, _ = parse_exec_cmd(cmd)
-            rc, _ = self._run_cmd(cmd, env, unit, wait=True, log_file=log_file)
+            chk = not self._exec(name, unit, cmd).ignore_failure
+            with TIMINGS.span("exec_reload"):
+                rc = self._run_helper(name, unit, "ExecReload", cmd, env)
             if rc and chk:
                 log_error("ExecReload failed for %s (exit %d)", name, rc)
                 return False
@@ -1679,70 +4401,189 @@ class ServiceManager:
             log_error("Failed to kill unit %s: %s", name, e)
             return False
 
+    # ---- Freeze ----
+
+    def _frozen_path(self, name):
+        return os.path.join(FROZEN_DIR, name + ".frozen")
+
+    def frozen_record(self, name, pid=None):
+        """{"pid", "method", "cgroup", "pids", "inodes", "reason", "since"}
+        when `name` is frozen, else None. A record left from an earlier run
+        of the unit (another main PID) does not count."""
+        try:
+            with open(self._frozen_path(name), "rb") as f:
+                rec = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if pid is None:
+            pid = self._read_pid(name)
+        if not isinstance(rec, dict) or not pid or rec.get("pid") != pid:
+            return None
+        return rec
+
+    def _remove_frozen(self, name):
+        try:
+            os.unlink(self._frozen_path(name))
+        except (IOError, OSError):
+            pass
+
+    def freeze(self, name, reason="manual"):
+        """Suspend every process of the unit: through cgroup.freeze when
+        the unit has a cgroup v2 group of its own, else SIGSTOP to its
+        process tree. `reason` is "manual" or "idle" (the daemon's
+        X-ServicedIdleFreezeSec= policy, which also thaws it again).
+        """
+        name = self.resolve_name(name)
+        return self._single_flight(
+            "freeze", name, lambda n: self._freeze(n, reason)
+        )
+
+    def _freeze(self, name, reason):
+        log_action("FREEZE request for %s", name)
+        if is_critical_service(name):
+            log_error("Refusing to manage critical service: %s", name)
+            return False
+        if not self.get_unit(name):
+            log_error("Service not found: %s", name)
+            return False
+        pid = self._read_pid(name)
+        if not pid or not pid_exists(pid):
+            log_error("%s is not active, cannot freeze.", name)
+            return False
+        if pid in (1, 2):
+            log_error("Refusing to freeze PID %d", pid)
+            return False
+        if self.frozen_record(name, pid):
+            log_info("%s is already frozen", name)
+            return True
+        tree = process_tree(pid)
+        if self.dry_run:
+            log_info("[DRY RUN] Would freeze %d process(es) of %s", len(tree), name)
+            return True
+        rec = {
+            "pid": pid,
+            "method": "signal",
+            "cgroup": None,
+            "reason": reason,
+            "since": time.time(),
+            "inodes": sorted(socket_inodes(tree)),
+        }
+        group = unit_cgroup(pid)
+        if group and cgroup_procs(group) == tree and cgroup_set_frozen(group, True):
+            rec.update(method="cgroup", cgroup=group)
+        else:
+            # Stop the tree until a pass finds nothing new, so a child
+            # forked while we were at it does not stay running.
+            stopped = set()
+            while tree - stopped:
+                for p in sorted(tree - stopped):
+                    try:
+                        os.kill(p, signal.SIGSTOP)
+                    except ProcessLookupError:
+                        pass
+                    except PermissionError:
+                        if p == pid:
+                            log_error("Permission denied stopping PID %d", pid)
+                            self._send_cont(pid, stopped)
+                            return False
+                    stopped.add(p)
+                tree = process_tree(pid)
+            tree = stopped
+        rec["pids"] = sorted(tree)
+        ensure_dirs()
+        _replace_file(self._frozen_path(name), marshal.dumps(rec))
+        log_info(
+            "%s frozen (%s, %d process(es))",
+            name,
+            "cgroup.freeze" if rec["cgroup"] else "SIGSTOP",
+            len(tree),
+        )
+        return True
+
+    def thaw(self, name):
+        """Resume a unit suspended by freeze()."""
+        name = self.resolve_name(name)
+        return self._single_flight("thaw", name, self._thaw)
+
+    def _thaw(self, name):
+        log_action("THAW request for %s", name)
+        if not self.get_unit(name):
+            log_error("Service not found: %s", name)
+            return False
+        rec = self.frozen_record(name)
+        if rec is None:
+            log_info("%s is not frozen", name)
+            self._remove_frozen(name)
+            return True
+        if self.dry_run:
+            log_info("[DRY RUN] Would thaw %s (PID %d)", name, rec["pid"])
+            return True
+        self._unfreeze(name, rec)
+        log_info("%s thawed", name)
+        return True
+
+    def _unfreeze(self, name, rec):
+        if not (rec["cgroup"] and cgroup_set_frozen(rec["cgroup"], False)):
+            self._send_cont(rec["pid"], rec["pids"])
+        self._remove_frozen(name)
+
+    @staticmethod
+    def _send_cont(pid, pids):
+        """SIGCONT to the tree of `pid` and to those of `pids` still in
+        its session; a PID reused by someone else since is left alone."""
+        for p in process_tree(pid) | set(pids):
+            try:
+                if p == pid or os.getsid(p) == pid:
+                    os.kill(p, signal.SIGCONT)
+            except OSError:
+                pass
+
+    def _thaw_before_signal(self, name, pid):
+        """Thaw a frozen unit that is about to be stopped or reloaded: a
+        stopped process would not act on SIGTERM, SIGHUP or ExecStop=."""
+        rec = self.frozen_record(name, pid)
+        if rec is not None:
+            log_debug("Thawing %s first", name)
+            self._unfreeze(name, rec)
+
     # ---- Cat ----
 
-    def cat_service(self, name):
-        """Print unit file contents with path header, plus drop-in overrides."""
+    def cat_record(self, name, effective=False):
+        """Unit file and drop-in contents as {"unit", "files": [...]},
+        or None when the unit or its main file cannot be read. With
+        effective, "settings" lists the merged result: {"section", "key",
+        "values", "file"} per key, "file" being where it was last set.
+        """
         name = self.resolve_name(name)
         unit = self.get_unit(name)
         if not unit:
             log_error("No files found for %s.", name)
-            return False
+            return None
         if not unit.path:
             log_error("No unit file path for %s", name)
-            return False
-        printed_something = False
-        try:
-            with open(unit.path, "r") as f:
-                content = f.read()
-            print("# %s" % unit.path)
-            print(content, end="" if content.endswith("\n") else "\n")
-            printed_something = True
-        except (IOError, OSError) as e:
-            log_error("Failed to read %s: %s", unit.path, e)
-            return False
-
-        # Per-unit drop-in: <name>.d/*.conf
-        for unit_dir in self._unit_paths:
-            dropin_dir = os.path.join(unit_dir, name + ".d")
-            if not os.path.isdir(dropin_dir):
-                continue
-            for fname in sorted(os.listdir(dropin_dir)):
-                if not fname.endswith(".conf"):
-                    continue
-                fpath = os.path.join(dropin_dir, fname)
-                try:
-                    with open(fpath, "r") as f:
-                        content = f.read()
-                    if printed_something:
-                        print()
-                    print("# %s" % fpath)
-                    print(content, end="" if content.endswith("\n") else "\n")
-                    printed_something = True
-                except (IOError, OSError) as e:
-                    log_debug("Failed to read drop-in %s: %s", fpath, e)
-
-        # Type-level drop-in: service.d/*.conf
-        unit_type = name.rsplit(".", 1)[-1] if "." in name else "service"
-        for unit_dir in self._unit_paths:
-            type_dropin_dir = os.path.join(unit_dir, unit_type + ".d")
-            if not os.path.isdir(type_dropin_dir):
-                continue
-            for fname in sorted(os.listdir(type_dropin_dir)):
-                if not fname.endswith(".conf"):
-                    continue
-                fpath = os.path.join(type_dropin_dir, fname)
-                try:
-                    with open(fpath, "r") as f:
-                        content = f.read()
-                    if printed_something:
-                        print()
-                    print("# %s" % fpath)
-                    print(content, end="" if content.endswith("\n") else "\n")
-                    printed_something = True
-                except (IOError, OSError) as e:
-                    log_debug("Failed to read type drop-in %s: %s", fpath, e)
-        return printed_something
+            return None
+        files = []
+        for fpath in (unit.path,) + unit.dropins:
+            try:
+                with open(fpath, "r") as f:
+                    files.append({"path": fpath, "content": f.read()})
+            except (IOError, OSError) as e:
+                if fpath == unit.path:
+                    log_error("Failed to read %s: %s", fpath, e)
+                    return None
+                log_debug("Failed to read drop-in %s: %s", fpath, e)
+        rec = {"unit": name, "files": files}
+        if effective:
+            rec["settings"] = [
+                {
+                    "section": section,
+                    "key": key,
+                    "values": list(values if is_list_key(key) else values[-1:]),
+                    "file": unit.origin(section, key),
+                }
+                for section, key, values in unit.items()
+            ]
+        return rec
 
     # ---- Help ----
 
@@ -1819,6 +4660,8 @@ class ServiceManager:
                 with open(target, "w") as f:
                     f.write("# enabled")
             log_info("Enabled %s", name)
+            if unit.bus_name:
+                self._fix_bus_activation_files(name, unit)
             return True
         except PermissionError:
             log_error("Permission denied: cannot enable %s (need root?)", name)
@@ -1850,178 +4693,2469 @@ class ServiceManager:
     def is_enabled(self, name):
         return os.path.exists(os.path.join(ENABLED_DIR, name))
 
-    def start_all_enabled(self):
+    def enabled_services(self):
+        """Enabled .service names in boot (name) order."""
+        try:
+            names = os.listdir(ENABLED_DIR)
+        except OSError:
+            return []
+        return sorted(n for n in names if n.endswith(".service"))
+
+    def start_all_enabled(self, progress=None):
+        """Start every enabled unit in name order. Returns {name: ok}.
+        Holds the global boot lock: a boot started meanwhile by another
+        process waits for this one and returns its results. Progress goes
+        to BOOT_PROGRESS_FILE; pass the BootProgress of a boot begun
+        elsewhere (see _boot_background) to carry on with it, skipping
+        the units it has already settled."""
+        if self.dry_run:
+            return self._start_all_enabled()
+        lock = StateLock("boot")
+        results = lock.run("boot", lambda: self._start_all_enabled(progress))
+        if lock.shared:
+            for name, ok in sorted((results or {}).items()):
+                log_job(ok, "Started", "Failed to start", name)
+        return results or {}
+
+    def _start_all_enabled(self, progress=None):
         if not os.path.isdir(ENABLED_DIR):
-            print("No enabled services found.")
-            return
-        enabled = sorted(os.listdir(ENABLED_DIR))
+            log_info("No enabled services found.")
+            return {}
+        enabled = self.enabled_services()
         if not enabled:
-            print("No enabled services.")
-            return
-        for name in enabled:
-            if not name.endswith(".service"):
-                continue
-            ok = self.start(name)
-            msg = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-            print("%s %s %s." % (msg, "Started" if ok else "Failed to start", name))
+            log_info("No enabled services.")
+            return {}
+        if progress is None and not self.dry_run:
+            progress = BootProgress(enabled)
+            progress.save()
+        results = {}
+        with TIMINGS.span("boot"):
+            for name in enabled:
+                settled = progress and progress.state(name)
+                if settled in ("done", "failed"):
+                    results[name] = settled == "done"
+                    continue
+                if progress:
+                    progress.mark(name, "starting")
+                ok = results[name] = self.start(name)
+                if progress:
+                    progress.mark(name, "done" if ok else "failed")
+                log_job(ok, "Started", "Failed to start", name)
+        if progress:
+            progress.finish()
+        if TIMINGS.enabled and not self.dry_run:
+            TIMINGS.save(BOOT_TIMINGS_FILE, "start")
+        return results
 
     # ---- Status / Log / List ----
 
-    def status(self, name):
+    def _enabled_set(self):
+        try:
+            return set(os.listdir(ENABLED_DIR))
+        except OSError:
+            return set()
+
+    def status_record(self, name, proc=None, bus_names=None, enabled=None, shed=None):
+        """Runtime state of one unit as a plain dict. `proc`, `bus_names`,
+        `enabled` and `shed` let batch callers share one /proc listing,
+        one D-Bus ListNames call, one ENABLED_DIR listing and one read of
+        SHED_FILE across many units.
+        """
         name = self.resolve_name(name)
         unit = self.get_unit(name)
+        rec = {
+            "unit": name,
+            "load_state": "loaded" if unit else "not-found",
+            "description": "",
+            "path": None,
+            "type": None,
+            "enabled": False,
+            "documentation": [],
+            "bus_name": None,
+            "bus_name_acquired": None,
+            "sockets": [],
+            "state": "inactive",
+            "sub_state": "dead",
+            "pid": None,
+            "since": None,
+            "message": "",
+            "priority": None,
+            "shed": None,
+            "code": 4,
+        }
         if not unit:
-            print("%s - not found" % name)
-            return 4
-        print("● %s - %s" % (name, unit.description))
-        print("   Loaded: loaded (%s)" % (unit.path or "unknown"))
-        docs = unit.documentation
-        if docs:
-            all_urls = []
-            for d in docs:
-                all_urls.extend(d.split())
-            if all_urls:
-                print("     Docs: %s" % all_urls[0])
-                for url in all_urls[1:]:
-                    print("           %s" % url)
+            return rec
+        proc = proc or ProcSnapshot()
+        rec["description"] = unit.description
+        rec["path"] = unit.path
+        rec["type"] = unit.service_type
+        rec["priority"] = unit.priority
+        if shed is None:
+            shed = shed_records()
+        if name in shed:
+            rec["shed"] = dict(zip(("action", "time", "pressure", "ok"), shed[name]))
+        rec["enabled"] = (
+            name in enabled if enabled is not None else self.is_enabled(name)
+        )
+        for d in unit.documentation:
+            rec["documentation"].extend(d.split())
         if unit.bus_name:
-            ba = check_dbus_bus_name(unit.bus_name, timeout=2.0)
-            print(
-                "  BusName: %s (%s)"
-                % (unit.bus_name, "acquired" if ba else "not on bus")
-            )
+            if bus_names is None:
+                bus_names = list_dbus_names(timeout=2.0) or set()
+            rec["bus_name"] = unit.bus_name
+            rec["bus_name_acquired"] = unit.bus_name in bus_names
         for sock_name in self._find_related_sockets(name, unit):
             for sp in self._get_socket_paths(sock_name):
-                alive = is_socket_alive(sp)
-                print(
-                    "   Socket: %s (%s)"
-                    % (sp, "\033[32malive\033[0m" if alive else "dead")
-                )
+                rec["sockets"].append({"path": sp, "alive": proc.socket_alive(sp)})
         pid = self._read_pid(name)
-        sd = self._read_status(name)
-        if pid and pid_exists(pid):
-            print("   Active: \033[32mactive (running)\033[0m")
-            print("      PID: %d" % pid)
+        if pid and proc.alive(pid):
+            rec.update(state="active", sub_state="running", pid=pid, code=0)
+            frozen = self.frozen_record(name, pid)
+            if frozen:
+                rec["sub_state"] = "frozen"
+                rec["message"] = "Frozen (%s, %s) since %s" % (
+                    frozen["reason"],
+                    "cgroup.freeze" if frozen["cgroup"] else "SIGSTOP",
+                    time.strftime(
+                        "%Y-%m-%d %H:%M:%S", time.localtime(frozen["since"])
+                    ),
+                )
             try:
                 st = os.stat("/proc/%d" % pid)
-                started = datetime.datetime.fromtimestamp(st.st_mtime)
-                uptime = datetime.datetime.now() - started
-                print(
-                    "    Since: %s (%s ago)"
-                    % (started.strftime("%Y-%m-%d %H:%M:%S"), str(uptime).split(".")[0])
-                )
+                rec["since"] = datetime.datetime.fromtimestamp(st.st_mtime).isoformat()
             except (OSError, IOError):
                 pass
-            return 0
-        elif sd:
+            return rec
+        sd = self._read_status(name)
+        if sd:
             state = sd.get("state", "inactive")
-            if state == "active":
-                print("   Active: \033[32m%s\033[0m" % state)
-            elif state == "failed":
-                print("   Active: \033[31m%s\033[0m" % state)
-            else:
-                print("   Active: %s" % state)
-            if sd.get("message"):
-                print("   Status: %s" % sd["message"])
-            if sd.get("timestamp"):
-                print("    Since: %s" % sd["timestamp"])
-            return 0 if state == "active" else 3
+            rec["state"] = state
+            rec["sub_state"] = {"active": "exited", "failed": "failed"}.get(
+                state, "dead"
+            )
+            rec["message"] = sd.get("message", "")
+            rec["since"] = sd.get("timestamp") or None
+            rec["code"] = 0 if state == "active" else 3
         else:
-            print("   Active: inactive (dead)")
-            return 3
+            rec["code"] = 3
+        return rec
+
+    def status_records(self, names, proc=None, bus_names=None):
+        """Yield status records for `names` from one discovery, one /proc
+        listing and at most one D-Bus query. Pass `proc`/`bus_names` to
+        reuse ones the caller already has.
+        """
+        if proc is None:
+            proc = ProcSnapshot()
+        enabled = self._enabled_set()
+        shed = shed_records()
+        for name in names:
+            unit = self.get_unit(name)
+            if unit and unit.bus_name and bus_names is None:
+                bus_names = list_dbus_names(timeout=2.0) or set()
+            yield self.status_record(
+                name, proc=proc, bus_names=bus_names, enabled=enabled, shed=shed
+            )
+
+    def all_service_names(self):
+        self.discover_services()
+        return sorted(self._units.keys())
 
-    def show_log(self, name, lines=50):
+    def log_lines(self, name, lines=50):
+        """Last `lines` lines of the unit log, or None if there is none."""
         name = self.resolve_name(name)
         log_file = self._log_path(name)
         if not os.path.isfile(log_file):
             log_info("No logs found for %s", name)
-            return
+            return None
         try:
             with open(log_file) as f:
                 all_lines = f.readlines()
-            for line in all_lines[-lines:]:
-                print(line, end="")
-            if not all_lines:
-                print("(empty log)")
         except (IOError, OSError) as e:
             log_error("Failed to read log for %s: %s", name, e)
+            return None
+        return [line.rstrip("\n") for line in all_lines[-lines:]] if lines else []
 
-    def list_services(self, running_only=False):
+    def list_records(self, running_only=False):
+        """Yield one dict per discovered service, sharing one /proc listing."""
         self.discover_services()
-        rows = []
+        proc = ProcSnapshot()
+        enabled = self._enabled_set()
         for name in sorted(self._units.keys()):
             unit = self._units[name]
             stype = unit.service_type
             pid = self._read_pid(name)
-            is_running = pid > 0 and pid_exists(pid)
+            is_running = pid > 0 and proc.alive(pid)
             if running_only and not is_running:
                 continue
-            critical = is_critical_service(name)
-            unsupported = stype in UNSUPPORTED_TYPES
             if is_running:
-                state = "\033[32mrunning\033[0m"
+                state = "frozen" if self.frozen_record(name, pid) else "running"
             else:
                 sd = self._read_status(name)
-                if sd and sd.get("state") == "failed":
-                    state = "\033[31mfailed\033[0m"
-                else:
-                    state = "stopped"
-            flags = ""
-            if critical:
-                flags = " [CRITICAL]"
-            elif unsupported:
-                flags = " [UNSUPPORTED:%s]" % stype
-            rows.append(
-                (
-                    name,
-                    stype,
-                    state,
-                    str(pid) if is_running else "-",
-                    unit.description[:50],
-                    flags,
+                state = "failed" if sd and sd.get("state") == "failed" else "stopped"
+            yield {
+                "unit": name,
+                "type": stype,
+                "state": state,
+                "pid": pid if is_running else None,
+                "description": unit.description,
+                "enabled": name in enabled,
+                "critical": is_critical_service(name),
+                "unsupported": stype in UNSUPPORTED_TYPES,
+            }
+
+    # ---- Timings ----
+
+    def show_blame(self, lines=20):
+        """List units of the last boot by exclusive start time, slowest
+        first, with the phase that took longest inside each.
+        """
+        data = self._load_boot_timings()
+        if data is None:
+            return False
+        records = data.get("spans", [])
+        self_times = unit_self_times(records)
+        if not self_times:
+            log_info("No units were started during the last boot.")
+            return False
+        worst_phase = {}
+        for r in records:
+            if r["phase"] in ("start", "boot") or not r["unit"]:
+                continue
+            cur = worst_phase.get(r["unit"])
+            if cur is None or r["duration_ms"] > cur[1]:
+                worst_phase[r["unit"]] = (r["phase"], r["duration_ms"])
+        print("Last boot: %s" % data.get("timestamp", "unknown"))
+        print("%10s  %-40s %s" % ("TIME", "UNIT", "SLOWEST PHASE"))
+        print("-" * 80)
+        ranked = sorted(self_times.items(), key=lambda kv: kv[1], reverse=True)
+        for unit_name, ms in ranked[:lines]:
+            phase = worst_phase.get(unit_name)
+            print(
+                "%8.1fms  %-40s %s"
+                % (
+                    ms,
+                    unit_name,
+                    "%s (%.1fms)" % phase if phase else "-",
+                )
+            )
+        return True
+
+    def _load_boot_timings(self):
+        try:
+            with open(BOOT_TIMINGS_FILE) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            log_info("No boot timings recorded yet (run 'serviced start').")
+            return None
+
+    def _boot_dependencies(self, name, booted):
+        """Ordering/requirement edges of `name` restricted to units that
+        were started during the boot. Sockets map to their services.
+        """
+        unit = self.get_unit(name)
+        if not unit:
+            return set()
+        deps = set()
+        for dep in unit.requires + unit.wants + unit.after + unit.binds_to:
+            if dep.endswith(".socket"):
+                dep = self._find_service_for_socket(dep)
+            elif "." not in dep:
+                dep += ".service"
+            if dep != name and dep in booted:
+                deps.add(dep)
+        for sock in self._find_related_sockets(name, unit):
+            svc = self._find_service_for_socket(sock)
+            if svc != name and svc in booted:
+                deps.add(svc)
+        return deps
+
+    def critical_chain(self, units, target=None):
+        """Longest self-time path through the dependency graph of the
+        booted units, i.e. the boot time left if everything else ran in
+        parallel. Returns [(unit, finish_ms)] from target back to the root.
+        """
+        deps = {}
+        for name in units:
+            deps[name] = self._boot_dependencies(name, units)
+        for name, u in units.items():
+            if u["pulled_by"] in units:
+                deps.setdefault(u["pulled_by"], set()).add(name)
+        finish = {}
+
+        def visit(name, path):
+            if name in finish:
+                return finish[name]
+            if name in path:
+                return 0.0
+            path.add(name)
+            best = max([visit(d, path) for d in deps.get(name, ())] or [0.0])
+            path.discard(name)
+            finish[name] = best + units[name]["self_ms"]
+            return finish[name]
+
+        for name in units:
+            visit(name, set())
+        if target is None:
+            target = max(finish, key=finish.get)
+        chain = []
+        seen = set()
+        cur = target
+        while cur and cur not in seen:
+            seen.add(cur)
+            chain.append((cur, finish[cur]))
+            candidates = [d for d in deps.get(cur, ()) if d not in seen]
+            cur = max(candidates, key=finish.get) if candidates else None
+        return chain
+
+    def analyze(self, name=None, trace_file=None, svg_file=None):
+        """Print the critical chain of the last boot and optionally export
+        a Chrome trace-event JSON file and an SVG timeline.
+        """
+        data = self._load_boot_timings()
+        if data is None:
+            return False
+        records = data.get("spans", [])
+        units = boot_unit_times(records)
+        if not units:
+            log_info("No units were started during the last boot.")
+            return False
+        if name:
+            name = self.resolve_name(name)
+            if name not in units:
+                log_error("%s was not started during the last boot.", name)
+                return False
+        self.discover_services()
+        chain = self.critical_chain(units, name)
+        serial = max(u["end"] for u in units.values())
+        print("Last boot: %s" % data.get("timestamp", "unknown"))
+        print(
+            "The time when unit became ready is printed after the \"@\" character.\n"
+            "The time the unit took to start is printed after the \"+\" character.\n"
+        )
+        for depth, (unit_name, _) in enumerate(chain):
+            u = units[unit_name]
+            prefix = "" if depth == 0 else "  " * (depth - 1) + "\u2514\u2500"
+            print(
+                "%s%s @%.0fms +%.0fms%s"
+                % (
+                    prefix,
+                    unit_name,
+                    u["ready"],
+                    u["self_ms"],
+                    "" if u["ok"] else " (failed)",
+                )
+            )
+        on_chain = set(n for n, _ in chain)
+        print(
+            "\nBoot took %.0fms serially; the critical chain needs %.0fms."
+            % (serial, chain[0][1])
+        )
+        delaying = sorted(
+            ((n, u["self_ms"]) for n, u in units.items() if n in on_chain),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )
+        print("Units delaying the chain:")
+        for unit_name, ms in delaying:
+            print("  %8.1fms  %s" % (ms, unit_name))
+        off_chain = sorted(
+            ((n, u["self_ms"]) for n, u in units.items() if n not in on_chain),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )
+        if off_chain:
+            print("Off the critical chain (candidates for parallel or lazy start):")
+            for unit_name, ms in off_chain:
+                print("  %8.1fms  %s" % (ms, unit_name))
+        for path, render in (
+            (trace_file, lambda: json.dumps(chrome_trace(records))),
+            (svg_file, lambda: svg_timeline(units)),
+        ):
+            if not path:
+                continue
+            try:
+                with open(path, "w") as f:
+                    f.write(render())
+                log_info("Wrote %s", path)
+            except (IOError, OSError) as e:
+                log_error("Failed to write %s: %s", path, e)
+                return False
+        return True
+
+
+# ---- Metrics ----
+#
+# Counters and histograms are bumped when a job ends (ServiceManager.
+# _record_metrics) and kept in METRICS_FILE, so a scrape only reads that
+# file, the status files and one pass over /proc for CPU and memory. The
+# exposition is Prometheus text format 0.0.4; it is printed by 'serviced
+# metrics', served on GET /metrics by the daemon's control socket and,
+# with SERVICED_METRICS_TEXTFILE set, rewritten atomically after every
+# job for node_exporter's textfile collector. Updates hold flock() on
+# METRICS_FILE.lock as well as _METRICS_LOCK, so counters bumped by
+# concurrent serviced processes are not lost.
+
+_METRICS_LOCK = _thread.allocate_lock()
+
+_METRIC_COUNTERS = (
+    ("serviced_unit_starts_total", "starts", "Starts requested"),
+    ("serviced_unit_start_failures_total", "start_failures", "Starts that failed"),
+    ("serviced_unit_stops_total", "stops", "Stops requested"),
+    ("serviced_unit_stop_failures_total", "stop_failures", "Stops that failed"),
+    ("serviced_unit_restarts_total", "restarts", "Restarts requested"),
+)
+
+_METRIC_HISTOGRAMS = (
+    ("start", "Time from the end of dependency starts to the unit being up"),
+    ("stop", "Time a stop took"),
+    ("exec_start_pre", "Time spent in ExecStartPre= commands"),
+)
+
+
+class MetricsStore:
+    """Per-unit counters and histograms in a marshal file: name ->
+    {"<event>s": n, "<event>_failures": n, "<event>_hist": [bucket
+    counts..., +Inf count, sum]}."""
+
+    def __init__(self, path=None):
+        self.path = METRICS_FILE if path is None else path
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _flock(self):
+        """An fd holding flock() on the lock file next to the store, or
+        None when it cannot be had (the update then goes ahead)."""
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+            fd = os.open(
+                self.path + ".lock", os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644
+            )
+        except OSError as e:
+            log_debug("Cannot lock %s: %s", self.path, e)
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError as e:
+            log_debug("Cannot lock %s: %s", self.path, e)
+        return fd
+
+    def record(self, events):
+        with _METRICS_LOCK:
+            fd = self._flock()
+            try:
+                self._merge(events)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def _merge(self, events):
+        """Read, add `events`, replace; the caller holds the locks."""
+        data = self.load()
+        for name, items in events.items():
+            entry = data.setdefault(name, {})
+            for event, seconds, ok in items:
+                key = event + "s"
+                entry[key] = entry.get(key, 0) + 1
+                if not ok:
+                    key = event + "_failures"
+                    entry[key] = entry.get(key, 0) + 1
+                if seconds is not None:
+                    hist = entry.get(event + "_hist")
+                    if hist is None:
+                        hist = entry[event + "_hist"] = [0] * (
+                            len(METRICS_BUCKETS) + 1
+                        ) + [0.0]
+                    for i, bound in enumerate(METRICS_BUCKETS):
+                        if seconds <= bound:
+                            break
+                    else:
+                        i = len(METRICS_BUCKETS)
+                    hist[i] += 1
+                    hist[-1] += seconds
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+            with open(tmp, "wb") as f:
+                marshal.dump(data, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            log_debug("Failed to save %s: %s", self.path, e)
+
+
+def process_usage():
+    """({session id: [cpu ticks, rss pages]}, {pid: [cpu ticks, rss
+    pages]}) from one pass over /proc/*/stat."""
+    by_sid = {}
+    by_pid = {}
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return by_sid, by_pid
+    for p in pids:
+        try:
+            with open("/proc/%s/stat" % p) as f:
+                fields = f.read().rsplit(")", 1)[-1].split()
+            usage = [int(fields[11]) + int(fields[12]), int(fields[21])]
+            sid = int(fields[3])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        by_pid[int(p)] = usage
+        total = by_sid.setdefault(sid, [0, 0])
+        total[0] += usage[0]
+        total[1] += usage[1]
+    return by_sid, by_pid
+
+
+def _metric_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def collect_metrics(mgr):
+    """Prometheus text exposition of every unit serviced has run, has
+    state for, or has enabled."""
+    store = MetricsStore().load()
+    names = set(store)
+    for directory, suffix in ((PID_DIR, ".pid"), (STATUS_DIR, ".json")):
+        try:
+            names.update(
+                f[: -len(suffix)] for f in os.listdir(directory) if f.endswith(suffix)
+            )
+        except OSError:
+            pass
+    names.update(mgr._enabled_set())
+    proc = ProcSnapshot()
+    by_sid, by_pid = process_usage()
+    ticks = float(os.sysconf("SC_CLK_TCK"))
+    page = os.sysconf("SC_PAGE_SIZE")
+    state_lines = []
+    exit_lines = []
+    usage_lines = []
+    for name in sorted(names):
+        label = _metric_label(name)
+        pid = mgr._read_pid(name)
+        status = None
+        if pid and proc.alive(pid):
+            state = "active"
+            try:
+                usage = by_sid[pid] if os.getsid(pid) == pid else by_pid[pid]
+            except (OSError, KeyError):
+                usage = None
+            if usage:
+                usage_lines.append(
+                    'serviced_unit_cpu_seconds_total{unit="%s"} %.2f'
+                    % (label, usage[0] / ticks)
                 )
+                usage_lines.append(
+                    'serviced_unit_memory_rss_bytes{unit="%s"} %d'
+                    % (label, usage[1] * page)
+                )
+        else:
+            status = mgr._read_status(name) or {}
+            state = status.get("state") or "inactive"
+            if state not in ("active", "failed"):
+                state = "inactive"
+        for s in ("active", "inactive", "failed"):
+            state_lines.append(
+                'serviced_unit_state{unit="%s",state="%s"} %d'
+                % (label, s, s == state)
             )
-        if not rows:
-            print("No services found." if not running_only else "No running services.")
+        if status is None:
+            status = mgr._read_status(name) or {}
+        if status.get("exit_code") is not None:
+            exit_lines.append(
+                'serviced_unit_last_exit_code{unit="%s"} %d'
+                % (label, status["exit_code"])
+            )
+
+    out = [
+        "# HELP serviced_unit_state Unit state, 1 for the current one.",
+        "# TYPE serviced_unit_state gauge",
+    ]
+    out.extend(state_lines)
+    for metric, key, text in _METRIC_COUNTERS:
+        out.append("# HELP %s %s." % (metric, text))
+        out.append("# TYPE %s counter" % metric)
+        for name in sorted(store):
+            if key in store[name]:
+                out.append(
+                    '%s{unit="%s"} %d' % (metric, _metric_label(name), store[name][key])
+                )
+    out.append("# HELP serviced_unit_last_exit_code Exit status of the last run.")
+    out.append("# TYPE serviced_unit_last_exit_code gauge")
+    out.extend(exit_lines)
+    for event, text in _METRIC_HISTOGRAMS:
+        metric = "serviced_unit_%s_duration_seconds" % event
+        out.append("# HELP %s %s." % (metric, text))
+        out.append("# TYPE %s histogram" % metric)
+        for name in sorted(store):
+            hist = store[name].get(event + "_hist")
+            if not hist:
+                continue
+            label = _metric_label(name)
+            count = 0
+            for bound, n in zip(METRICS_BUCKETS + ("+Inf",), hist):
+                count += n
+                out.append(
+                    '%s_bucket{unit="%s",le="%s"} %d' % (metric, label, bound, count)
+                )
+            out.append('%s_sum{unit="%s"} %.6f' % (metric, label, hist[-1]))
+            out.append('%s_count{unit="%s"} %d' % (metric, label, count))
+    out.append("# HELP serviced_unit_cpu_seconds_total CPU time of the unit's session.")
+    out.append("# TYPE serviced_unit_cpu_seconds_total counter")
+    out.extend(line for line in usage_lines if line.startswith("serviced_unit_cpu"))
+    out.append("# HELP serviced_unit_memory_rss_bytes Resident memory of the session.")
+    out.append("# TYPE serviced_unit_memory_rss_bytes gauge")
+    out.extend(line for line in usage_lines if line.startswith("serviced_unit_memory"))
+    return "\n".join(out) + "\n"
+
+
+def write_metrics_textfile(path, text):
+    """Replace `path` with `text` atomically, for a textfile collector."""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        log_warn("Cannot write metrics to %s: %s", path, e)
+
+
+# ---- Library API ----
+#
+# Client is the in-process interface: queries return UnitStatus/UnitInfo,
+# jobs return JobResult, failures raise ServicedError and nothing is
+# printed. The command line below only renders what it returns.
+
+
+class ServicedError(Exception):
+    """Base class of every error raised by Client."""
+
+
+class UnitNotFoundError(ServicedError):
+    def __init__(self, unit):
+        ServicedError.__init__(self, "Unit %s not found." % unit)
+        self.unit = unit
+
+
+class OperationError(ServicedError):
+    """enable/disable/kill/freeze/thaw/cat failed; `unit` and `op` say
+    which."""
+
+    def __init__(self, op, unit, message=None):
+        ServicedError.__init__(self, message or "Failed to %s %s" % (op, unit))
+        self.op = op
+        self.unit = unit
+
+
+class JobFailedError(ServicedError):
+    """A job run with check=True had failures; `results` has them all."""
+
+    def __init__(self, op, results):
+        failed = [r.unit for r in results if not r.ok]
+        ServicedError.__init__(self, "%s failed: %s" % (op, " ".join(failed)))
+        self.op = op
+        self.results = results
+
+
+class _Record:
+    """Fixed set of attributes; to_dict() gives the JSON form."""
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for key in self.__slots__:
+            setattr(self, key, fields.get(key))
+
+    def to_dict(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            type(self).__name__,
+            ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__[:4]),
+        )
+
+
+class UnitStatus(_Record):
+    """Runtime state of one unit, as in 'serviced -o json status'."""
+
+    __slots__ = (
+        "unit",
+        "load_state",
+        "description",
+        "path",
+        "type",
+        "enabled",
+        "documentation",
+        "bus_name",
+        "bus_name_acquired",
+        "sockets",
+        "state",
+        "sub_state",
+        "pid",
+        "since",
+        "message",
+        "priority",
+        "shed",
+        "code",
+    )
+
+    @property
+    def active(self):
+        return self.state == "active"
+
+
+class UnitInfo(_Record):
+    """One row of 'serviced list'."""
+
+    __slots__ = (
+        "unit",
+        "type",
+        "state",
+        "pid",
+        "description",
+        "enabled",
+        "critical",
+        "unsupported",
+    )
+
+
+class JobResult(_Record):
+    """Outcome of a job for one unit. `phases` maps phase to ms when the
+    Client records timings; `messages` are the (level, text) log lines
+    that named the unit while the job ran, `error` the last ERROR one.
+    """
+
+    __slots__ = (
+        "unit",
+        "op",
+        "ok",
+        "state",
+        "pid",
+        "duration_ms",
+        "phases",
+        "messages",
+        "error",
+    )
+
+
+class Client:
+    """serviced as a library. Keep one instance and reuse it: the unit
+    index is parsed once (refresh() drops it), and the status calls take
+    a shared ProcSnapshot and D-Bus name set so a poller pays for /proc
+    and the bus once per round, not once per unit.
+
+    With capture_logs (the default) messages go to `messages` instead of
+    the terminal; that handler is process-wide. Jobs are serialized, and
+    queries may run from any thread meanwhile.
+    """
+
+    MAX_MESSAGES = 1000
+
+    def __init__(
+        self, user_mode=False, dry_run=False, capture_logs=True, timings=False
+    ):
+        self.manager = ServiceManager(dry_run=dry_run, user_mode=user_mode)
+        self.messages = []
+        self.timings = timings
+        self._seq = 0
+        self._msg_lock = _thread.allocate_lock()
+        self._job_lock = _thread.allocate_lock()
+        if timings:
+            TIMINGS.enabled = True
+        if capture_logs:
+            set_log_handler(self._on_log)
+
+    def _on_log(self, level, text):
+        with self._msg_lock:
+            self._seq += 1
+            self.messages.append((self._seq, level, text))
+            if len(self.messages) > self.MAX_MESSAGES:
+                del self.messages[: -self.MAX_MESSAGES]
+
+    def _messages_since(self, seq):
+        with self._msg_lock:
+            return [(lvl, text) for n, lvl, text in self.messages if n > seq]
+
+    # ---- Queries ----
+
+    def refresh(self):
+        """Re-read unit files on the next call."""
+        self.manager.invalidate()
+
+    @staticmethod
+    def snapshot():
+        """A /proc listing to pass as `proc` to several status calls."""
+        return ProcSnapshot()
+
+    @staticmethod
+    def bus_names(timeout=2.0):
+        """Names on the system bus, to pass as `bus_names`."""
+        return list_dbus_names(timeout=timeout) or set()
+
+    def unit_names(self):
+        return self.manager.all_service_names()
+
+    def status(self, name, proc=None, bus_names=None):
+        rec = self.manager.status_record(name, proc=proc, bus_names=bus_names)
+        if rec["load_state"] == "not-found":
+            raise UnitNotFoundError(rec["unit"])
+        return UnitStatus(**rec)
+
+    def statuses(self, names=None, proc=None, bus_names=None):
+        """UnitStatus for each name (default: every unit). Unknown units
+        come back with load_state "not-found" instead of raising.
+        """
+        if names is None:
+            names = self.unit_names()
+        records = self.manager.status_records(names, proc=proc, bus_names=bus_names)
+        return [UnitStatus(**rec) for rec in records]
+
+    def units(self, running_only=False):
+        return [UnitInfo(**rec) for rec in self.manager.list_records(running_only)]
+
+    def log(self, name, lines=50):
+        """Last `lines` lines of the unit log, None if it has none."""
+        return self.manager.log_lines(name, lines)
+
+    def metrics(self):
+        """Prometheus text exposition of unit states, job counters and
+        histograms, and per-unit CPU and memory."""
+        return collect_metrics(self.manager)
+
+    def events(self, units=None):
+        """A UnitEvents reporting on `units` (names or globs), or on every
+        unit when None."""
+        mgr = self.manager
+        if not units:
+            return UnitEvents(mgr)
+        names = set()
+        globs = []
+        for pat in units:
+            if any(c in pat for c in "*?["):
+                globs.append(mgr.resolve_name(pat))
+            else:
+                names.add(mgr.resolve_name(pat))
+
+        def match(name):
+            return name in names or any(fnmatch.fnmatchcase(name, g) for g in globs)
+
+        return UnitEvents(mgr, match)
+
+    @staticmethod
+    def boot_status():
+        """BootProgress.summary() of the current or last boot, or None."""
+        progress = BootProgress.load()
+        return progress and progress.summary()
+
+    def cat(self, name, effective=False):
+        """{"unit", "files": [{"path", "content"}]} for the unit, plus the
+        merged "settings" with effective (see ServiceManager.cat_record)."""
+        name = self.manager.resolve_name(name)
+        if not self.manager.get_unit(name):
+            raise UnitNotFoundError(name)
+        rec = self.manager.cat_record(name, effective)
+        if rec is None:
+            raise OperationError("cat", name)
+        return rec
+
+    # ---- Jobs ----
+
+    def resolve(self, patterns):
+        """Split names and globs into (known, missing, unmatched): units
+        with a unit file, names without one and globs matching nothing.
+        """
+        names, unmatched = self.manager.expand_units(patterns)
+        known = [n for n in names if self.manager.get_unit(n)]
+        missing = [n for n in names if n not in known]
+        return known, missing, unmatched
+
+    def expand(self, units):
+        """Names and globs to unit names; unknown ones raise."""
+        if isinstance(units, str):
+            units = [units]
+        names, unmatched = self.manager.expand_units(units)
+        if unmatched:
+            raise UnitNotFoundError(unmatched[0])
+        for name in names:
+            if not self.manager.get_unit(name):
+                raise UnitNotFoundError(name)
+        return names
+
+    def _job(self, op, names, run, check):
+        with self._job_lock:
+            ensure_dirs()
+            with self._msg_lock:
+                seq = self._seq
+            if self.timings:
+                TIMINGS.spans = []
+            t0 = time.monotonic()
+            finished = {}
+            results = run(lambda name, ok: finished.setdefault(name, time.monotonic()))
+            messages = self._messages_since(seq)
+            records = TIMINGS.records() if self.timings else []
+            out = []
+            # state and pid only; skip the D-Bus round trip
+            for rec in self.manager.status_records(names, bus_names=frozenset()):
+                name = rec["unit"]
+                mine = [m for m in messages if name in m[1]]
+                errors = [text for lvl, text in mine if lvl == "ERROR"]
+                phases = None
+                if self.timings:
+                    phases = {}
+                    for r in records:
+                        if r["unit"] == name:
+                            phases[r["phase"]] = (
+                                phases.get(r["phase"], 0.0) + r["duration_ms"]
+                            )
+                out.append(
+                    JobResult(
+                        unit=name,
+                        op=op,
+                        ok=bool(results.get(name, False)),
+                        state=rec["state"],
+                        pid=rec["pid"],
+                        duration_ms=round(
+                            (finished.get(name, time.monotonic()) - t0) * 1000.0, 3
+                        ),
+                        phases=phases,
+                        messages=mine,
+                        error=errors[-1] if errors else None,
+                    )
+                )
+        if check and not all(r.ok for r in out):
+            raise JobFailedError(op, out)
+        return out
+
+    def run(self, op, units, jobs=4, check=False, on_done=None):
+        """start, stop, restart or reload `units` (names or globs) as one
+        transaction. Returns a JobResult per unit; with check=True a
+        failure raises JobFailedError. on_done(name, ok) fires as units
+        finish.
+        """
+        if op not in ("start", "stop", "restart", "reload"):
+            raise ValueError("unknown job type: %s" % op)
+        names = self.expand(units)
+
+        def run(done):
+            def both(name, ok):
+                done(name, ok)
+                if on_done:
+                    on_done(name, ok)
+
+            mgr = self.manager
+            if op == "restart":
+                mgr.run_transaction("stop", names, jobs=jobs)
+                results = mgr.run_transaction("start", names, jobs=jobs, on_done=both)
+                mgr._record_metrics(
+                    dict((n, [("restart", None, ok)]) for n, ok in results.items())
+                )
+                return results
+            return mgr.run_transaction(op, names, jobs=jobs, on_done=both)
+
+        return self._job(op, names, run, check)
+
+    def start(self, units, **kwargs):
+        return self.run("start", units, **kwargs)
+
+    def stop(self, units, **kwargs):
+        return self.run("stop", units, **kwargs)
+
+    def restart(self, units, **kwargs):
+        return self.run("restart", units, **kwargs)
+
+    def reload(self, units, **kwargs):
+        return self.run("reload", units, **kwargs)
+
+    def shutdown(self, timeout=5.0, jobs=4, check=False, on_done=None):
+        """Stop everything that runs (see ServiceManager.shutdown)."""
+        names = self.manager._active_units()
+
+        def run(done):
+            def both(name, ok):
+                done(name, ok)
+                if on_done:
+                    on_done(name, ok)
+
+            return self.manager.shutdown(timeout=timeout, jobs=jobs, on_done=both)
+
+        return self._job("stop", names, run, check)
+
+    def boot(self, check=False):
+        """Start every enabled unit, like 'serviced start'."""
+        enabled = self.manager._enabled_set()
+        names = sorted(n for n in enabled if n.endswith(".service"))
+
+        def run(done):
+            return self.manager.start_all_enabled()
+
+        return self._job("start", names, run, check)
+
+    def enable(self, name):
+        self._simple("enable", name, self.manager.enable)
+
+    def disable(self, name):
+        self._simple("disable", name, self.manager.disable)
+
+    def kill(self, name, sig="SIGTERM", who="all"):
+        self._simple(
+            "kill", name, lambda n: self.manager.kill_service(n, sig=sig, kill_who=who)
+        )
+
+    def freeze(self, name):
+        self._simple("freeze", name, self.manager.freeze)
+
+    def thaw(self, name):
+        self._simple("thaw", name, self.manager.thaw)
+
+    def _simple(self, op, name, fn):
+        name = self.manager.resolve_name(name)
+        with self._msg_lock:
+            seq = self._seq
+        if not fn(name):
+            errors = [t for lvl, t in self._messages_since(seq) if lvl == "ERROR"]
+            raise OperationError(op, name, errors[-1] if errors else None)
+
+
+# ---- Daemon ----
+#
+# 'serviced daemon' keeps one Client resident and serves it on
+# CONTROL_SOCKET, one request per connection: a JSON line
+# {"call": ..., "args": {...}} is answered by a JSON line {"result": ...}
+# or {"error": {...}}. The CLI sends "M" + the same request in marshal
+# form and half-closes instead, gets marshal back and so never imports
+# json; the socket is mode 0600, so only the daemon's own user (root)
+# can feed it. Status answers come from memory and are dropped when
+# inotify reports a change under the state or unit directories, when a
+# unit the daemon started exits, or after DAEMON_STATUS_TTL, since a
+# forking unit can die without anyone being told.
+
+
+class DirWatcher:
+    """Change notification for a few directories: inotify through libc
+    where it works, an mtime comparison in poll() for the rest.
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    # | IN_CREATE | IN_DELETE
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+
+    def __init__(self, dirs):
+        self.dirs = [d for d in dirs if os.path.isdir(d)]
+        self.fd = None
+        self._wd = {}
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            fd = -1
+        if fd >= 0:
+            self.fd = fd
+            for d in self.dirs:
+                wd = libc.inotify_add_watch(fd, os.fsencode(d), self.MASK)
+                if wd >= 0:
+                    self._wd[wd] = d
+        watched = set(self._wd.values())
+        self._polled = dict(
+            (d, self._stamp(d)) for d in self.dirs if d not in watched
+        )
+
+    @property
+    def mode(self):
+        if not self._polled:
+            return "inotify"
+        return "inotify+poll" if self._wd else "poll"
+
+    @staticmethod
+    def _stamp(path):
+        # Status files are rewritten in place, which leaves the directory
+        # mtime alone; look at the entries too.
+        try:
+            st = os.stat(path)
+            entries = [e.stat().st_mtime_ns for e in os.scandir(path)]
+        except OSError:
+            return None
+        return st.st_mtime_ns, len(entries), max(entries) if entries else 0
+
+    def read(self):
+        """Directories with inotify events since the last call."""
+        return set(d for d, _ in self.events())
+
+    def events(self):
+        """(directory, file name) per inotify event since the last call;
+        the name is None when the kernel dropped events (IN_Q_OVERFLOW)
+        and the whole directory has to be looked at again."""
+        try:
+            data = os.read(self.fd, 65536)
+        except (BlockingIOError, InterruptedError):
+            return []
+        found = []
+        pos = 0
+        while pos + 16 <= len(data):
+            wd = int.from_bytes(data[pos : pos + 4], sys.byteorder, signed=True)
+            length = int.from_bytes(data[pos + 12 : pos + 16], sys.byteorder)
+            if wd == -1:  # IN_Q_OVERFLOW
+                found.extend((d, None) for d in self.dirs)
+            elif wd in self._wd:
+                name = data[pos + 16 : pos + 16 + length].rstrip(b"\0")
+                found.append((self._wd[wd], os.fsdecode(name) or None))
+            pos += 16 + length
+        return found
+
+    def poll(self):
+        """Directories without a watch whose stamp moved."""
+        changed = set()
+        for d, old in self._polled.items():
+            new = self._stamp(d)
+            if new != old:
+                self._polled[d] = new
+                changed.add(d)
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class IdleFreezer:
+    """The daemon's idle policy, for units that set (in a drop-in, say)
+
+        [Service]
+        X-ServicedIdleFreezeSec=15min
+
+    Every IDLE_CHECK_SEC it samples the CPU time and the open sockets of
+    each running unit that has the key. A unit whose processes used no
+    more than a clock tick between samples and opened or closed no
+    socket for that long is frozen, and thawed again as soon as a
+    connection waits on one of the sockets it was listening on. Units
+    frozen by hand are left alone.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        # name -> (main PID, CPU ticks, socket inodes, idle since)
+        self._seen = {}
+        # units this policy froze: name -> socket inodes to watch
+        self.frozen = {}
+        self._next = 0.0
+
+    def tick(self, now, busy=False):
+        """Thaw units with connections waiting; every IDLE_CHECK_SEC, and
+        not while a job runs (`busy`), freeze the ones idle long enough."""
+        if self.frozen:
+            self._thaw_waiting()
+        if now >= self._next and not busy:
+            self._next = now + IDLE_CHECK_SEC
+            self._check(now)
+
+    def _thaw_waiting(self):
+        watched = set()
+        for inodes in self.frozen.values():
+            watched.update(inodes)
+        waiting = pending_connections(watched)
+        for name, inodes in list(self.frozen.items()):
+            if waiting.intersection(inodes):
+                del self.frozen[name]
+                self._seen.pop(name, None)
+                log_info("%s: connection waiting, thawing", name)
+                self.manager.thaw(name)
+
+    def _check(self, now):
+        mgr = self.manager
+        try:
+            files = os.listdir(PID_DIR)
+        except OSError:
+            return
+        proc = ProcSnapshot()
+        usage = None
+        seen = {}
+        frozen = {}
+        for fname in files:
+            if not fname.endswith(".pid"):
+                continue
+            name = fname[:-4]
+            unit = mgr.get_unit(name)
+            pid = mgr._read_pid(name)
+            if unit is None or not proc.alive(pid):
+                continue
+            rec = mgr.frozen_record(name, pid)
+            if rec is not None:
+                if rec.get("reason") == "idle":
+                    frozen[name] = rec["inodes"]
+                continue
+            limit = parse_timespan(
+                unit.get("Service", "X-ServicedIdleFreezeSec", ""), None
+            )
+            if not limit:
+                continue
+            if usage is None:
+                usage = process_usage()
+            by_sid, by_pid = usage
+            try:
+                cpu = (by_sid[pid] if os.getsid(pid) == pid else by_pid[pid])[0]
+            except (OSError, KeyError):
+                continue
+            inodes = frozenset(socket_inodes(process_tree(pid, proc)))
+            last = self._seen.get(name)
+            since = now
+            if last and last[0] == pid and last[2] == inodes and cpu - last[1] <= 1:
+                since = last[3]
+            seen[name] = (pid, cpu, inodes, since)
+            if now - since < limit or StateLock(name).busy():
+                continue
+            log_info("%s idle for %ds, freezing", name, now - since)
+            if mgr.freeze(name, reason="idle"):
+                del seen[name]
+                rec = mgr.frozen_record(name, pid)
+                if rec is not None:
+                    frozen[name] = rec["inodes"]
+        self._seen = seen
+        self.frozen = frozen
+
+
+def memory_pressure(path=None):
+    """"some" avg10 of memory PSI in percent, None without PSI."""
+    try:
+        text = _read_proc(path or PSI_MEMORY)
+    except (IOError, OSError):
+        return None
+    for line in text.splitlines():
+        if line.startswith("some "):
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "avg10":
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+    return None
+
+
+def shed_records():
+    """SHED_FILE: unit -> (action, wall time, some avg10, ok) of the last
+    step taken against it under memory pressure."""
+    try:
+        with open(SHED_FILE, "rb") as f:
+            data = marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _record_shed(name, action, pressure, ok):
+    data = shed_records()
+    data[name] = (action, time.time(), pressure, ok)
+    try:
+        os.makedirs(STATE_DIR, mode=0o755, exist_ok=True)
+        _replace_file(SHED_FILE, marshal.dumps(data))
+    except (IOError, OSError) as e:
+        log_debug("Failed to save %s: %s", SHED_FILE, e)
+
+
+class MemoryShedder:
+    """Memory pressure handling for 'serviced daemon'. The daemon sleeps
+    on a PSI trigger (MEMORY_PRESSURE_TRIGGER): `fd` turns up among the
+    exceptional conditions of its select() when the kernel reports a
+    stall, so nothing is read while memory is fine. Where the kernel
+    refuses the trigger the averages are read every POLL_SEC instead.
+
+    Once "some" avg10 reaches MEMORY_PRESSURE_AVG10, one running unit is
+    shed: the lowest X-ServicedPriority= class first and, within a class,
+    the largest RSS. Only classes up to SERVICED_SHED_PRIORITY (low by
+    default, so units that did not opt in are left alone) are shed.
+    X-ServicedPressureAction= says whether it is stopped (the default),
+    frozen or restarted. The next one follows only if the pressure
+    outlasts MEMORY_PRESSURE_COOLDOWN_SEC. Every step is logged
+    and kept in SHED_FILE for status.
+    """
+
+    POLL_SEC = 5.0
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.fd = None
+        self.mode = None
+        self._next = 0.0
+        self._quiet_until = 0.0
+        up_to = os.environ.get("SERVICED_SHED_PRIORITY") or SHED_PRIORITY_DEFAULT
+        if up_to not in PRIORITY_CLASSES[:-1]:
+            log_warn(
+                "Invalid SERVICED_SHED_PRIORITY=%s, using %s",
+                up_to,
+                SHED_PRIORITY_DEFAULT,
+            )
+            up_to = SHED_PRIORITY_DEFAULT
+        self.max_rank = PRIORITY_CLASSES.index(up_to)
+        try:
+            fd = os.open(PSI_MEMORY, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+        except OSError:
+            fd = None
+        if fd is not None:
+            try:
+                os.write(fd, MEMORY_PRESSURE_TRIGGER.encode("ascii") + b"\0")
+                self.fd = fd
+                self.mode = "psi trigger"
+            except OSError as e:
+                log_debug("PSI trigger refused (%s), polling instead", e)
+                os.close(fd)
+        if self.fd is None and memory_pressure() is not None:
+            self.mode = "psi poll"
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wakeup(self, now):
+        """The trigger fired."""
+        self._check(now)
+
+    def tick(self, now):
+        if self.mode == "psi poll" and now >= self._next:
+            self._next = now + self.POLL_SEC
+            self._check(now)
+
+    def _check(self, now):
+        if now < self._quiet_until:
+            return
+        pressure = memory_pressure()
+        if pressure is None or pressure < MEMORY_PRESSURE_AVG10:
+            return
+        self._quiet_until = now + MEMORY_PRESSURE_COOLDOWN_SEC
+        victim = self._pick()
+        if victim is None:
+            log_warn(
+                "Memory pressure (some avg10 %.2f%%), nothing left to shed", pressure
+            )
+            return
+        name, unit, rss = victim
+        action = unit.pressure_action
+        log_warn(
+            "Memory pressure (some avg10 %.2f%%): %s %s (%s priority, %d MiB)",
+            pressure,
+            {"stop": "stopping", "freeze": "freezing", "restart": "restarting"}[
+                action
+            ],
+            name,
+            unit.priority,
+            rss >> 20,
+        )
+        mgr = self.manager
+        if action == "freeze":
+            ok = mgr.freeze(name, reason="memory-pressure")
+        elif action == "restart":
+            ok = mgr.restart(name)
+        else:
+            ok = mgr.stop(name)
+            if ok:
+                mgr._write_status(name, "inactive", msg="Stopped under memory pressure")
+        log_job(ok, "Shed", "Failed to shed", name)
+        _record_shed(name, action, pressure, ok)
+
+    def _pick(self):
+        """(name, unit, RSS bytes) of the unit to shed next, or None."""
+        mgr = self.manager
+        try:
+            files = os.listdir(PID_DIR)
+        except OSError:
+            return None
+        proc = ProcSnapshot()
+        by_sid, by_pid = process_usage()
+        page = os.sysconf("SC_PAGE_SIZE")
+        best = None
+        for fname in files:
+            if not fname.endswith(".pid"):
+                continue
+            name = fname[:-4]
+            unit = mgr.get_unit(name)
+            pid = mgr._read_pid(name)
+            if unit is None or is_critical_service(name) or not proc.alive(pid):
+                continue
+            rank = PRIORITY_CLASSES.index(unit.priority)
+            if rank > self.max_rank or mgr.frozen_record(name, pid):
+                continue
+            if StateLock(name).busy():
+                continue
+            try:
+                usage = by_sid[pid] if os.getsid(pid) == pid else by_pid[pid]
+            except (OSError, KeyError):
+                continue
+            key = (rank, -usage[1])
+            if best is None or key < best[0]:
+                best = (key, name, unit, usage[1] * page)
+        return best and best[1:]
+
+
+class Daemon:
+    """The resident end of CONTROL_SOCKET. serve() runs the event loop in
+    the main thread; every connection gets a thread of its own so status
+    queries are not held up by a running start job.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CONTROL_SOCKET
+        self.client = Client(capture_logs=False)
+        self.requests = 0
+        self._started = time.monotonic()
+        self._lock = _thread.allocate_lock()
+        self._gen = 0
+        self._cache = {}
+        self._bus = (0.0, None)
+        self._metrics = None
+        self._units_stale = False
+        self._stopping = False
+        self._watch_mode = None
+        # (name, pid, failed, exit code, message) reaped during a job
+        self._exits = []
+        self.idle = IdleFreezer(self.client.manager)
+        self.memory = None
+
+    def _on_log(self, level, text):
+        self.client._on_log(level, text)
+        if level == "DEBUG" and not VERBOSE:
+            return
+        if level in ("INFO", "PROGRESS"):
+            stream = sys.stdout
+        else:
+            stream = sys.stderr
+        if level == "PROGRESS":
+            stream.write(text + "\n")
+        else:
+            stream.write("[%s] %s\n" % (level, text))
+        stream.flush()
+
+    def invalidate(self, units=False):
+        """Drop cached status; with units, re-read unit files too (once no
+        job is running)."""
+        with self._lock:
+            self._gen += 1
+            self._metrics = None
+            if units:
+                self._units_stale = True
+
+    def _refresh_units(self):
+        if self._units_stale and not self.client._job_lock.locked():
+            self._units_stale = False
+            self.client.refresh()
+
+    def _bus_names(self, now):
+        expires, names = self._bus
+        if names is None or expires <= now:
+            names = frozenset(list_dbus_names(timeout=2.0) or ())
+            self._bus = (now + DAEMON_STATUS_TTL, names)
+        return names
+
+    def statuses(self, names=None):
+        """Client.statuses from memory where the cached record is current."""
+        if names is None:
+            names = self.client.unit_names()
+        names = [self.client.manager.resolve_name(n) for n in names]
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            gen = self._gen
+            for name in names:
+                hit = self._cache.get(name)
+                if hit is not None and hit[0] == gen and hit[1] > now:
+                    found[name] = hit[2]
+        missing = [n for n in dict.fromkeys(names) if n not in found]
+        if missing:
+            fresh = self.client.statuses(
+                missing, proc=ProcSnapshot(), bus_names=self._bus_names(now)
+            )
+            found.update(zip(missing, fresh))
+            with self._lock:
+                if self._gen == gen:
+                    expires = now + DAEMON_STATUS_TTL
+                    for name, st in zip(missing, fresh):
+                        self._cache[name] = (gen, expires, st)
+        return [found[n] for n in names]
+
+    # ---- Requests ----
+
+    def metrics(self):
+        """collect_metrics(), reused for DAEMON_STATUS_TTL."""
+        now = time.monotonic()
+        cached = self._metrics
+        if cached is None or cached[0] <= now:
+            cached = self._metrics = (
+                now + DAEMON_STATUS_TTL,
+                self.client.metrics(),
+            )
+        return cached[1]
+
+    def _call(self, call, args):
+        self._refresh_units()
+        client = self.client
+        if call == "ping":
+            return {
+                "pid": os.getpid(),
+                "version": VERSION,
+                "uptime": round(time.monotonic() - self._started, 3),
+                "requests": self.requests,
+                "watch": self._watch_mode,
+                "memory": self.memory and self.memory.mode,
+            }
+        if call == "resolve":
+            return list(client.resolve(args["patterns"]))
+        if call == "unit_names":
+            return client.unit_names()
+        if call == "metrics":
+            return self.metrics()
+        if call == "statuses":
+            return [st.to_dict() for st in self.statuses(args.get("names"))]
+        if call == "units":
+            running_only = bool(args.get("running_only"))
+            return [u.to_dict() for u in client.units(running_only)]
+        with client._msg_lock:
+            seq = client._seq
+        try:
+            if call == "run":
+                op = args["op"]
+                done_verb, fail_verb, _ = _LIFECYCLE_VERBS[op]
+                results = client.run(
+                    op,
+                    args["units"],
+                    jobs=args.get("jobs", 4),
+                    on_done=lambda n, ok: log_job(ok, done_verb, fail_verb, n),
+                )
+            elif call == "shutdown":
+                results = client.shutdown(
+                    timeout=args.get("timeout", 5.0),
+                    jobs=args.get("jobs", 4),
+                    on_done=lambda n, ok: log_job(ok, "Stopped", "Failed to stop", n),
+                )
+            elif call == "boot":
+                TIMINGS.spans = []
+                TIMINGS.root = -1
+                TIMINGS._origin = None
+                TIMINGS.enabled = True
+                try:
+                    results = client.boot()
+                finally:
+                    TIMINGS.enabled = False
+            else:
+                raise ServicedError("unknown call: %s" % call)
+        finally:
+            self.invalidate()
+        return {
+            "results": [r.to_dict() for r in results],
+            "messages": client._messages_since(seq),
+        }
+
+    def _handle(self, conn):
+        try:
+            conn.settimeout(5.0)
+            data = b""
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+                if len(data) > 1 << 20:
+                    raise ValueError("request too large")
+                if data[:4] == b"GET ":
+                    if b"\r\n\r\n" in data or b"\n\n" in data:
+                        break
+                elif data[:1] != b"M" and data.endswith(b"\n"):
+                    break
+            if not data:
+                return
+            if data[:4] == b"GET ":
+                self._http(conn, data)
+                return
+            binary = data[:1] == b"M"
+            if binary:
+                req = marshal.loads(data[1:])
+            else:
+                req = json.loads(data.decode("utf-8"))
+            call = req.get("call")
+            self.requests += 1
+            conn.settimeout(None)
+            try:
+                resp = {"result": self._call(call, req.get("args") or {})}
+            except UnitNotFoundError as e:
+                resp = {"error": {"type": "UnitNotFoundError", "unit": e.unit}}
+            except ServicedError as e:
+                resp = {"error": {"type": "ServicedError", "message": str(e)}}
+            except Exception as e:
+                log_error("daemon: %s failed: %s: %s", call, type(e).__name__, e)
+                resp = {
+                    "error": {
+                        "type": "ServicedError",
+                        "message": "%s: %s" % (type(e).__name__, e),
+                    }
+                }
+            if binary:
+                conn.sendall(marshal.dumps(resp))
+            else:
+                conn.sendall(json.dumps(resp).encode("utf-8") + b"\n")
+        except (OSError, ValueError, EOFError, TypeError, AttributeError) as e:
+            log_debug("daemon: dropped request: %s", e)
+        finally:
+            conn.close()
+
+    # ---- Events ----
+
+    def _http(self, conn, data):
+        """Answer GET /metrics, so the control socket doubles as a scrape
+        endpoint: curl --unix-socket CONTROL_SOCKET http://localhost/metrics
+        """
+        path = data.split(None, 2)[1] if len(data.split(None, 2)) > 1 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            body = self.metrics().encode("utf-8")
+            head = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"not found\n"
+            head = "404 Not Found", "text/plain"
+        conn.sendall(
+            (
+                "HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                "Connection: close\r\n\r\n" % (head[0], head[1], len(body))
+            ).encode("ascii")
+            + body
+        )
+
+    def _reap(self):
+        """Collect units this daemon started that have exited and record
+        how they ended, so status does not wait for the TTL to notice.
+        Exits reaped while a job runs are kept until it is over.
+        """
+        mgr = self.client.manager
+        try:
+            files = os.listdir(PID_DIR)
+        except OSError:
+            files = []
+        named = set()
+        for fname in files:
+            if not fname.endswith(".pid"):
+                continue
+            name = fname[:-4]
+            pid = mgr._read_pid(name)
+            if pid <= 0:
+                continue
+            named.add(pid)
+            proc = mgr.children.get(pid)
+            if proc is not None:
+                rc = proc.poll()
+                if rc is None:
+                    continue
+                del mgr.children[pid]
+            else:
+                try:
+                    got, status = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    continue
+                if got != pid:
+                    continue
+                if os.WIFSIGNALED(status):
+                    rc = -os.WTERMSIG(status)
+                else:
+                    rc = os.WEXITSTATUS(status)
+            if rc < 0:
+                msg = "Killed by signal %d" % -rc
+                code = 128 - rc
+            else:
+                msg = "Exited with status %d" % rc
+                code = rc
+            self._exits.append((name, pid, code != 0, code, msg))
+        # Children no PID file names any more (stopped by a job)
+        for pid, proc in list(mgr.children.items()):
+            if pid not in named and proc.poll() is not None:
+                del mgr.children[pid]
+        if not self._exits or self.client._job_lock.locked():
             return
+        for name, pid, failed, code, msg in self._exits:
+            log_info("%s (pid %d): %s", name, pid, msg)
+            # Unless a job (a stop, most likely) has recorded the outcome
+            if mgr._read_pid(name) == pid:
+                mgr._remove_pid(name)
+                mgr._write_status(
+                    name, "failed" if failed else "inactive", msg=msg, exit_code=code
+                )
+        del self._exits[:]
+        self.invalidate()
+        mgr._metrics_changed()
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.invalidate(units=True)
+        elif signum != signal.SIGCHLD:
+            self._stopping = True
+
+    def serve(self):
+        """Run until SIGTERM or SIGINT; SIGHUP re-reads unit files. False
+        when another daemon answers on the socket or it cannot be bound.
+        """
+        if _daemon_running(self.path):
+            log_error("serviced daemon is already running on %s", self.path)
+            return False
+        ensure_dirs()
+        try:
+            os.makedirs(ENABLED_DIR, exist_ok=True)
+        except OSError:
+            pass
+        set_log_handler(self._on_log)
+        listener = socketmod.socket(socketmod.AF_UNIX, socketmod.SOCK_STREAM)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        umask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+            listener.listen(64)
+        except OSError as e:
+            log_error("Cannot listen on %s: %s", self.path, e)
+            listener.close()
+            set_log_handler(None)
+            return False
+        finally:
+            os.umask(umask)
+
+        mgr = self.client.manager
+        mgr.discover_services()
+        unit_dirs = set(mgr._unit_paths)
+        # drop-in directories present now; new ones show up as a change of
+        # their unit directory
+        for dname, parents in mgr._dropin_index.items():
+            unit_dirs.update(os.path.join(d, dname) for d in parents)
+        watcher = DirWatcher(
+            [PID_DIR, STATUS_DIR, FROZEN_DIR, ENABLED_DIR] + sorted(unit_dirs)
+        )
+        self._watch_mode = watcher.mode
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        for signum in (signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        fds = [listener, wake_r]
+        if watcher.fd is not None:
+            fds.append(watcher.fd)
+        self.memory = MemoryShedder(mgr)
+        pressure_fds = [self.memory.fd] if self.memory.fd is not None else []
+        log_info(
+            "serviced daemon listening on %s (pid %d, %s, %s)",
+            self.path,
+            os.getpid(),
+            watcher.mode,
+            self.memory.mode or "no psi",
+        )
+        try:
+            while not self._stopping:
+                timeout = IDLE_THAW_POLL_SEC if self.idle.frozen else 1.0
+                ready, _, pressure = select.select(fds, [], pressure_fds, timeout)
+                if listener in ready:
+                    try:
+                        conn = listener.accept()[0]
+                    except OSError:
+                        conn = None
+                    if conn is not None:
+                        threading.Thread(
+                            target=self._handle, args=(conn,), daemon=True
+                        ).start()
+                changed = watcher.poll()
+                if watcher.fd is not None and watcher.fd in ready:
+                    changed |= watcher.read()
+                if changed:
+                    self.invalidate(units=bool(changed & unit_dirs))
+                if wake_r in ready:
+                    try:
+                        while os.read(wake_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                self._reap()
+                now = time.monotonic()
+                if pressure:
+                    self.memory.wakeup(now)
+                self.memory.tick(now)
+                self.idle.tick(now, busy=self.client._job_lock.locked())
+        finally:
+            signal.set_wakeup_fd(-1)
+            listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            watcher.close()
+            self.memory.close()
+            os.close(wake_r)
+            os.close(wake_w)
+            log_info("serviced daemon stopped")
+            set_log_handler(None)
+        return True
+
+
+def _daemon_running(path=None):
+    remote = RemoteClient.connect(path)
+    if remote is None:
+        return False
+    remote.close()
+    return True
+
+
+class RemoteClient:
+    """Stand-in for Client that forwards to a running 'serviced daemon'.
+    It covers what the command line forwards; jobs replay the daemon's
+    log lines through the local log functions and ignore on_done.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CONTROL_SOCKET
+        self._sock = None
+
+    @classmethod
+    def connect(cls, path=None):
+        """A RemoteClient if a daemon accepts on `path`, else None. The
+        connection made to find out carries the first call.
+        """
+        client = cls(path)
+        if not os.path.exists(client.path):
+            return None
+        try:
+            client._sock = client._open()
+        except OSError:
+            return None
+        return client
+
+    def _open(self):
+        sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        try:
+            sock.settimeout(1.0)
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _call(self, call, timeout=None, **args):
+        sock, self._sock = self._sock, None
+        if sock is None:
+            sock = self._open()
+        try:
+            sock.settimeout(timeout)
+            sock.sendall(b"M" + marshal.dumps({"call": call, "args": args}))
+            sock.shutdown(_socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            sock.close()
+        try:
+            resp = marshal.loads(b"".join(chunks))
+        except (EOFError, ValueError, TypeError):
+            raise ServicedError("No answer from serviced daemon on %s" % self.path)
+        err = resp.get("error")
+        if err:
+            if err.get("type") == "UnitNotFoundError":
+                raise UnitNotFoundError(err.get("unit"))
+            raise ServicedError(err.get("message"))
+        return resp["result"]
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def ping(self):
+        """{"pid", "version", "uptime", "requests", "watch", "memory"} of the
+        daemon."""
+        return self._call("ping", timeout=5.0)
+
+    def resolve(self, patterns):
+        return tuple(self._call("resolve", timeout=30.0, patterns=list(patterns)))
+
+    def unit_names(self):
+        return self._call("unit_names", timeout=30.0)
+
+    def metrics(self):
+        return self._call("metrics", timeout=30.0)
+
+    @staticmethod
+    def boot_status():
+        return Client.boot_status()
+
+    def statuses(self, names=None):
+        return [
+            UnitStatus(**rec)
+            for rec in self._call("statuses", timeout=30.0, names=names)
+        ]
+
+    def units(self, running_only=False):
+        recs = self._call("units", timeout=30.0, running_only=running_only)
+        return [UnitInfo(**rec) for rec in recs]
+
+    def _job(self, op, call, check, args):
+        out = self._call(call, **args)
+        for level, text in out["messages"]:
+            if level == "DEBUG" and not VERBOSE:
+                continue
+            stream = sys.stdout if level in ("INFO", "PROGRESS") else sys.stderr
+            _log(stream, level, text, ())
+        results = [JobResult(**rec) for rec in out["results"]]
+        if check and not all(r.ok for r in results):
+            raise JobFailedError(op, results)
+        return results
+
+    def run(self, op, units, jobs=4, check=False, on_done=None):
+        args = {"op": op, "units": list(units), "jobs": jobs}
+        return self._job(op, "run", check, args)
+
+    def shutdown(self, timeout=5.0, jobs=4, check=False, on_done=None):
+        args = {"timeout": timeout, "jobs": jobs}
+        return self._job("stop", "shutdown", check, args)
+
+    def boot(self, check=False):
+        return self._job("start", "boot", check, {})
+
+
+# ---- Events ----
+#
+# UnitEvents turns changes under the state directory into one record per
+# unit state transition. Every job writes the unit's lock file when it
+# begins and ends and the status, PID and freeze files in between, so
+# inotify on those directories sees every step of every serviced process
+# (the daemon's reaper included) without asking any of them.
+
+# State of a unit while a job of this kind holds its lock
+_JOB_STATES = {
+    "start": "starting",
+    "stop": "stopping",
+    "reload": "reloading",
+    "freeze": "freezing",
+    "thaw": "thawing",
+}
+
+_EVENT_SUFFIXES = (".json", ".pid", ".frozen", ".lock")
+
+
+class UnitEvents:
+    """Unit state transitions as records {"time", "unit", "state",
+    "previous", "pid", "exit_code", "message"}. state is starting,
+    stopping, reloading, freezing or thawing while a job runs, then
+    active, frozen, exited (the main process is gone, see exit_code),
+    failed or inactive.
+
+    inotify on the status, PID, freeze and lock directories (DirWatcher's
+    mtime poll where it is missing) says which units to look at again.
+    Units believed to be up also get a PID check every second, since a
+    process can die without any file changing. `match`, if given, is
+    called with each unit name and picks the units to report.
+    """
+
+    def __init__(self, manager, match=None):
+        self.manager = manager
+        self.match = match
+        self.states = {}
+        ensure_dirs()
+        self.watcher = DirWatcher([STATUS_DIR, PID_DIR, FROZEN_DIR, LOCK_DIR])
+        self._next_check = 0.0
+
+    def close(self):
+        self.watcher.close()
+
+    @staticmethod
+    def _unit_of(fname):
+        for suffix in _EVENT_SUFFIXES:
+            if fname.endswith(suffix):
+                name = fname[: -len(suffix)]
+                return name if name.endswith(".service") else None
+        return None
+
+    def _names_in(self, directory):
+        try:
+            return set(filter(None, map(self._unit_of, os.listdir(directory))))
+        except OSError:
+            return set()
+
+    def state(self, name):
+        """(state, main PID, exit code, message) of `name` right now."""
+        mgr = self.manager
+        pid = mgr._read_pid(name)
+        job = StateLock(name).current()
+        if job is not None:
+            return _JOB_STATES.get(job["op"], job["op"]), pid or None, None, ""
+        if pid and pid_exists(pid):
+            if mgr.frozen_record(name, pid):
+                return "frozen", pid, None, ""
+            return "active", pid, None, ""
+        st = mgr._read_status(name) or {}
+        state = st.get("state") or "inactive"
+        if state == "active":
+            state = "exited"
+        return state, None, st.get("exit_code"), st.get("message", "")
+
+    def _update(self, names):
+        out = []
+        for name in sorted(names):
+            if self.match is not None and not self.match(name):
+                continue
+            new = self.state(name)
+            old = self.states.get(name)
+            self.states[name] = new
+            if old is not None and new[0] == old[0]:
+                continue
+            out.append(
+                {
+                    "time": round(time.time(), 3),
+                    "unit": name,
+                    "state": new[0],
+                    "previous": old[0] if old else None,
+                    "pid": new[1],
+                    "exit_code": new[2],
+                    "message": new[3],
+                }
+            )
+        return out
+
+    def initial(self, names=()):
+        """A record per unit with any state (and per name in `names`),
+        with previous None: the starting point for poll()."""
+        found = set(names)
+        for d in self.watcher.dirs:
+            found |= self._names_in(d)
+        return self._update(found)
+
+    def poll(self, timeout=1.0):
+        """Transitions since the last call, waiting up to `timeout` for
+        the first one."""
+        if self.watcher.fd is not None:
+            select.select([self.watcher.fd], [], [], timeout)
+        else:
+            time.sleep(timeout)
+        names = set()
+        if self.watcher.fd is not None:
+            for directory, fname in self.watcher.events():
+                if fname is None:
+                    names |= self._names_in(directory)
+                else:
+                    names.add(self._unit_of(fname))
+        if self.watcher.poll():
+            names |= set(self.states)
+            for d in self.watcher.dirs:
+                names |= self._names_in(d)
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + 1.0
+            names.update(
+                n
+                for n, st in self.states.items()
+                if st[0] not in ("exited", "failed", "inactive")
+            )
+        names.discard(None)
+        return self._update(names)
+
+    def follow(self, names=()):
+        """initial(), then poll() for ever."""
+        for rec in self.initial(names):
+            yield rec
+        while True:
+            for rec in self.poll():
+                yield rec
+
+
+# ---- Rendering ----
+
+
+def render_status(rec):
+    """Text form of a status record (dict), like systemctl status."""
+    name = rec["unit"]
+    if rec["load_state"] == "not-found":
+        print("%s - not found" % name)
+        return
+    print("● %s - %s" % (name, rec["description"]))
+    print("   Loaded: loaded (%s)" % (rec["path"] or "unknown"))
+    urls = rec["documentation"]
+    if urls:
+        print("     Docs: %s" % urls[0])
+        for url in urls[1:]:
+            print("           %s" % url)
+    if rec["bus_name"]:
         print(
-            "%-40s %-10s %-12s %-8s %s"
-            % ("SERVICE", "TYPE", "STATE", "PID", "DESCRIPTION")
+            "  BusName: %s (%s)"
+            % (
+                rec["bus_name"],
+                "acquired" if rec["bus_name_acquired"] else "not on bus",
+            )
         )
-        print("-" * 110)
-        for nm, st, state, ps, desc, flags in rows:
-            em = "*" if self.is_enabled(nm) else " "
+    for sock in rec["sockets"]:
+        print(
+            "   Socket: %s (%s)"
+            % (sock["path"], "\033[32malive\033[0m" if sock["alive"] else "dead")
+        )
+    if rec.get("priority") not in (None, "normal"):
+        print(" Priority: %s" % rec["priority"])
+    state = rec["state"]
+    if rec["sub_state"] in ("running", "frozen"):
+        if rec["sub_state"] == "frozen":
+            print("   Active: \033[36mactive (frozen)\033[0m")
+        else:
+            print("   Active: \033[32mactive (running)\033[0m")
+        print("      PID: %d" % rec["pid"])
+        if rec["message"]:
+            print("   Status: %s" % rec["message"])
+        if rec["since"]:
+            started = datetime.datetime.fromisoformat(rec["since"])
+            uptime = datetime.datetime.now() - started
             print(
-                "%s %-40s %-10s %-12s %-8s %s%s" % (em, nm, st, state, ps, desc, flags)
+                "    Since: %s (%s ago)"
+                % (started.strftime("%Y-%m-%d %H:%M:%S"), str(uptime).split(".")[0])
+            )
+    elif rec["since"] is None and state == "inactive" and not rec["message"]:
+        print("   Active: inactive (dead)")
+    else:
+        if state == "active":
+            print("   Active: \033[32m%s\033[0m" % state)
+        elif state == "failed":
+            print("   Active: \033[31m%s\033[0m" % state)
+        else:
+            print("   Active: %s" % state)
+        if rec["message"]:
+            print("   Status: %s" % rec["message"])
+        if rec["since"]:
+            print("    Since: %s" % rec["since"])
+    shed = rec.get("shed")
+    if shed:
+        print(
+            "     Shed: %s%s under memory pressure (some avg10 %.2f%%) at %s"
+            % (
+                {"stop": "stopped", "freeze": "frozen", "restart": "restarted"}.get(
+                    shed["action"], shed["action"]
+                ),
+                "" if shed["ok"] else " (failed)",
+                shed["pressure"],
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(shed["time"])),
             )
-        print("\nTotal: %d services (* = enabled)" % len(rows))
+        )
 
 
-def main():
-    global VERBOSE
+def render_unit_table(rows, running_only=False):
+    """The 'serviced list' table for list records (dicts)."""
+    colors = {
+        "running": "\033[32mrunning\033[0m",
+        "frozen": "\033[36mfrozen\033[0m",
+        "failed": "\033[31mfailed\033[0m",
+    }
+    if not rows:
+        print("No services found." if not running_only else "No running services.")
+        return
+    print(
+        "%-40s %-10s %-12s %-8s %s"
+        % ("SERVICE", "TYPE", "STATE", "PID", "DESCRIPTION")
+    )
+    print("-" * 110)
+    for r in rows:
+        flags = ""
+        if r["critical"]:
+            flags = " [CRITICAL]"
+        elif r["unsupported"]:
+            flags = " [UNSUPPORTED:%s]" % r["type"]
+        print(
+            "%s %-40s %-10s %-12s %-8s %s%s"
+            % (
+                "*" if r["enabled"] else " ",
+                r["unit"],
+                r["type"],
+                colors.get(r["state"], r["state"]),
+                r["pid"] or "-",
+                r["description"][:50],
+                flags,
+            )
+        )
+    print("\nTotal: %d services (* = enabled)" % len(rows))
+
+
+def render_boot_status(rec):
+    """Text form of a BootProgress summary."""
+    units = rec["units"]
+    counts = {}
+    for state, _, _ in units.values():
+        counts[state] = counts.get(state, 0) + 1
+    now = time.time()
+    started = rec["started"]
+    print(
+        "Boot %s (PID %d), started %s, %.1fs%s"
+        % (
+            rec["state"],
+            rec["pid"],
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+            (rec["finished"] or now) - started,
+            "" if rec["finished"] else " so far",
+        )
+    )
+    print(
+        "%d done, %d failed, %d starting, %d pending"
+        % tuple(counts.get(s, 0) for s in ("done", "failed", "starting", "pending"))
+    )
+    print()
+    print("%-40s %-10s %s" % ("UNIT", "STATE", "TIME"))
+    colors = {"done": "\033[32m", "failed": "\033[31m", "starting": "\033[33m"}
+    for name in rec["order"]:
+        state, t0, t1 = units[name]
+        if t0 and t1:
+            took = "%.2fs" % (t1 - t0)
+        elif t0:
+            took = "%.1fs so far" % (now - t0)
+        else:
+            took = "-"
+        label = "%-10s" % state
+        if state in colors:
+            label = colors[state] + label + "\033[0m"
+        print("%-40s %s %s" % (name, label, took))
+
+
+_EVENT_COLORS = {
+    "active": "\033[32m",
+    "frozen": "\033[36m",
+    "failed": "\033[31m",
+    "exited": "",
+    "inactive": "",
+}
 
-    if len(sys.argv) >= 2 and sys.argv[1] in ("-h", "--help"):
-        sys.stdout.write(HELP_TEXT)
-        sys.exit(0)
-    if len(sys.argv) >= 2 and sys.argv[1] == "--version":
-        print("serviced v%s - lightweight service manager" % VERSION)
-        sys.exit(0)
 
+def _event_row(rec, color):
+    """One 'serviced watch' line for a UnitEvents record."""
+    if rec["pid"]:
+        info = "PID %d" % rec["pid"]
+    elif rec["exit_code"] is not None:
+        info = "code %d" % rec["exit_code"]
+    else:
+        info = "-"
+    if rec["message"] and rec["state"] in ("failed", "exited"):
+        info += "  " + rec["message"]
+    label = "%-10s" % rec["state"]
+    if color:
+        # job states (starting, stopping, ...) in yellow
+        prefix = _EVENT_COLORS.get(rec["state"], "\033[33m")
+        if prefix:
+            label = prefix + label + "\033[0m"
+    return "%-40s %s %s  %s" % (
+        rec["unit"],
+        label,
+        time.strftime("%H:%M:%S", time.localtime(rec["time"])),
+        info[:60],
+    )
+
+
+def render_watch(events, names=()):
+    """'serviced watch': a table of unit states kept current from
+    UnitEvents. On a terminal only the row of a unit that changed is
+    rewritten in place (cursor up, erase line, back down) and new units
+    are added at the bottom; elsewhere each change is a new line. Runs
+    until interrupted."""
+    out = sys.stdout
+    tty = out.isatty()
+    rows = {}
+    if tty:
+        out.write("\033[?25l\033[H\033[2J")
+    out.write("%-40s %-10s %-8s  %s\n" % ("UNIT", "STATE", "SINCE", "INFO"))
+    try:
+        batch = events.initial(names)
+        while True:
+            try:
+                height = os.get_terminal_size(out.fileno()).lines
+            except OSError:
+                height = 0
+            for rec in batch:
+                row = _event_row(rec, tty)
+                up = len(rows) - rows.get(rec["unit"], len(rows))
+                if not tty or rec["unit"] not in rows:
+                    rows[rec["unit"]] = len(rows)
+                    out.write(row + "\n")
+                elif up < height or not height:
+                    # rows scrolled off the top stay as they are
+                    out.write("\033[%dA\r\033[2K%s\r\033[%dB" % (up, row, up))
+            out.flush()
+            batch = events.poll()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if tty:
+            out.write("\033[?25h")
+        out.flush()
+
+
+def render_cat(rec):
+    """Unit file contents with a path header per file, or the merged
+    settings when the record has them."""
+    if "settings" in rec:
+        render_effective(rec)
+        return
+    for i, entry in enumerate(rec["files"]):
+        if i:
+            print()
+        content = entry["content"]
+        print("# %s" % entry["path"])
+        print(content, end="" if content.endswith("\n") else "\n")
+
+
+def render_effective(rec):
+    """Merged unit as one file, each run of keys headed by its source."""
+    print("# Effective configuration of %s, merged from:" % rec["unit"])
+    for entry in rec["files"]:
+        print("#   %s" % entry["path"])
+    section = source = None
+    for item in rec["settings"]:
+        if item["section"] != section:
+            section, source = item["section"], None
+            print("\n[%s]" % section)
+        if item["file"] != source:
+            source = item["file"]
+            print("# %s" % source)
+        for value in item["values"] or [""]:
+            print("%s=%s" % (item["key"], value))
+
+
+def _usage_error(message):
+    sys.stderr.write("serviced: %s\n\n" % message)
+    sys.stdout.write(HELP_TEXT)
+    sys.exit(2)
+
+
+OUTPUT_MODES = ("text", "json", "ndjson")
+
+_FAST_COMMANDS = {
+    "start": 0,
+    "stop": 1,
+    "restart": 1,
+    "reload": 1,
+    "enable": 1,
+    "disable": 1,
+    "status": 0,
+    "list": -1,
+    "list-running": -1,
+    "metrics": -1,
+    "boot-status": -1,
+    "events": 0,
+    "watch": 0,
+}
+
+# Commands that go to a running 'serviced daemon' when there is one
+_REMOTE_COMMANDS = frozenset(
+    (
+        "start",
+        "stop",
+        "restart",
+        "reload",
+        "status",
+        "list",
+        "list-running",
+        "metrics",
+    )
+)
+
+_FAST_FLAGS = {
+    "-v": "verbose",
+    "--verbose": "verbose",
+    "--dry-run": "dry_run",
+    "--user": "user",
+    "--timings": "timings",
+}
+
+
+class _Args:
+    """Namespace produced by the fast parser, with argparse's defaults."""
+
+    def __init__(self):
+        self.help = False
+        self.dry_run = False
+        self.verbose = False
+        self.user = False
+        self.timings = False
+        self.jobs = 4
+        self.timeout = 5.0
+        self.output = "text"
+        self.command = None
+        self.service = []
+        self.all = False
+        self.background = False
+        self.boot = False
+
+
+def _fast_args(argv):
+    """Parse the common invocations (start/stop/restart/reload/enable/
+    disable/status/list) by hand so they never build the argparse tree.
+    Returns None for anything else, including every error case, so the
+    full parser can produce its usual message.
+    """
+    args = _Args()
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        value = None
+        if a in _FAST_FLAGS:
+            setattr(args, _FAST_FLAGS[a], True)
+        elif a == "--all" and args.command in ("status", "stop"):
+            args.all = True
+        elif a == "--background" and args.command == "start":
+            args.background = True
+        elif a == "--boot" and args.command == "status":
+            args.boot = True
+        elif a in ("-o", "--output", "-j", "--jobs"):
+            if i + 1 >= len(argv):
+                return None
+            i += 1
+            value = argv[i]
+        elif a.startswith("--output=") or a.startswith("--jobs="):
+            a, _, value = a.partition("=")
+        elif a.startswith("-"):
+            return None
+        elif args.command is None:
+            if a not in _FAST_COMMANDS:
+                return None
+            args.command = a
+        else:
+            args.service.append(a)
+        if value is not None:
+            if a in ("-o", "--output"):
+                if value not in OUTPUT_MODES:
+                    return None
+                args.output = value
+            else:
+                try:
+                    args.jobs = int(value)
+                except ValueError:
+                    return None
+        i += 1
+    need = _FAST_COMMANDS.get(args.command)
+    if need is None:
+        return None
+    if need > 0 and not args.service and not args.all:
+        return None
+    if (args.background or args.boot) and args.service:
+        return None
+    if need < 0 and args.service:
+        return None
+    return args
+
+
+def _parse_args(argv):
     parser = argparse.ArgumentParser(
         prog="serviced",
         add_help=False,
     )
 
-    def _parser_error(message):
-        sys.stderr.write("serviced: %s\n\n" % message)
-        sys.stdout.write(HELP_TEXT)
-        sys.exit(2)
-
-    parser.error = _parser_error
+    parser.error = _usage_error
 
     parser.add_argument("-h", "--help", action="store_true", default=False)
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--timings", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+    parser.add_argument("-o", "--output", default="text", choices=OUTPUT_MODES)
     parser.add_argument(
         "--user",
         action="store_true",
@@ -2031,33 +7165,35 @@ def main():
     sub = parser.add_subparsers(dest="command")
 
     p = sub.add_parser("start")
-    p.add_argument("service", nargs="?")
+    p.add_argument("service", nargs="*")
+    p.add_argument("--background", action="store_true")
 
     p = sub.add_parser("stop")
-    p.add_argument("service")
+    p.add_argument("service", nargs="*")
+    p.add_argument("--all", action="store_true")
+    p.add_argument("--timeout", type=float, default=5.0)
 
-    p = sub.add_parser("restart")
-    p.add_argument("service")
+    for cmd in ("restart", "reload", "enable", "disable"):
+        p = sub.add_parser(cmd)
+        p.add_argument("service", nargs="+")
 
-    p = sub.add_parser("reload")
-    p.add_argument("service")
+    for cmd in ("freeze", "thaw"):
+        p = sub.add_parser(cmd)
+        p.add_argument("service", nargs="+")
 
     p = sub.add_parser("kill")
-    p.add_argument("service")
+    p.add_argument("service", nargs="+")
     p.add_argument("-s", "--signal", default="SIGTERM")
     p.add_argument("--kill-who", default="all", choices=["main", "all"])
 
-    p = sub.add_parser("enable")
-    p.add_argument("service")
-
-    p = sub.add_parser("disable")
-    p.add_argument("service")
-
     p = sub.add_parser("status")
-    p.add_argument("service")
+    p.add_argument("service", nargs="*")
+    p.add_argument("--all", action="store_true")
+    p.add_argument("--boot", action="store_true")
 
     p = sub.add_parser("cat")
-    p.add_argument("service")
+    p.add_argument("service", nargs="+")
+    p.add_argument("--effective", action="store_true")
 
     p = sub.add_parser("help")
     p.add_argument("service")
@@ -2068,90 +7204,424 @@ def main():
 
     sub.add_parser("list")
     sub.add_parser("list-running")
+    sub.add_parser("boot-status")
+
+    for cmd in ("events", "watch"):
+        p = sub.add_parser(cmd)
+        p.add_argument("service", nargs="*")
+
+    # -o/--output is also accepted after the subcommand
+    for cmd in ("status", "cat", "log", "list", "list-running", "boot-status"):
+        sub.choices[cmd].add_argument(
+            "-o", "--output", choices=OUTPUT_MODES, default=argparse.SUPPRESS
+        )
+
+    p = sub.add_parser("blame")
+    p.add_argument("-n", "--lines", type=int, default=20)
+
+    p = sub.add_parser("analyze")
+    p.add_argument("service", nargs="?")
+    p.add_argument("--trace")
+    p.add_argument("--svg")
     sub.add_parser("version")
 
-    args = parser.parse_args()
+    p = sub.add_parser("daemon")
+    p.add_argument("--detach", action="store_true")
+    p = sub.add_parser("metrics")
+    p.add_argument("--textfile", metavar="FILE")
+
+    return parser.parse_args(argv)
+
+
+def main():
+    global VERBOSE
+
+    argv = sys.argv[1:]
+    if argv and argv[0] in ("-h", "--help"):
+        sys.stdout.write(HELP_TEXT)
+        sys.exit(0)
+    if argv and argv[0] == "--version":
+        print("serviced v%s - lightweight service manager" % VERSION)
+        sys.exit(0)
+
+    args = _fast_args(argv) or _parse_args(argv)
 
     if getattr(args, "help", False) or args.command is None:
         sys.stdout.write(HELP_TEXT)
         sys.exit(0)
 
     VERBOSE = args.verbose
-    mgr = ServiceManager(dry_run=args.dry_run, user_mode=args.user)
+    if args.command == "daemon":
+        _daemon(args)
+        return
+    client = None
+    if (
+        args.command in _REMOTE_COMMANDS
+        and not (args.dry_run or args.user or args.timings)
+        and not getattr(args, "background", False)
+        and not os.environ.get("SERVICED_NO_DAEMON")
+    ):
+        client = RemoteClient.connect()
+    if client is None:
+        TIMINGS.enabled = args.timings or (
+            args.command == "start" and not args.service
+        )
+        client = Client(dry_run=args.dry_run, user_mode=args.user, capture_logs=False)
     ensure_dirs()
+    try:
+        _dispatch(client, args)
+    except ServicedError as e:
+        log_error("%s", e)
+        sys.exit(1)
+    finally:
+        if args.timings:
+            print()
+            print_timings(TIMINGS.records())
+
+
+_LIFECYCLE_VERBS = {
+    "start": ("Started", "Failed to start", "started"),
+    "stop": ("Stopped", "Failed to stop", "stopped"),
+    "restart": ("Restarted", "Failed to restart", "restarted"),
+    "reload": ("Reloaded", "Failed to reload", "reloaded"),
+}
 
-    if args.command == "start":
-        if args.service:
-            ok = mgr.start(args.service)
-            if not VERBOSE:
-                m = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-                a = "Started" if ok else "Failed to start"
-                print("%s %s %s." % (m, a, args.service))
-            if not ok:
-                sys.exit(1)
-        else:
-            mgr.start_all_enabled()
 
-    elif args.command == "stop":
-        ok = mgr.stop(args.service)
-        if not VERBOSE:
-            m = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-            a = "Stopped" if ok else "Failed to stop"
-            print("%s %s %s." % (m, a, args.service))
-        if not ok:
-            sys.exit(1)
+def _expand_or_exit(mgr, patterns):
+    names, unmatched = mgr.expand_units(patterns)
+    for pat in unmatched:
+        log_error("No units matched '%s'", pat)
+    if not names:
+        sys.exit(1)
+    return names, bool(unmatched)
+
 
-    elif args.command == "restart":
-        mgr.stop(args.service)
-        ok = mgr.start(args.service)
+def _lifecycle(client, args):
+    """start/stop/restart/reload over every unit and glob on the command
+    line as one transaction, with one aggregated exit code.
+    """
+    op = args.command
+    done_verb, fail_verb, past = _LIFECYCLE_VERBS[op]
+    known, missing, unmatched = client.resolve(args.service)
+    for pat in unmatched:
+        log_error("No units matched '%s'", pat)
+    for name in missing:
+        log_error("Unit %s not found.", name)
+    if not known and not missing:
+        sys.exit(1)
+    failed = list(missing)
+    total = len(known) + len(missing)
+
+    def report(name, ok):
         if not VERBOSE:
-            m = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-            a = "Restarted" if ok else "Failed to restart"
-            print("%s %s %s." % (m, a, args.service))
-        if not ok:
+            log_job(ok, done_verb, fail_verb, name)
+
+    if known:
+        results = client.run(op, known, jobs=args.jobs, on_done=report)
+        failed.extend(r.unit for r in results if not r.ok)
+    if total > 1:
+        print(
+            "%d of %d units %s%s"
+            % (
+                total - len(failed),
+                total,
+                past,
+                "; failed: %s" % " ".join(failed) if failed else "",
+            )
+        )
+    if failed or unmatched:
+        sys.exit(1)
+
+
+def _shutdown(client, args):
+    """stop --all: tear everything down within --timeout seconds."""
+    if args.service:
+        _usage_error("stop: --all does not take unit names")
+
+    def report(name, ok):
+        log_job(ok, "Stopped", "Failed to stop", name)
+
+    results = client.shutdown(timeout=args.timeout, jobs=args.jobs, on_done=report)
+    failed = sorted(r.unit for r in results if not r.ok)
+    print(
+        "%d of %d units stopped%s"
+        % (
+            len(results) - len(failed),
+            len(results),
+            "; failed: %s" % " ".join(failed) if failed else "",
+        )
+    )
+    if failed:
+        sys.exit(1)
+
+
+def _boot_background(client, args):
+    """start --background: check the enabled set, start the units with
+    X-ServicedLoginCritical= (and what they need) here, then leave the
+    rest of the boot to a process of its own that logs to BOOT_LOG_FILE,
+    so the caller can go on. BOOT_PROGRESS_FILE follows both parts, and
+    the boot lock is held by both, so no other boot runs the same starts.
+    """
+    mgr = client.manager
+    names = mgr.enabled_services()
+    if not names:
+        log_info("No enabled services.")
+        return
+    lock = StateLock("boot")
+    if not lock.hold("boot"):
+        log_info("A boot is already running, see serviced boot-status")
+        return
+    pid = None
+    try:
+        progress = BootProgress(names)
+        progress.save()
+        for name in names:
+            unit = mgr.get_unit(name)
+            if unit is None:
+                log_error("Enabled unit %s not found.", name)
+                progress.mark(name, "failed")
+            elif unit.login_critical:
+                progress.mark(name, "starting")
+                ok = mgr.start(name)
+                progress.mark(name, "done" if ok else "failed")
+                log_job(ok, "Started", "Failed to start", name)
+        left = []
+        for name in names:
+            if progress.state(name) != "pending":
+                continue
+            # Started above as a dependency: starting it again in the
+            # background would kill and restart it under the login
+            main_pid = mgr._read_pid(name)
+            st = mgr._read_status(name) or {}
+            if (main_pid and pid_exists(main_pid)) or st.get("state") == "active":
+                progress.mark(name, "done")
+            else:
+                left.append(name)
+        if not left:
+            progress.finish()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+    finally:
+        if pid != 0:
+            lock.release(done=not pid)
+    if pid:
+        log_info(
+            "Starting %d more unit(s) in the background (PID %d), "
+            "see serviced boot-status",
+            len(left),
+            pid,
+        )
+        return
+    code = 1
+    try:
+        os.setsid()
+        null = os.open(os.devnull, os.O_RDONLY)
+        out = os.open(BOOT_LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(null, 0)
+        os.dup2(out, 1)
+        os.dup2(out, 2)
+        os.close(null)
+        os.close(out)
+        progress.rec["pid"] = os.getpid()
+        progress.save()
+        lock.release(mgr.start_all_enabled(progress))
+        code = 0
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _daemon(args):
+    """'serviced daemon': serve CONTROL_SOCKET in the foreground, or with
+    --detach in a new session logging to STATE_DIR/daemon.log, returning
+    once the daemon answers.
+    """
+    if args.user:
+        _usage_error("daemon: --user is not supported")
+    if _daemon_running():
+        log_error("serviced daemon is already running on %s", CONTROL_SOCKET)
+        sys.exit(1)
+    ensure_dirs()
+    if args.detach:
+        log_path = os.path.join(STATE_DIR, "daemon.log")
+        pid = os.fork()
+        if pid:
+            deadline = time.monotonic() + 5.0
+            while time.monotonic() < deadline:
+                if _daemon_running():
+                    log_info("serviced daemon started (pid %d)", pid)
+                    return
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+                time.sleep(0.02)
+            log_error("serviced daemon did not come up, see %s", log_path)
             sys.exit(1)
+        os.setsid()
+        null = os.open(os.devnull, os.O_RDONLY)
+        out = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(null, 0)
+        os.dup2(out, 1)
+        os.dup2(out, 2)
+        os.close(null)
+        os.close(out)
+    if not Daemon().serve():
+        sys.exit(1)
+
+
+def _each(names, method, *args):
+    """Call a Client method per unit; True when none raised."""
+    ok = True
+    for name in names:
+        try:
+            method(name, *args)
+        except OperationError:
+            ok = False
+    return ok
 
-    elif args.command == "reload":
-        ok = mgr.reload(args.service)
-        if not VERBOSE:
-            m = "[\033[32m  OK  \033[0m]" if ok else "[\033[31mFAILED\033[0m]"
-            a = "Reloaded" if ok else "Failed to reload"
-            print("%s %s %s." % (m, a, args.service))
-        if not ok:
+
+def _dispatch(client, args):
+    # None for a RemoteClient, which only gets _REMOTE_COMMANDS
+    mgr = getattr(client, "manager", None)
+
+    if args.command == "start" and getattr(args, "background", False):
+        if args.service:
+            _usage_error("start: --background does not take unit names")
+        _boot_background(client, args)
+
+    elif args.command == "start" and not args.service:
+        client.boot()
+
+    elif args.command == "boot-status" or getattr(args, "boot", False):
+        if args.command == "status" and (args.service or args.all):
+            _usage_error("status: --boot does not take unit names")
+        rec = client.boot_status()
+        if rec is None:
+            log_info("No boot has been recorded.")
+            sys.exit(1)
+        if args.output == "text":
+            render_boot_status(rec)
+        else:
+            emit_records([rec], args.output)
+        failed = any(u[0] == "failed" for u in rec["units"].values())
+        if rec["state"] == "running":
+            sys.exit(3)
+        if failed or rec["state"] != "finished":
             sys.exit(1)
 
+    elif args.command == "stop" and getattr(args, "all", False):
+        _shutdown(client, args)
+
+    elif args.command == "stop" and not args.service:
+        _usage_error("stop: specify UNIT... or --all")
+
+    elif args.command in _LIFECYCLE_VERBS:
+        _lifecycle(client, args)
+
     elif args.command == "kill":
-        ok = mgr.kill_service(args.service, sig=args.signal, kill_who=args.kill_who)
-        if not ok:
+        names, partial = _expand_or_exit(mgr, args.service)
+        if not _each(names, client.kill, args.signal, args.kill_who) or partial:
             sys.exit(1)
 
     elif args.command == "cat":
-        if not mgr.cat_service(args.service):
+        recs = []
+        for svc in args.service:
+            try:
+                recs.append(client.cat(svc, effective=args.effective))
+            except UnitNotFoundError as e:
+                log_error("No files found for %s.", e.unit)
+            except OperationError:
+                pass
+        if args.output == "text":
+            for rec in recs:
+                render_cat(rec)
+        else:
+            emit_records(recs, args.output)
+        if len(recs) != len(args.service):
             sys.exit(1)
 
     elif args.command == "help":
         if not mgr.help_service(args.service):
             sys.exit(1)
 
-    elif args.command == "enable":
-        if not mgr.enable(args.service):
-            sys.exit(1)
-
-    elif args.command == "disable":
-        if not mgr.disable(args.service):
+    elif args.command in ("enable", "disable", "freeze", "thaw"):
+        names, partial = _expand_or_exit(mgr, args.service)
+        method = getattr(client, args.command)
+        if not _each(names, method) or partial:
             sys.exit(1)
 
     elif args.command == "status":
-        sys.exit(mgr.status(args.service))
+        names = client.unit_names() if args.all else args.service
+        if not names:
+            _usage_error("status: specify UNIT... or --all")
+        recs = client.statuses(names)
+        if args.output == "text":
+            for i, st in enumerate(recs):
+                if i:
+                    print()
+                render_status(st.to_dict())
+        else:
+            emit_records([st.to_dict() for st in recs], args.output)
+        codes = [st.code for st in recs]
+        sys.exit(4 if 4 in codes else 3 if any(codes) else 0)
 
     elif args.command == "log":
-        mgr.show_log(args.service, lines=args.lines)
+        name = mgr.resolve_name(args.service)
+        tail = client.log(name, lines=args.lines)
+        if args.output == "json":
+            emit_records([{"unit": name, "lines": tail or []}], args.output)
+        elif args.output == "ndjson":
+            emit_records(({"unit": name, "line": ln} for ln in tail or []), args.output)
+        elif tail is not None:
+            for line in tail:
+                print(line)
+            if not tail:
+                print("(empty log)")
+
+    elif args.command in ("events", "watch"):
+        events = client.events(args.service)
+        # units with no state yet still get a row when enabled or named
+        names = mgr.enabled_services() + [
+            mgr.resolve_name(pat)
+            for pat in args.service
+            if not any(c in pat for c in "*?[")
+        ]
+        try:
+            if args.command == "watch":
+                render_watch(events, names)
+            else:
+                emit_records(events.follow(names), "ndjson")
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        finally:
+            events.close()
+
+    elif args.command in ("list", "list-running"):
+        running_only = args.command == "list-running"
+        rows = [u.to_dict() for u in client.units(running_only)]
+        if args.output == "text":
+            render_unit_table(rows, running_only)
+        else:
+            emit_records(rows, args.output)
 
-    elif args.command == "list":
-        mgr.list_services(running_only=False)
+    elif args.command == "metrics":
+        text = client.metrics()
+        if getattr(args, "textfile", None):
+            write_metrics_textfile(args.textfile, text)
+        else:
+            sys.stdout.write(text)
 
-    elif args.command == "list-running":
-        mgr.list_services(running_only=True)
+    elif args.command == "blame":
+        if not mgr.show_blame(lines=args.lines):
+            sys.exit(1)
+
+    elif args.command == "analyze":
+        if not mgr.analyze(args.service, trace_file=args.trace, svg_file=args.svg):
+            sys.exit(1)
 
     elif args.command == "version":
         print("serviced v%s - lightweight service manager" % VERSION)